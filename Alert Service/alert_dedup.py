@@ -0,0 +1,49 @@
+import hashlib
+
+from quixstreams import State
+
+# fields identifying an alert, with the rule that raised it, the others (temperature, message) describe it
+identity_fields = ("status", "parameter_name", "timestamp")
+
+
+def fingerprint(alert: dict, rule: str = "") -> str:
+    """
+    A short fingerprint of the alert's identity and of its 'rule', stable across restarts unlike hash().
+    Alerts of different rules on the same parameter at the same time are different alerts.
+    """
+    identity = "\x1f".join([rule, *(str(alert.get(field, "")) for field in identity_fields)])
+    return hashlib.blake2b(identity.encode(), digest_size=8).hexdigest()
+
+
+class AlertDeduplicator:
+    """
+    Remembers the fingerprints of the alerts already sent, in the state of the message key, to send every alert once.
+    At most 'capacity' fingerprints are kept, for up to 'ttl_ms': they are stored in a dict in the order they were
+    added, so the oldest ones are evicted from its start and every check costs the same however long
+    the printer has been running.
+    """
+
+    state_key = "alert_fingerprints"
+
+    def __init__(self, capacity: int, ttl_ms: int):
+        self.capacity = capacity
+        self.ttl_ms = ttl_ms
+
+    def is_new(self, state: State, alert: dict, now_ms: int, rule: str = "") -> bool:
+        """
+        True if the alert of 'rule' was not seen in the last 'ttl_ms', it's remembered from now on.
+        """
+        seen = state.get(self.state_key) or {}
+        alert_fingerprint = fingerprint(alert, rule)
+        expired = now_ms - self.ttl_ms
+        if alert_fingerprint in seen:
+            if seen[alert_fingerprint] >= expired:
+                return False
+            del seen[alert_fingerprint]  # added again at the end
+
+        while seen and (len(seen) >= self.capacity or next(iter(seen.values())) < expired):
+            del seen[next(iter(seen))]
+
+        seen[alert_fingerprint] = now_ms
+        state.set(self.state_key, seen)
+        return True
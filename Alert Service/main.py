@@ -1,13 +1,16 @@
-import json
-import hashlib
-
-from quixstreams import Application, State
+from quixstreams import Application, State, message_context, message_key
+from quixstreams.state.rocksdb import RocksDBOptions
+from quixstreams.utils.json import dumps as json_dumps
 import os
 
 import logging
 from dotenv import load_dotenv
 
-from uuid import uuid4
+from alert_dedup import AlertDeduplicator
+from instrumentation import Instrumentation, exponential_buckets, sized, timed
+from rules import NORMAL, RuleEngine, load_rules
+from tracing import traced_serializer
+from wire_format import WireDeserializer, value_serializer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,112 +18,96 @@ logger = logging.getLogger(__name__)
 with open("./.env", 'a+') as file: pass  # make sure the .env file exists
 load_dotenv("./.env") # load environment variables from .env file for local dev
 
-app = Application.Quix("transformation-v1" + str(uuid4()), auto_offset_reset="latest", )
-
 forecast_topic = os.getenv("forecast_topic", "forecast")
 alerts_topic = os.getenv("alert_topic", "alerts")
+# format of the alerts, "json" or "binary"
+wire_format = os.getenv("wire_format", "json")
+
+instrumentation = Instrumentation.from_env("alerts")
+processing_seconds = instrumentation.histogram("processing_seconds", "Time to process a forecast row")
+# the keys and values are serialized by the same function, one in every 16 of them is measured
+state_bytes = instrumentation.histogram("state_bytes", "Size of the keys and values serialized to the state",
+                                        exponential_buckets(16, 2, 12))
+alerts_published = instrumentation.counter("alerts_total", "Alerts published", labels=("status",))
+duplicate_alerts = instrumentation.counter("duplicate_alerts_total", "Alerts swallowed, already sent")
 
-# Alerts definitions
-NO_ALERT = "no-alert"
-UNDER_FORECAST = "under-forecast"
-OVER_FORECAST = "over-forecast"
-UNDER_NOW = "under-now"
-OVER_NOW = "over-now"
-PRINTER_FINISHED = "printer-finished"
+# the default serialization of the state, with the size of the values written
+rocksdb_options = RocksDBOptions(dumps=sized(json_dumps, state_bytes, 16))
 
-low_threshold = 73
-high_threshold = 75
+# the alert rules, as a JSON list or the path of a JSON file, see the README
+rule_engine = RuleEngine(load_rules(os.getenv("alert_rules")))
 
-def hash_json(json_obj):
-    json_str = json.dumps(json_obj, sort_keys=True)  # Convert to string and sort keys for consistency
-    return hashlib.sha256(json_str.encode()).hexdigest()  # Hash the string and get the hexadecimal representation
+# alerts already sent are remembered per printer, up to 'dedup_capacity' of them for 'dedup_ttl_seconds'
+deduplicator = AlertDeduplicator(int(os.getenv("dedup_capacity", "1000")),
+                                 int(os.getenv("dedup_ttl_seconds", "86400")) * 1000)
 
 
 def on_forecast_received(message: dict, state: State):
     """
-    This looks more complicated than it is.
-    We are creating an alert_status object if the incoming message has a temperature < or > the alert temp.
-    Create a hash for the created alert_status object.
-    Then check to see if we have already handled a message with the same hash.
-    If not then return it for publishing to the output topic.
-    If yes then swallow it.
-    
+    The forecasts are keyed by printer, so the state is per printer and a printer's alerts
+    never interfere with another's.
+    The rows of a forecast (its horizon) are kept in state until its last one is received,
+    then all the alert rules are evaluated over the whole horizon at once.
+    Only the columns the rules read are kept, with the state of every rule to alert only when it enters an alert state.
+    Alerts already sent by the same rule, with the same status, parameter and timestamp, are swallowed.
+    Returns the list of alerts to publish.
+    """
+    index = message.get("forecast_index", 0)
+    length = message.get("forecast_length", 1)
+
+    horizon = [] if index == 0 else state.get("horizon", [])
+    horizon.append(rule_engine.compact(message))
+    if index < length - 1:
+        state.set("horizon", horizon)  # wait for the rest of the forecast
+        return []
+    state.delete("horizon")
+
+    rule_states = state.get("rule_states")
+    if rule_states is None or len(rule_states) != len(rule_engine.rules):
+        rule_states = [NORMAL] * len(rule_engine.rules)  # first forecast, or the rules changed
+
+    rule_states, triggered = rule_engine.evaluate(horizon, rule_states, state.get("previous_row"))
+    state.set("rule_states", rule_states)  # store the updated rule states in state for use next time
+    state.set("previous_row", horizon[0])
+
+    alerts = []
+    now = message_context().timestamp.milliseconds
+    printer = message.get("printer") or message_key().decode()
+    for rule_index, rule_state, step, signal in triggered:
+        alert = rule_engine.to_alert(horizon, rule_index, rule_state, step, signal)
+        alert["printer"] = printer
+        if deduplicator.is_new(state, alert, now, rule_engine.rules[rule_index].key):
+            logger.info(f"Publishing: {alert}")
+            alerts_published.labels(alert["status"]).inc()
+            alerts.append(alert)
+        else:
+            duplicate_alerts.inc()
+    return alerts
+
+
+def build_pipeline(app: Application):
+    """
+    The topics and the streaming dataframe of the service, on 'app'.
     """
-
-    alert_status = state.get("alert_status", 
-                             {  "status": NO_ALERT,
-                                "parameter_name": "",
-                                "alert_temperature": 0,
-                                "timestamp": "",
-                                "message": ""
-                             })
-    
-    forecast = message["forecast"]
-
-    if forecast <= low_threshold and not forecast >= high_threshold:
-        if forecast < low_threshold and alert_status["status"] != UNDER_FORECAST:
-            alert_status = {
-                "status": UNDER_FORECAST,
-                "parameter_name": "ambient_temperature",
-                "alert_temperature": forecast,
-                "timestamp": message["timestamp"],
-                "message": f"'Ambient temperature' is forecasted to fall below {low_threshold}ºC at {message['timestamp']}."
-            }
-            #break
-        elif forecast > high_threshold and alert_status["status"] != OVER_FORECAST:
-            alert_status = {
-                "status": OVER_FORECAST,
-                "parameter_name": "ambient_temperature",
-                "alert_temperature": forecast,
-                "timestamp": message["timestamp"],
-                "message": f"'Ambient temperature' is forecasted to go over {high_threshold}ºC at {message['timestamp']}."
-            }
-                #break
-    else:
-        alert_status = {
-            "status": NO_ALERT,
-            "parameter_name": "ambient_temperature",
-            "timestamp": message["timestamp"],
-            "message": f"'Ambient temperature' is within specified parameters."
-        }
-
-    state.set("alert_status", alert_status)  # store the updated alert status in state for use next time
-
-    alert_hash = hash_json(alert_status)  # calculate the unique hash of this alert, to avoid sending the same alert twice
-    past_alerts = state.get("past_alerts", [])  # get the past alerts from state
-    if past_alerts == None: past_alerts = []  # 
-
-    if (alert_hash not in past_alerts and alert_status != {} and 
-        alert_status['status'] in [UNDER_NOW, UNDER_FORECAST, OVER_NOW, OVER_FORECAST]):
-        past_alerts.append(alert_hash)
-        state.set("past_alerts", past_alerts)
-        logger.info(f"Publishing: {alert_status}")
-        return alert_status
-
-
-def main():
-    # Quix platform injects credentials automatically to the client.
-    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
-    # Or set the relevant values in a .env file
-    app = Application.Quix("transformation", auto_offset_reset="earliest", use_changelog_topics=False)
-
     # Open the topics for input and output of data
-    input_topic = app.topic(forecast_topic, value_deserializer="json")
-    producer_topic = app.topic(alerts_topic, value_serializer="json")
+    # the forecasts are read in JSON or binary, by the header of every message
+    # the alerts carry the trace of the last row of the forecast
+    input_topic = app.topic(forecast_topic, value_deserializer=WireDeserializer())
+    producer_topic = app.topic(alerts_topic,
+                               value_serializer=traced_serializer(value_serializer(wire_format), "alerts"))
 
     sdf = app.dataframe(input_topic)  # initialize the streaming dataframe
 
     sdf = sdf[sdf.contains("timestamp")]  # filter out imbound data without this column
-    sdf = sdf.apply(on_forecast_received, stateful=True)  # perform a stateful operation on each row using a function
+    # perform a stateful operation on each row using a function
+    # it returns no alert for most rows, and a row per alert created for the inbound data otherwise
+    sdf = sdf.apply(timed(on_forecast_received, processing_seconds), stateful=True, expand=True)
 
-    # filter any rows that have no data
-    # these are rows where there is no alert created for the inbound data
-    sdf = sdf.filter(lambda row: row is not None)
-    
 
     # the outbound data will look like this:
     # {
     #   "status": "under-forecast",
+    #   "printer": "Printer 1",
     #   "parameter_name": "ambient_temperature",
     #   "alert_temperature": 50.02194179087244,
     #   "timestamp": "2024-03-01 14:45:20",
@@ -128,6 +115,17 @@ def main():
     # }
     
     sdf = sdf.to_topic(producer_topic)  # publish to the desired output topic 
+    return sdf
+
+
+def main():
+    # Quix platform injects credentials automatically to the client.
+    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
+    # Or set the relevant values in a .env file
+    app = Application.Quix("transformation", auto_offset_reset="earliest", use_changelog_topics=False,
+                           rocksdb_options=rocksdb_options, consumer_extra_config=instrumentation.consumer_config())
+    sdf = build_pipeline(app)
+    instrumentation.start()
  
     try:
         app.run(sdf)
@@ -0,0 +1,232 @@
+import json
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+# Alerts definitions
+NO_ALERT = "no-alert"
+UNDER_FORECAST = "under-forecast"
+OVER_FORECAST = "over-forecast"
+UNDER_NOW = "under-now"
+OVER_NOW = "over-now"
+FALLING_FORECAST = "falling-forecast"
+RISING_FORECAST = "rising-forecast"
+FALLING_NOW = "falling-now"
+RISING_NOW = "rising-now"
+PRINTER_FINISHED = "printer-finished"
+
+# rule state, kept per rule and printer
+NORMAL = 0
+UNDER = -1
+OVER = 1
+
+# alerts for the under and over states of every kind of rule and source
+statuses = {
+    ("threshold", "forecast"): (UNDER_FORECAST, OVER_FORECAST),
+    ("threshold", "now"): (UNDER_NOW, OVER_NOW),
+    ("rate", "forecast"): (FALLING_FORECAST, RISING_FORECAST),
+    ("rate", "now"): (FALLING_NOW, RISING_NOW),
+}
+
+# the rule of the original service: the forecast of the ambient temperature must stay between 73 and 75ºC
+# the rules on the current values, and the rate rules, are added with the rules config
+default_rules = [
+    {"type": "threshold", "source": "forecast", "parameter": "mean_fluctuated_ambient_temperature",
+     "parameter_name": "ambient_temperature", "label": "Ambient temperature", "low": 73, "high": 75},
+]
+
+
+class Rule(NamedTuple):
+    """
+    A rule alerts when a signal goes under 'low' or over 'high', and goes back to normal once the whole signal
+    is back past the limit by 'hysteresis'. The signal is the forecast of the parameter or its current value
+    ("source") for "threshold" rules, and their rate of change per minute for "rate" rules.
+    """
+    type: str
+    source: str
+    parameter: str
+    parameter_name: str
+    label: str
+    low: float
+    high: float
+    hysteresis: float
+    unit: str
+
+    @property
+    def key(self) -> str:
+        """
+        The identity of the rule, which stays the same when the other rules change.
+        """
+        return f"{self.type}/{self.source}/{self.parameter}/{self.low:g}/{self.high:g}"
+
+
+def parse_rules(config: List[dict]) -> List[Rule]:
+    rules = []
+    for rule in config:
+        rule_type = rule.get("type", "threshold")
+        source = rule.get("source", "forecast")
+        if (rule_type, source) not in statuses:
+            raise ValueError(f"Unknown alert rule type '{rule_type}' or source '{source}' in {rule}")
+
+        if rule_type == "rate":
+            low = -rule.get("max_fall_per_minute", np.inf)
+            high = rule.get("max_rise_per_minute", np.inf)
+            unit = "ºC/min"
+        else:
+            low = rule.get("low", -np.inf)
+            high = rule.get("high", np.inf)
+            unit = "ºC"
+
+        parameter = rule["parameter"]
+        rules.append(Rule(rule_type, source, parameter, rule.get("parameter_name", parameter),
+                          rule.get("label", parameter), float(low), float(high), float(rule.get("hysteresis", 0)),
+                          unit))
+    return rules
+
+
+def load_rules(value: Optional[str]) -> List[Rule]:
+    """
+    Load the rules from a JSON list, or the path of a JSON file with the list, or use the default rules.
+    """
+    if not value:
+        return parse_rules(default_rules)
+    if not value.lstrip().startswith("["):
+        with open(value) as file:
+            value = file.read()
+    return parse_rules(json.loads(value))
+
+
+def parse_minutes(timestamp) -> float:
+    """
+    Minutes since the epoch of a timestamp in milliseconds or a "2024-03-01 14:45:20" string.
+    """
+    if isinstance(timestamp, (int, float)):
+        return timestamp / 60000
+    return datetime.fromisoformat(timestamp).timestamp() / 60
+
+
+class RuleEngine:
+    """
+    Evaluates all the rules over a whole forecast horizon (the rows of one forecast) at once.
+    The rules are compiled into arrays of limits, the signals of all the rules into one matrix
+    (a row per rule, a column per step, NaN where a rule has no value), and the state machine of every rule
+    moves in one vectorized pass per horizon:
+    a rule in the normal state alerts at the first step under or over its limits and enters that state,
+    and goes back to normal once every step is back within its limits by the hysteresis.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self.low = np.array([rule.low for rule in rules])
+        self.high = np.array([rule.high for rule in rules])
+        self.hysteresis = np.array([rule.hysteresis for rule in rules])
+        self._forecast_rules = [i for i, rule in enumerate(rules) if rule.source == "forecast"]
+        self._now_rules = [i for i, rule in enumerate(rules) if rule.source == "now"]
+        # the columns of a forecast row the rules read
+        sources = {"forecast": "forecast", "now": "current"}
+        self.columns = ["timestamp", *sorted({f"{sources[rule.source]}_{rule.parameter}" for rule in rules})]
+
+    def compact(self, row: dict) -> dict:
+        """
+        Only the columns of the row the rules read, to keep in state.
+        """
+        return {column: row[column] for column in self.columns if column in row}
+
+    def signals(self, horizon: List[dict], previous: Optional[dict]) -> np.ndarray:
+        """
+        The signal of every rule over the horizon. 'previous' is the row the last horizon started with,
+        for the rate of the current values.
+        """
+        steps = len(horizon)
+        signals = np.full((len(self.rules), steps), np.nan)
+        minutes = np.array([parse_minutes(row["timestamp"]) for row in horizon])
+
+        for i in self._forecast_rules:
+            rule = self.rules[i]
+            values = np.array([row.get(f"forecast_{rule.parameter}", np.nan) for row in horizon], dtype=float)
+            if rule.type == "rate":
+                signals[i, 1:] = np.diff(values) / np.diff(minutes)
+            else:
+                signals[i] = values
+
+        for i in self._now_rules:
+            rule = self.rules[i]
+            value = horizon[0].get(f"current_{rule.parameter}", np.nan)
+            if rule.type == "rate":
+                if previous is not None and f"current_{rule.parameter}" in previous:
+                    elapsed = parse_minutes(horizon[0]["timestamp"]) - parse_minutes(previous["timestamp"])
+                    if elapsed > 0:
+                        signals[i, 0] = (value - previous[f"current_{rule.parameter}"]) / elapsed
+            else:
+                signals[i, 0] = value
+        return signals
+
+    def evaluate(self, horizon: List[dict], rule_states: List[int], previous: Optional[dict] = None):
+        """
+        Move the state machine of every rule with the horizon.
+        Returns the new states and the alerts as (rule index, state, step, signal value) tuples.
+        """
+        signals = self.signals(horizon, previous)
+        states = np.array(rule_states, dtype=int)
+        with np.errstate(invalid="ignore"):
+            under = signals < self.low[:, None]
+            over = signals > self.high[:, None]
+            back_from_under = np.all(np.isnan(signals) | (signals >= (self.low + self.hysteresis)[:, None]), axis=1)
+            back_from_over = np.all(np.isnan(signals) | (signals <= (self.high - self.hysteresis)[:, None]), axis=1)
+
+        steps = signals.shape[1]
+        first_under = np.where(under.any(axis=1), under.argmax(axis=1), steps)
+        first_over = np.where(over.any(axis=1), over.argmax(axis=1), steps)
+
+        # the first crossing of the horizon decides, if it's a new state
+        goes_under = (first_under < first_over) & (states != UNDER)
+        goes_over = (first_over < first_under) & (states != OVER)
+        new_states = np.where(goes_under, UNDER, np.where(goes_over, OVER, states))
+        new_states = np.where((new_states == UNDER) & ~goes_under & back_from_under & (first_over == steps),
+                              NORMAL, new_states)
+        new_states = np.where((new_states == OVER) & ~goes_over & back_from_over & (first_under == steps),
+                              NORMAL, new_states)
+
+        alerts = []
+        for i in np.flatnonzero(goes_under | goes_over):
+            step = int(first_under[i] if goes_under[i] else first_over[i])
+            alerts.append((int(i), int(new_states[i]), step, float(signals[i, step])))
+        return new_states.tolist(), alerts
+
+    def to_alert(self, horizon: List[dict], rule_index: int, state: int, step: int, signal: float) -> dict:
+        """
+        The alert message, like the ones of the original service.
+        """
+        rule = self.rules[rule_index]
+        status = statuses[(rule.type, rule.source)][0 if state == UNDER else 1]
+        row = horizon[step]
+        timestamp = row["timestamp"]
+        value = row.get(f"{'forecast' if rule.source == 'forecast' else 'current'}_{rule.parameter}", signal)
+
+        if rule.type == "rate":
+            limit = -rule.low if state == UNDER else rule.high
+            if rule.source == "forecast":
+                change = "is forecasted to fall" if state == UNDER else "is forecasted to rise"
+            else:
+                change = "is falling" if state == UNDER else "is rising"
+            message = f"'{rule.label}' {change} faster than {limit:g}{rule.unit} at {timestamp}."
+        else:
+            limit = rule.low if state == UNDER else rule.high
+            if rule.source == "forecast":
+                change = "fall below" if state == UNDER else "go over"
+                message = f"'{rule.label}' is forecasted to {change} {limit:g}{rule.unit} at {timestamp}."
+            else:
+                change = "below" if state == UNDER else "over"
+                message = f"'{rule.label}' is {change} {limit:g}{rule.unit} at {timestamp}."
+
+        alert = {
+            "status": status,
+            "parameter_name": rule.parameter_name,
+            "alert_temperature": value,
+            "timestamp": timestamp,
+            "message": message
+        }
+        if rule.type == "rate":
+            alert["rate"] = signal
+        return alert
@@ -0,0 +1,243 @@
+"""
+Compact binary format of the messages between the services, next to JSON.
+
+A binary message is a flat row: the version byte, the length of the descriptor, the descriptor, which has the type
+and id of every field, then the fields packed with struct (little-endian, the strings as their length)
+followed by the UTF-8 bytes of the strings. Field names are replaced by their one byte id in 'field_names',
+a name that isn't there is written in full in the descriptor. Rows with the same fields and types
+have the same descriptor, its layout is compiled once for every descriptor seen.
+
+Messages carry their format in the 'wire_format' header. The deserializer reads both formats, and messages without
+the header (from producers not migrated yet) are read as JSON, so consumers are migrated first,
+then the producers switch to "binary".
+
+This module is the same in every service, a change to one copy goes to all of them.
+"""
+import numbers
+import struct
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from quixstreams.models.serializers import Deserializer, SerializationContext, SerializationError, Serializer
+from quixstreams.utils.json import loads as json_loads
+
+WIRE_FORMAT_HEADER = "wire_format"
+JSON = "json"
+BINARY_V1 = "binary-v1"
+
+_version = b"\xb1"  # first byte of a binary message, never the first byte of JSON
+_descriptor_length = struct.Struct("<H")
+
+_sensor_fields = ("hotend_temperature", "bed_temperature", "ambient_temperature", "fluctuated_ambient_temperature")
+_aggregates = ("sum", "mean", "min", "max", "count", "variance", "stddev")
+_aggregated_fields = tuple(f"{aggregate}_{field}" for field in _sensor_fields for aggregate in _aggregates)
+
+# the field ids of version 1, from 1. Append only: an id must keep its name for as long as messages use it
+field_names = (
+    "timestamp", "original_timestamp", "printer", "resolution", "count", "final",
+    "forecast", "forecast_index", "forecast_length",
+    "status", "parameter_name", "alert_temperature", "message", "rate",
+    *_sensor_fields,
+    *_aggregated_fields,
+    *(f"forecast_{field}" for field in _aggregated_fields),
+    *(f"current_{field}" for field in _aggregated_fields),
+)
+_field_ids = {name: i + 1 for i, name in enumerate(field_names)}  # 0 means the name follows in the descriptor
+
+# type codes of the descriptor and their struct format, the strings are packed as their length and null takes no space
+_type_codes = {float: b"d", int: b"q", bool: b"?", str: b"s", type(None): b"n"}
+_struct_formats = {ord("d"): "d", ord("q"): "q", ord("?"): "?", ord("s"): "H", ord("n"): ""}
+
+
+class _Layout(NamedTuple):
+    names: Tuple[str, ...]  # of the packed fields, the nulls aren't packed
+    nulls: Tuple[str, ...]
+    struct: struct.Struct
+    strings: Tuple[int, ...]  # indexes of the packed fields that are strings
+    packed: Optional[Tuple[int, ...]]  # indexes of the row values that are packed, None if they all are
+    prefix: bytes  # version, descriptor length and descriptor
+
+
+def _type_code(value: Any) -> bytes:
+    code = _type_codes.get(type(value))
+    if code is not None:
+        return code
+    # subclasses, like the numpy scalars
+    if isinstance(value, bool):
+        return b"?"
+    if isinstance(value, numbers.Integral):
+        return b"q"
+    if isinstance(value, numbers.Real):
+        return b"d"
+    if isinstance(value, str):
+        return b"s"
+    raise TypeError(f"Type {type(value).__name__} of {value!r} can't be written in the binary wire format")
+
+
+def encode_descriptor(fields: Sequence[Tuple[str, bytes]]) -> bytes:
+    """
+    The version, descriptor length and descriptor of a row with these (name, type code) fields.
+    """
+    descriptor = []
+    for name, code in fields:
+        field_id = _field_ids.get(name, 0)
+        descriptor.append(code + bytes((field_id,)))
+        if not field_id:
+            encoded_name = name.encode()
+            descriptor.append(bytes((len(encoded_name),)) + encoded_name)
+    descriptor = b"".join(descriptor)
+    return _version + _descriptor_length.pack(len(descriptor)) + descriptor
+
+
+def _compile(names: Sequence[str], codes: Sequence[int], prefix: bytes) -> _Layout:
+    packed = [i for i, code in enumerate(codes) if code != ord("n")]
+    packed_codes = [codes[i] for i in packed]
+    return _Layout(
+        names=tuple(names[i] for i in packed),
+        nulls=tuple(name for name, code in zip(names, codes) if code == ord("n")),
+        struct=struct.Struct("<" + "".join(_struct_formats[code] for code in packed_codes)),
+        strings=tuple(i for i, code in enumerate(packed_codes) if code == ord("s")),
+        packed=tuple(packed) if len(packed) < len(codes) else None,
+        prefix=prefix,
+    )
+
+
+class BinaryEncoder:
+    """
+    Encodes rows in the binary format, with the layout of their fields and types compiled once.
+    """
+
+    def __init__(self):
+        self._layouts: Dict[tuple, _Layout] = {}
+
+    def encode(self, row: Mapping[str, Any]) -> bytes:
+        values = list(row.values())
+        key = (tuple(row), tuple(map(type, values)))
+        layout = self._layouts.get(key)
+        if layout is None:
+            names = list(row)
+            codes = [_type_code(value) for value in values]
+            layout = self._layouts[key] = _compile(names, [code[0] for code in codes],
+                                                   encode_descriptor(list(zip(names, codes))))
+
+        if layout.packed is not None:
+            values = [values[i] for i in layout.packed]
+        strings = []
+        for i in layout.strings:
+            encoded = values[i].encode()
+            strings.append(encoded)
+            values[i] = len(encoded)
+        return b"".join((layout.prefix, layout.struct.pack(*values), *strings))
+
+
+class BinaryDecoder:
+    """
+    Decodes the rows of the binary format, with the layout of every descriptor compiled once.
+    """
+
+    def __init__(self):
+        self._layouts: Dict[bytes, _Layout] = {}
+
+    def decode(self, data: bytes) -> dict:
+        """
+        The row of a binary message, the floats, integers, booleans, strings and nulls are read as written.
+        """
+        if data[:1] != _version:
+            raise ValueError(f"Unsupported binary wire format version {data[:1]!r}")
+        start = 3 + _descriptor_length.unpack_from(data, 1)[0]
+        descriptor = data[3:start]
+        layout = self._layouts.get(descriptor)
+        if layout is None:
+            layout = self._layouts[descriptor] = self._compile(descriptor)
+
+        values = layout.struct.unpack_from(data, start)
+        if layout.strings:
+            values = list(values)
+            offset = start + layout.struct.size
+            for i in layout.strings:
+                end = offset + values[i]
+                values[i] = data[offset:end].decode()
+                offset = end
+        row = dict(zip(layout.names, values))
+        for name in layout.nulls:
+            row[name] = None
+        return row
+
+    @staticmethod
+    def _compile(descriptor: bytes) -> _Layout:
+        names: List[str] = []
+        codes: List[int] = []
+        i = 0
+        while i < len(descriptor):
+            code, field_id = descriptor[i], descriptor[i + 1]
+            i += 2
+            if field_id:
+                names.append(field_names[field_id - 1])
+            else:
+                name_length = descriptor[i]
+                names.append(descriptor[i + 1:i + 1 + name_length].decode())
+                i += 1 + name_length
+            if code not in _struct_formats:
+                raise ValueError(f"Unknown type code {chr(code)!r} of the field '{names[-1]}'")
+            codes.append(code)
+        return _compile(names, codes, b"")
+
+
+def wire_format(headers) -> Optional[str]:
+    """
+    The format in the 'wire_format' header of a message, None without it.
+    """
+    for name, value in headers or ():
+        if name == WIRE_FORMAT_HEADER:
+            return value.decode() if isinstance(value, bytes) else value
+    return None
+
+
+class WireSerializer(Serializer):
+    """
+    Serializes rows in the binary format, with its 'wire_format' header.
+    """
+
+    def __init__(self):
+        self._encoder = BinaryEncoder()
+
+    @property
+    def extra_headers(self) -> Dict[str, str]:
+        return {WIRE_FORMAT_HEADER: BINARY_V1}
+
+    def __call__(self, value: Mapping[str, Any], ctx: SerializationContext) -> bytes:
+        try:
+            return self._encoder.encode(value)
+        except (AttributeError, TypeError, ValueError, struct.error) as exc:
+            raise SerializationError(str(exc)) from exc
+
+
+class WireDeserializer(Deserializer):
+    """
+    Deserializes the messages of both formats, by their 'wire_format' header. Messages without it are JSON.
+    """
+
+    def __init__(self, column_name: Optional[str] = None):
+        super().__init__(column_name=column_name)
+        self._decoder = BinaryDecoder()
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> Any:
+        message_format = wire_format(ctx.headers)
+        try:
+            if message_format == BINARY_V1:
+                return self._to_dict(self._decoder.decode(value))
+            if message_format is None or message_format == JSON:
+                return self._to_dict(json_loads(value))
+        except (IndexError, TypeError, ValueError, UnicodeDecodeError, struct.error) as exc:
+            raise SerializationError(str(exc)) from exc
+        raise SerializationError(f"Unsupported wire format '{message_format}'")
+
+
+def value_serializer(name: str):
+    """
+    The value serializer of an output topic: "json" or "binary".
+    """
+    if name == "json":
+        return "json"
+    if name == "binary":
+        return WireSerializer()
+    raise ValueError(f"Unknown wire format '{name}', expected json or binary")
@@ -0,0 +1,144 @@
+import math
+from array import array
+from typing import Any, List, NamedTuple, Sequence
+
+from quixstreams.utils.json import dumps as json_dumps, loads as json_loads
+
+NORMAL = 0
+UNDER = 1
+OVER = 2
+
+statuses = {UNDER: "under-anomaly", OVER: "over-anomaly"}
+
+# the record of a printer is the sample count followed by these values for every field
+_MEAN, _VARIANCE, _RISES, _FALLS, _STATE, _OUTLIERS = range(6)
+_slots = 6
+
+# Packed records are stored in state as this byte followed by the record, any other value as JSON
+_packed_marker = b"\x00"
+
+
+def state_dumps(value: Any) -> bytes:
+    """
+    Serializer of the state store: bytes (packed records) are stored as they are, behind a marker byte
+    JSON never starts with, everything else (the state keys) as JSON.
+    It mirrors the serializer of the Down-sampling's packed windows in its aggregations.py, the services can't import
+    each other's modules. Unlike wire_format.py, the copies don't have to stay the same, every service only reads
+    its own state.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return _packed_marker + value
+    return json_dumps(value)
+
+
+def state_loads(data: bytes) -> Any:
+    if data[:1] == _packed_marker:
+        return data[1:]
+    return json_loads(data)
+
+
+class Anomaly(NamedTuple):
+    field: int  # index in the fields of the detector
+    state: int  # UNDER or OVER
+    value: float
+    mean: float
+    zscore: float
+
+
+class AnomalyDetector:
+    """
+    Detects the anomalies of 'fields' in the samples of a printer, one sample at a time, in constant time and memory.
+
+    Every field has an exponentially weighted moving average and variance of its samples (with weight 'alpha',
+    or the plain mean and variance of Welford's algorithm until there are 1 / 'alpha' samples), so the z-score of
+    a sample is its distance to the recent average, in standard deviations. A field enters an anomaly, under or
+    over its average, when the z-score of a sample is past 'z_threshold', for sudden changes, or when a two-sided
+    CUSUM of the z-scores (the sum of their excess over 'cusum_slack') is past 'cusum_threshold', for smaller
+    shifts that last. It's back to normal once the CUSUM of its direction, capped at 'cusum_threshold' during
+    the anomaly, is back to 0, so an anomaly is reported once and not again while it fades.
+
+    Samples past 'z_threshold' are outliers, they don't update the average and variance. After 'relearn_samples'
+    outliers in a row, the samples are a new level rather than an anomaly and the average starts over from it.
+    Nothing is detected in the first 'warmup_samples' of a printer.
+
+    The state of a printer is a packed record of float64: its sample count, then the average, variance,
+    both sums, state and outliers in a row of every field.
+    """
+
+    state_key = "detector"
+
+    def __init__(self, fields: Sequence[str], alpha: float, z_threshold: float, cusum_slack: float,
+                 cusum_threshold: float, warmup_samples: int, relearn_samples: int):
+        self.fields = list(fields)
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.cusum_slack = cusum_slack
+        self.cusum_threshold = cusum_threshold
+        self.warmup_samples = warmup_samples
+        self.relearn_samples = relearn_samples
+
+    def process(self, values: Sequence[float], state) -> List[Anomaly]:
+        """
+        Add the values of a sample (in the order of the fields) to the statistics of the printer in 'state'.
+        Returns the anomalies the sample starts.
+        """
+        packed = state.get(self.state_key)
+        record = array("d")
+        if packed is None:
+            record.extend([0.0] * (1 + _slots * len(self.fields)))
+        else:
+            record.frombytes(packed)
+
+        anomalies = self.update(record, values)
+        state.set(self.state_key, record.tobytes())
+        return anomalies
+
+    def update(self, record: array, values: Sequence[float]) -> List[Anomaly]:
+        count = record[0] + 1
+        record[0] = count
+        alpha = max(self.alpha, 1 / count)
+        detecting = count > self.warmup_samples
+        z_threshold = self.z_threshold
+        slack = self.cusum_slack
+        cusum_threshold = self.cusum_threshold
+        anomalies = []
+
+        for i, value in enumerate(values):
+            base = 1 + i * _slots
+            mean, variance, rises, falls, field_state, outliers = record[base:base + _slots]
+            deviation = value - mean
+            std = math.sqrt(variance)
+            zscore = deviation / std if std > 0 else 0.0
+
+            if detecting:
+                rises = max(0.0, rises + zscore - slack)
+                falls = max(0.0, falls - zscore - slack)
+                if field_state == NORMAL:
+                    if zscore <= -z_threshold or falls > cusum_threshold:
+                        field_state, rises, falls = UNDER, 0.0, cusum_threshold
+                        anomalies.append(Anomaly(i, UNDER, value, mean, zscore))
+                    elif zscore >= z_threshold or rises > cusum_threshold:
+                        field_state, rises, falls = OVER, cusum_threshold, 0.0
+                        anomalies.append(Anomaly(i, OVER, value, mean, zscore))
+                elif field_state == UNDER:
+                    falls = min(falls, cusum_threshold)
+                    if falls == 0.0:
+                        field_state = NORMAL
+                else:
+                    rises = min(rises, cusum_threshold)
+                    if rises == 0.0:
+                        field_state = NORMAL
+
+            if detecting and abs(zscore) > z_threshold:
+                outliers += 1
+                if outliers >= self.relearn_samples:
+                    mean, outliers = value, 0.0
+            else:
+                # the exponentially weighted mean and variance, Welford's while alpha is 1 / count
+                increment = alpha * deviation
+                mean += increment
+                variance = (1 - alpha) * (variance + deviation * increment)
+                outliers = 0.0
+
+            record[base:base + _slots] = array("d", (mean, variance, rises, falls, field_state, outliers))
+        return anomalies
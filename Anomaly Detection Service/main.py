@@ -0,0 +1,128 @@
+from quixstreams import Application, State, message_context
+from quixstreams.state.rocksdb import RocksDBOptions
+import os
+
+import logging
+from dotenv import load_dotenv
+
+from detectors import UNDER, AnomalyDetector, statuses, state_dumps, state_loads
+from instrumentation import Instrumentation, exponential_buckets, sized, timed
+from tracing import traced_serializer
+from wire_format import WireDeserializer, value_serializer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+with open("./.env", 'a+') as file: pass  # make sure the .env file exists
+load_dotenv("./.env") # load environment variables from .env file for local dev
+
+input_topic_name = os.getenv("input", "3d-printer-data-json")
+alerts_topic = os.getenv("alert_topic", "alerts")
+# format of the alerts, "json" or "binary"
+wire_format = os.getenv("wire_format", "json")
+
+instrumentation = Instrumentation.from_env("anomalies")
+processing_seconds = instrumentation.histogram("processing_seconds", "Time to process a sample")
+# the keys and values are serialized by the same function, one in every 16 of them is measured
+state_bytes = instrumentation.histogram("state_bytes", "Size of the keys and values serialized to the state",
+                                        exponential_buckets(16, 2, 12))
+anomalies_published = instrumentation.counter("anomalies_total", "Anomalies published",
+                                              labels=("parameter_name", "status"))
+
+# The statistics of every printer are a packed record in state, stored as it is by 'state_dumps'
+rocksdb_options = RocksDBOptions(dumps=sized(state_dumps, state_bytes, 16), loads=state_loads)
+
+# the fields checked for anomalies, see the README for the parameters of the detector
+fields = [field.strip() for field in os.getenv("fields", "hotend_temperature,bed_temperature").split(",")
+          if field.strip()]
+detector = AnomalyDetector(fields,
+                           alpha=float(os.getenv("ewma_alpha", "0.01")),
+                           z_threshold=float(os.getenv("z_threshold", "5")),
+                           cusum_slack=float(os.getenv("cusum_slack", "1")),
+                           cusum_threshold=float(os.getenv("cusum_threshold", "8")),
+                           warmup_samples=int(os.getenv("warmup_samples", "60")),
+                           relearn_samples=int(os.getenv("relearn_samples", "300")))
+labels = [field.replace("_", " ").capitalize() for field in fields]
+
+
+def on_sample_received(message: dict, state: State):
+    """
+    The samples are keyed by printer, so the statistics are per printer.
+    Every sample updates them and is checked against them as soon as it's received, unlike the alerts
+    of the Alert Service, which are raised on forecasts of the down-sampled data.
+    Returns an alert per anomaly the sample starts, in the format of the Alert Service's.
+    """
+    alerts = []
+    for anomaly in detector.process([message[field] for field in fields], state):
+        field = fields[anomaly.field]
+        status = statuses[anomaly.state]
+        direction = "below" if anomaly.state == UNDER else "above"
+        timestamp = message.get("timestamp")
+        if abs(anomaly.zscore) >= detector.z_threshold:
+            change = f"is {abs(anomaly.zscore):.1f} standard deviations {direction}"
+        else:
+            change = f"has shifted {direction}"  # found by the CUSUM
+        alert = {
+            "status": status,
+            "printer": message.get("printer") or message_context().key.decode(),
+            "parameter_name": field,
+            "alert_temperature": anomaly.value,
+            "timestamp": timestamp,
+            "message": f"'{labels[anomaly.field]}' {change} its recent average of {anomaly.mean:.1f}ºC at {timestamp}.",
+            "zscore": anomaly.zscore,
+        }
+        logger.info(f"Publishing: {alert}")
+        anomalies_published.labels(field, status).inc()
+        alerts.append(alert)
+    return alerts
+
+
+def build_pipeline(app: Application):
+    """
+    The topics and the streaming dataframe of the service, on 'app'.
+    """
+    # Open the topics for input and output of data
+    # the samples are read in JSON or binary, by the header of every message
+    # the alerts carry the trace of the sample they were raised on
+    input_topic = app.topic(input_topic_name, value_deserializer=WireDeserializer())
+    producer_topic = app.topic(alerts_topic,
+                               value_serializer=traced_serializer(value_serializer(wire_format), "anomalies"))
+
+    sdf = app.dataframe(input_topic)  # initialize the streaming dataframe
+    # only the samples with every field checked
+    sdf = sdf.filter(lambda value: all(value.get(field) is not None for field in fields))
+    # it returns no alert for most samples, and a row per anomaly started by the sample otherwise
+    sdf = sdf.apply(timed(on_sample_received, processing_seconds), stateful=True, expand=True)
+
+    # the outbound data will look like this:
+    # {
+    #   "status": "under-anomaly",
+    #   "printer": "Printer 1",
+    #   "parameter_name": "hotend_temperature",
+    #   "alert_temperature": 241.3912350132124,
+    #   "timestamp": "2024-03-01T14:45:20",
+    #   "message": "'Hotend temperature' is 17.6 standard deviations below its recent average of 250.0ºC at ...",
+    #   "zscore": -17.6254810392451
+    # }
+
+    sdf = sdf.to_topic(producer_topic)  # publish to the alerts topic, with the alerts of the Alert Service
+    return sdf
+
+
+def main():
+    # Quix platform injects credentials automatically to the client.
+    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
+    # Or set the relevant values in a .env file
+    app = Application.Quix("anomaly-detection", auto_offset_reset="latest", use_changelog_topics=False,
+                           rocksdb_options=rocksdb_options, consumer_extra_config=instrumentation.consumer_config())
+    sdf = build_pipeline(app)
+    instrumentation.start()
+
+    try:
+        app.run(sdf)
+    except Exception as e:
+        logger.exception("An error occurred while running the application.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,78 @@
 import asyncio
+import atexit
+import functools
 import logging
 import math
 import os
 import random
 import sys
+import time
 from datetime import datetime, timedelta
-import json
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
 import dotenv
+import numpy as np
 
 from quixstreams import Application
 from quixstreams.models.topics import Topic
 from quixstreams.kafka import Producer
 
+from instrumentation import Instrumentation
+from recording import Recording, RecordingWriter
+from serializers import FrameSerializer, encode_columns, get_serializer
+from tracing import start_trace, tracing_enabled
+
 dotenv.load_dotenv() # for local dev, load env vars from .env file
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-# Replay speed
-replay_speed = 10.0
+# Replay speed, seconds of data sent per second. A recording is replayed as fast as possible with 0
+replay_speed = float(os.getenv("replay_speed", "10"))
 anomaly_fluctuation = 20
 hot_end_anomaly_min_duration = 30
 hot_end_anomaly_max_duration = 35
 bed_anomaly_min_duration = 30
 bed_anomaly_max_duration = 35
+# Seconds to wait before a printer starts sending its data again
+restart_delay = 10
+# Seconds between fleet throughput reports
+fleet_report_interval = 10
+
+instrumentation = Instrumentation.from_env("data_generator")
+produce_seconds = instrumentation.histogram("produce_seconds", "Time to encode and produce a message")
+messages_sent = instrumentation.counter("messages_sent_total", "Messages produced")
+behind_schedule = instrumentation.counter("behind_schedule_total",
+                                          "Messages (or fleet ticks) sent late, not enough CPU for the replay speed")
+
+# every message starts a trace, to measure the latency of the services, see tracing.py
+tracing = tracing_enabled()
 
 
 def get_data_length() -> int:
     return int(os.getenv('datalength', 60000))
 
 
-def temp(target, sigma, offset):
-    return target + offset + random.gauss(0, sigma)
+def get_seed() -> Optional[int]:
+    seed = os.getenv("seed", "")
+    return int(seed) if seed != "" else None
 
 
-def generate_data():
-    data = []
+class Frame(NamedTuple):
+    """
+    Sensor values of a single sample, without timestamps or printer name.
+    """
+    hotend_temperature: float
+    bed_temperature: float
+    ambient_temperature: float
+    fluctuated_ambient_temperature: float
+
+
+def temp(target, sigma, offset, rng: random.Random = random):
+    return target + offset + rng.gauss(0, sigma)
+
+
+def stream_data(rng: random.Random = random) -> Iterator[Frame]:
+    """
+    Lazily generate the samples one by one, keeping only the current anomaly and fluctuation in memory.
+    """
     target_ambient_t = 75
     hotend_t = 250
     bed_t = 110
@@ -47,17 +86,17 @@ def generate_data():
 
     # Generate 20 random anomaly timestamps
     number_of_anomalies = int(os.getenv("number_of_anomalies", "20"))
-    hotend_anomaly_timestamps = [random.randint(0, datalength) for _ in range(number_of_anomalies)]
-    bed_anomaly_timestamps = [random.randint(0, datalength) for _ in range(number_of_anomalies)]
+    hotend_anomaly_timestamps = {rng.randint(0, datalength) for _ in range(number_of_anomalies)}
+    bed_anomaly_timestamps = {rng.randint(0, datalength) for _ in range(number_of_anomalies)}
 
+    hotend_anomaly_start = 0
     hotend_anomaly_end = -1
+    bed_anomaly_start = 0
     bed_anomaly_end = -1
 
-    fluctuated_ambient_temperatures = []
-
     # Start with the current time without milliseconds
     timestamp = datetime.now().replace(microsecond=0)
-    next_fluctuation = timestamp + timedelta(seconds=random.randint(5, 300))
+    next_fluctuation = timestamp + timedelta(seconds=rng.randint(5, 300))
     fluctuation_end = timestamp
     fluctuation_amplitude = 0
 
@@ -65,17 +104,14 @@ def generate_data():
     elapsed_seconds = 0
 
     for i in range(datalength):
-        hotend_temperature = temp(hotend_t, hotend_sigma, 0)
-        bed_temperature = temp(bed_t, bed_sigma, 0)
-
-        hotend_anomaly_start = 0
-        bed_anomaly_start = 0
+        hotend_temperature = temp(hotend_t, hotend_sigma, 0, rng)
+        bed_temperature = temp(bed_t, bed_sigma, 0, rng)
 
         # Check if current timestamp is an anomaly timestamp
         if i in hotend_anomaly_timestamps:
             # Start a new anomaly
             hotend_anomaly_start = i
-            hotend_anomaly_end = i + random.randint(hot_end_anomaly_min_duration, hot_end_anomaly_max_duration)
+            hotend_anomaly_end = i + rng.randint(hot_end_anomaly_min_duration, hot_end_anomaly_max_duration)
             # Continue anomaly if within duration
 
         if i <= hotend_anomaly_end:
@@ -85,7 +121,7 @@ def generate_data():
         if i in bed_anomaly_timestamps:
             # Start a new anomaly
             bed_anomaly_start = i
-            bed_anomaly_end = i + random.randint(bed_anomaly_min_duration, bed_anomaly_max_duration)
+            bed_anomaly_end = i + rng.randint(bed_anomaly_min_duration, bed_anomaly_max_duration)
             # Continue anomaly if within duration
 
         if i <= bed_anomaly_end:
@@ -99,7 +135,7 @@ def generate_data():
             # Use a quadratic function to calculate the decrease
             ambient_t = target_ambient_t - (target_ambient_t / 2) * (proportion ** 2)
 
-        ambient_temperature = temp(ambient_t, ambient_sigma, 0)
+        ambient_temperature = temp(ambient_t, ambient_sigma, 0, rng)
 
         # Add fluctuations
         if next_fluctuation <= timestamp <= fluctuation_end:
@@ -107,65 +143,320 @@ def generate_data():
         else:
             fluctuated_ambient_temperature = ambient_temperature
             if timestamp > fluctuation_end:
-                next_fluctuation = timestamp + timedelta(seconds=random.randint(5, 300))
-                fluctuation_duration = timedelta(seconds=random.randint(1, 4))
+                next_fluctuation = timestamp + timedelta(seconds=rng.randint(5, 300))
+                fluctuation_duration = timedelta(seconds=rng.randint(1, 4))
                 fluctuation_end = next_fluctuation + fluctuation_duration
-                fluctuation_amplitude = random.uniform(-2, 2)
+                fluctuation_amplitude = rng.uniform(-2, 2)
 
-        fluctuated_ambient_temperatures.append(fluctuated_ambient_temperature)
-
-        data_dict = {
-            'hotend_temperature': hotend_temperature,
-            'bed_temperature': bed_temperature,
-            'ambient_temperature': ambient_temperature,
-            'fluctuated_ambient_temperature': fluctuated_ambient_temperature
-        }
-
-        data.append(data_dict)
+        yield Frame(hotend_temperature, bed_temperature, ambient_temperature, fluctuated_ambient_temperature)
 
         next_timestamp = start_timestamp + timedelta(seconds=elapsed_seconds)
         elapsed_seconds += 1
         timestamp = next_timestamp
 
-    return data
 
+def generate_data():
+    return [frame._asdict() for frame in stream_data()]
+
+
+def anomaly_envelope(rng: np.random.Generator, datalength: int, number_of_anomalies: int,
+                     min_duration: int, max_duration: int) -> np.ndarray:
+    """
+    Sinusoidal anomaly envelope (0 outside anomalies) for every sample.
+    A new anomaly replaces the one in progress, like in 'generate_data'.
+    """
+    starts = np.unique(rng.integers(0, datalength, number_of_anomalies, endpoint=True))
+    ends = starts + rng.integers(min_duration, max_duration, len(starts), endpoint=True)
+
+    index = np.arange(datalength)
+    latest = np.searchsorted(starts, index, side="right") - 1  # most recent anomaly start for each sample
+    active = latest >= 0
+    active[active] = index[active] <= ends[latest[active]]
+
+    start = starts[latest[active]]
+    end = ends[latest[active]]
+    envelope = np.zeros(datalength)
+    envelope[active] = np.sin(np.pi * (end - index[active]) / (end - start))
+    return envelope
+
+
+def fluctuation_offsets(rng: np.random.Generator, datalength: int) -> np.ndarray:
+    """
+    Ambient fluctuation offset for every sample.
+    Fluctuations are scheduled back to back: wait 5-300 seconds, fluctuate for 1-4 seconds
+    with a random amplitude, then schedule the next one on the following second.
+    """
+    # every cycle takes at least 7 seconds, so this is enough to cover the whole data range
+    count = datalength // 7 + 2
+    gaps = rng.integers(5, 300, count, endpoint=True)
+    durations = rng.integers(1, 4, count, endpoint=True)
+    amplitudes = rng.uniform(-2, 2, count)
+
+    # 'generate_data' schedules the first fluctuation at sample 2 and its timestamps lag the sample index by one
+    scheduled = 2 + np.concatenate(([0], np.cumsum(gaps + durations + 1)[:-1]))
+    starts = scheduled + gaps
+    ends = starts + durations
+
+    index = np.arange(datalength)
+    latest = np.searchsorted(starts, index, side="right") - 1
+    active = latest >= 0
+    active[active] = index[active] <= ends[latest[active]]
+
+    offsets = np.zeros(datalength)
+    offsets[active] = amplitudes[latest[active]]
+    return offsets
+
+
+def generate_data_vectorized(seed: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Vectorized version of 'generate_data'.
+    Produces the same series as NumPy arrays (one per column) in a single pass,
+    so the cost does not depend on the number of anomalies.
+    """
+    rng = np.random.default_rng(seed)
 
-async def publish_data(printer: str, topic_name: str, producer: Producer, data: list):
-    start_timestamp = datetime.now()
+    target_ambient_t = 75
+    hotend_t = 250
+    bed_t = 110
+    ambient_t = 50
+
+    hotend_sigma = 0.5
+    bed_sigma = 0.5
+    ambient_sigma = 0.2
+
+    datalength = int(os.getenv('datalength', 30000))
+    number_of_anomalies = int(os.getenv("number_of_anomalies", "20"))
+    index = np.arange(datalength)
+
+    hotend_temperature = rng.normal(hotend_t, hotend_sigma, datalength)
+    hotend_temperature -= anomaly_fluctuation * anomaly_envelope(
+        rng, datalength, number_of_anomalies, hot_end_anomaly_min_duration, hot_end_anomaly_max_duration)
+
+    bed_temperature = rng.normal(bed_t, bed_sigma, datalength)
+    bed_temperature -= anomaly_fluctuation / 2 * anomaly_envelope(
+        rng, datalength, number_of_anomalies, bed_anomaly_min_duration, bed_anomaly_max_duration)
+
+    # Curve-like downward trend in the final half of the data range
+    ambient_target = np.full(datalength, float(ambient_t))
+    second_half = index > datalength / 2
+    proportion = 2 * (index[second_half] - datalength / 2) / datalength
+    ambient_target[second_half] = target_ambient_t - (target_ambient_t / 2) * (proportion ** 2)
+
+    ambient_temperature = ambient_target + rng.normal(0, ambient_sigma, datalength)
+    fluctuated_ambient_temperature = ambient_temperature + fluctuation_offsets(rng, datalength)
+
+    return {
+        'hotend_temperature': hotend_temperature,
+        'bed_temperature': bed_temperature,
+        'ambient_temperature': ambient_temperature,
+        'fluctuated_ambient_temperature': fluctuated_ambient_temperature
+    }
+
+
+def to_columns(data: list) -> Dict[str, np.ndarray]:
+    return {name: np.array([row[name] for row in data]) for name in data[0]}
+
+
+def get_payload_source(printer_index: int, payloads: Optional[List[bytes]],
+                       serializer: FrameSerializer) -> Callable[[], Iterable[bytes]]:
+    """
+    Return a function that creates a fresh iterable of encoded values for every replay of the printer.
+    Without pre-encoded payloads, every printer generates and encodes its own data lazily.
+    """
+    if payloads is not None:
+        return lambda: payloads
+
+    seed = get_seed()
+    printer_seed = seed + printer_index if seed is not None else None
+    return lambda: (serializer.encode_values(Frame._fields, frame) for frame in stream_data(random.Random(printer_seed)))
+
+
+async def publish_data(printer: str, topic_name: str, producer: Producer, payloads: Iterable[bytes],
+                       serializer: FrameSerializer, record: Optional[Callable[[float, int], None]] = None,
+                       start_timestamp: Optional[float] = None) -> float:
+    """
+    Send the payloads one second of data apart from 'start_timestamp' (now by default), paced by 'replay_speed'.
+    Returns the timestamp following the last one sent.
+    """
+    start_time = datetime.now().timestamp()
+    if start_timestamp is None:
+        start_timestamp = start_time
+    encoded_printer = serializer.encode_printer(printer)
     elapsed_seconds = 0
 
-    for frame in data:
-        next_timestamp = start_timestamp + timedelta(seconds=elapsed_seconds)
+    for values in payloads:
+        started = time.perf_counter()
+        # only the timestamp and printer name are added, the values were encoded once up front
+        timestamp = start_timestamp + elapsed_seconds
+        message = serializer.encode(values, encoded_printer, timestamp)
+        if record is not None:
+            record(timestamp, elapsed_seconds)
         elapsed_seconds += 1
 
-        frame["timestamp"] = datetime.fromtimestamp(next_timestamp.timestamp()).isoformat()
-        frame["original_timestamp"] = datetime.fromtimestamp(next_timestamp.timestamp()).isoformat()
-        frame["printer"] = printer
+        headers = start_trace(serializer.headers, "generator") if tracing else serializer.headers
+        producer.produce(topic_name, message, key=printer, headers=headers)  # publish with the producer
+        produce_seconds.observe(time.perf_counter() - started)
+        messages_sent.inc()
 
-        json_data = json.dumps(frame)  # convert the row to JSON
-        producer.produce(topic_name, json_data, key=printer)  # publish with the producer
-
-        # Dataframe should be sent at initial_timestamp + elapsed_seconds / replay_speed
-        target_time = start_timestamp + timedelta(seconds=elapsed_seconds / replay_speed)
-        delay_seconds = target_time.timestamp() - datetime.now().timestamp()
+        # Dataframe should be sent at start_time + elapsed_seconds / replay_speed
+        target_time = start_time + elapsed_seconds / replay_speed
+        delay_seconds = target_time - datetime.now().timestamp()
 
         if delay_seconds < 0:
+            behind_schedule.inc()
             logging.warning(f"{printer : <10}: Not enough CPU to keep up with replay speed")
         else:
             logging.debug(f"{printer : <10}: Waiting {delay_seconds:.3f} seconds to send next data point.")
             await asyncio.sleep(delay_seconds)
 
+    return start_timestamp + elapsed_seconds
+
 
-async def generate_data_async(topic: Topic, producer: Producer, printer: str, printer_data: list, initial_delay: int):
+async def generate_data_async(topic: Topic, producer: Producer, printer: str, payloads: Callable[[], Iterable[bytes]],
+                              serializer: FrameSerializer, initial_delay: int,
+                              record: Optional[Callable[[float, int], None]] = None):
     await asyncio.sleep(initial_delay)
+    start_timestamp = None
     while True:
         print(f"{printer}: Sending values for {os.getenv('datalength')} seconds.")
-        await publish_data(printer, topic.name, producer, printer_data)
+        next_timestamp = await publish_data(printer, topic.name, producer, payloads(), serializer, record,
+                                            start_timestamp)
 
         print(f"{printer}: Closing stream")
 
         # Wait 10 seconds before starting again
-        await asyncio.sleep(10)
+        await asyncio.sleep(restart_delay)
+        # A replay sends 'replay_speed' seconds of data per second, so its timestamps get ahead of the clock.
+        # The next one starts after the last timestamp sent: the event time of a printer never goes back,
+        # the windows of the Down-sampling and the histories of the Forecast Service take every replay
+        start_timestamp = max(datetime.now().timestamp(), next_timestamp + restart_delay)
+
+
+def get_fleet_tick_rate(number_of_printers: int) -> float:
+    """
+    Ticks per second of the fleet scheduler. Every tick sends one sample (one second of data) per active printer,
+    so by default it follows 'replay_speed'. 'target_messages_per_second' overrides it for load tests.
+    """
+    target_messages_per_second = float(os.getenv("target_messages_per_second", "0"))
+    if target_messages_per_second > 0:
+        return target_messages_per_second / number_of_printers
+    return replay_speed
+
+
+def get_fleet_restart_ticks(tick_rate: float) -> int:
+    """
+    Ticks a printer is inactive between its replays, 'restart_delay' seconds, none with 'target_messages_per_second':
+    every printer sends on every tick, so the fleet sends exactly that many messages per second.
+    """
+    if float(os.getenv("target_messages_per_second", "0")) > 0:
+        return 0
+    return int(restart_delay * tick_rate)
+
+
+async def publish_fleet(topic_name: str, producer: Producer, printers: List[str], payloads: List[bytes],
+                        serializer: FrameSerializer, tick_rate: float,
+                        record: Optional[Callable[[int, float, int], None]] = None):
+    """
+    Send the data of all the printers from a single scheduler.
+    On every tick each active printer sends its next sample, all of them in one batch.
+    Printers are spread over the data with phase offsets and, like in 'generate_data_async',
+    they are inactive for 'restart_delay' seconds between replays, except in target mode.
+    The timestamps of a printer go on across its replays, every tick is a second of data.
+    """
+    datalength = len(payloads)
+    restart_ticks = get_fleet_restart_ticks(tick_rate)
+    cycle_length = datalength + restart_ticks
+    offsets = np.arange(len(printers)) * cycle_length // len(printers)
+    encoded_printers = [serializer.encode_printer(printer) for printer in printers]
+
+    start_time = time.time()
+    # The first replay of each printer started 'offset' ticks before the start, its samples are one second apart
+    first_timestamps = (start_time - offsets / tick_rate + offsets).tolist()
+    report_time = start_time + fleet_report_interval
+    sent = 0
+    late_ticks = 0
+    tick = 0
+
+    while True:
+        positions = (tick + offsets) % cycle_length
+
+        for i in np.flatnonzero(positions < datalength).tolist():
+            started = time.perf_counter()
+            position = int(positions[i])
+            timestamp = first_timestamps[i] + tick
+            message = serializer.encode(payloads[position], encoded_printers[i], timestamp)
+            if record is not None:
+                record(i, timestamp, position)
+            headers = start_trace(serializer.headers, "generator") if tracing else serializer.headers
+            producer.produce(topic_name, message, key=printers[i], headers=headers)
+            produce_seconds.observe(time.perf_counter() - started)
+            messages_sent.inc()
+            sent += 1
+
+        tick += 1
+        delay_seconds = start_time + tick / tick_rate - time.time()
+        if delay_seconds > 0:
+            await asyncio.sleep(delay_seconds)
+        else:
+            late_ticks += 1
+            behind_schedule.inc()
+
+        now = time.time()
+        if now >= report_time:
+            elapsed = now - report_time + fleet_report_interval
+            logging.info(f"Fleet: sent {sent} messages ({sent / elapsed:.0f}/s) for {len(printers)} printers")
+            if late_ticks:
+                logging.warning(f"Fleet: {late_ticks} ticks behind schedule, not enough CPU to keep up with replay speed")
+            report_time = now + fleet_report_interval
+            sent = 0
+            late_ticks = 0
+
+
+async def publish_recording(topic_name: str, producer: Producer, recording: Recording, serializer: FrameSerializer,
+                            speed: float, shift_timestamps: bool):
+    """
+    Send the records of a recording once, in their order, 'speed' seconds of data per second or as fast as possible
+    with 0. The messages are the ones recorded, byte for byte, unless 'shift_timestamps' moves their timestamps
+    so the first one is sent now.
+    """
+    printers = recording.printers
+    encoded_printers = [serializer.encode_printer(printer) for printer in printers]
+    start_time = time.time()
+    first_timestamp = None
+    previous_timestamp = None
+    offset = 0.0
+    sent = 0
+
+    for chunk in recording.chunks():
+        timestamps = chunk["timestamp"].tolist()
+        printer_indexes = chunk["printer"].tolist()
+        samples = chunk["values"].tolist()
+        del chunk  # a view of the file, the recording can't be closed while it's referenced
+        if first_timestamp is None:
+            first_timestamp = timestamps[0]
+            offset = start_time - first_timestamp if shift_timestamps else 0.0
+
+        for timestamp, i, values in zip(timestamps, printer_indexes, samples):
+            # the records of a timestamp are sent together, like the ticks of the fleet mode
+            if speed > 0 and timestamp != previous_timestamp:
+                previous_timestamp = timestamp
+                delay_seconds = start_time + (timestamp - first_timestamp) / speed - time.time()
+                if delay_seconds > 0:
+                    await asyncio.sleep(delay_seconds)
+                else:
+                    behind_schedule.inc()
+
+            started = time.perf_counter()
+            message = serializer.encode(serializer.encode_values(recording.fields, values), encoded_printers[i],
+                                        timestamp + offset)
+            headers = start_trace(serializer.headers, "generator") if tracing else serializer.headers
+            producer.produce(topic_name, message, key=printers[i], headers=headers)
+            produce_seconds.observe(time.perf_counter() - started)
+            messages_sent.inc()
+            sent += 1
+
+    producer.flush()
+    logging.info(f"Replay: sent {sent} messages of {len(printers)} printers in {time.time() - start_time:.1f} seconds")
 
 
 async def main():
@@ -174,6 +465,9 @@ async def main():
     # Or set the relevant values in a .env file
     app = Application.Quix("consumer-group-1", use_changelog_topics=False)
     producer = app.get_producer()
+    instrumentation.gauge("producer_queue_messages", "Messages waiting in the producer to be delivered",
+                          function=lambda: len(producer))
+    instrumentation.start()
 
     # Open the output topic where to write data out
     topic = app.topic(os.getenv("output", "3d-printer-data-json"))  # serialize with json by default
@@ -181,17 +475,68 @@ async def main():
     number_of_printers = int(os.getenv("number_of_printers", 1)) # we will create a new stream for each printer
 
     tasks = []
-    printer_data = generate_data()
+    fleet_mode = os.getenv("simulation_mode", "printer") == "fleet"
+
+    serializer = get_serializer(os.getenv("serializer", "json"))
+
+    # "replay" sends the messages of a recording, see recording.py
+    if os.getenv("data_source", "buffer") == "replay":
+        with Recording(os.environ["replay_file"]) as recording:
+            logging.info(f"Replay: {recording.records} messages of {len(recording.printers)} printers "
+                         f"from {os.environ['replay_file']}")
+            await publish_recording(topic.name, producer, recording, serializer, replay_speed,
+                                    os.getenv("replay_timestamps", "recorded") == "shifted")
+        return
+
+    if replay_speed <= 0:
+        raise ValueError("replay_speed must be positive, only a recording can be replayed as fast as possible")
+
+    # "buffer" (default) generates and encodes the data once for all printers,
+    # "stream" generates independent data for every printer lazily, while it is published
+    printer_data = None
+    if os.getenv("data_source", "buffer") == "buffer" or fleet_mode:
+        # "vectorized" (default) generates all the data with NumPy in one pass, "loop" uses the original generator
+        seed = get_seed()
+        if os.getenv("generator_mode", "vectorized") == "loop":
+            random.seed(seed)
+            printer_data = to_columns(generate_data())
+        else:
+            printer_data = generate_data_vectorized(seed)
+        samples = np.column_stack([printer_data[name] for name in Frame._fields])
+        printer_data = encode_columns(serializer, printer_data)
+
+    printers = [f"Printer {i + 1}" for i in range(number_of_printers)]  # We don't want a Printer 0, so start at 1
+
+    # every message sent is also written to 'record_file', to replay the same messages
+    record = None
+    record_file = os.getenv("record_file", "")
+    if record_file:
+        if printer_data is None:
+            raise ValueError("record_file needs the buffer data source")
+        recorder = RecordingWriter(record_file, Frame._fields, printers)
+        atexit.register(recorder.close)
+
+        def write_record(printer_index: int, timestamp: float, position: int):
+            recorder.write(printer_index, timestamp, samples[position])
+
+        record = write_record
+
+    if fleet_mode:
+        tick_rate = get_fleet_tick_rate(number_of_printers)
+        logging.info(f"Fleet: {number_of_printers} printers at {tick_rate:.2f} ticks per second")
+        await publish_fleet(topic.name, producer, printers, printer_data, serializer, tick_rate, record)
+        return
 
     # Distribute all printers over the data length (defaults to 60 seconds)
     delay_seconds = get_data_length() / replay_speed / number_of_printers
 
-    for i in range(number_of_printers):
+    for i, name in enumerate(printers):
         # Set MessageKey/StreamID or leave parameters empty to get a generated message key.
-        name = f"Printer {i + 1}"  # We don't want a Printer 0, so start at 1
-
         # Start sending data, each printer will start with some delay after the previous one
-        tasks.append(asyncio.create_task(generate_data_async(topic, producer, name, printer_data.copy(), int(delay_seconds * i))))
+        payloads = get_payload_source(i, printer_data, serializer)
+        tasks.append(asyncio.create_task(
+            generate_data_async(topic, producer, name, payloads, serializer, int(delay_seconds * i),
+                                functools.partial(record, i) if record is not None else None)))
 
     await asyncio.gather(*tasks)
 
@@ -0,0 +1,117 @@
+"""
+Recordings of the data of a fleet of printers, to replay captured telemetry or a generated stream exactly.
+
+A recording is a file of fixed size records, one per message in the order they were sent: the timestamp
+(epoch seconds, float64), the index of the printer, 4 bytes of padding so the values stay 8-byte aligned,
+then the sensor values as float64. It starts with a small header: the magic bytes, the length of a JSON object
+with the names of the fields and of the printers, and that object, padded to 8 bytes.
+
+The records are appended as they are sent, so a recording can be of any length and the records of a file
+that wasn't closed are readable, up to the last complete one. Reading maps the file in memory and goes through
+it in chunks, releasing the pages already read, so replaying it doesn't depend on the size of the file.
+"""
+import json
+import mmap
+import struct
+from typing import Iterator, List, Sequence
+
+import numpy as np
+
+MAGIC = b"PMREC\x00\x01\x00"
+_header_length = struct.Struct("<I")
+_alignment = 8
+
+
+def record_dtype(number_of_fields: int) -> np.dtype:
+    return np.dtype([("timestamp", "<f8"), ("printer", "<u4"), ("padding", "<u4"),
+                     ("values", "<f8", (number_of_fields,))])
+
+
+class RecordingWriter:
+    """
+    Appends records to a new recording, 'chunk_records' at a time.
+    """
+
+    def __init__(self, path: str, fields: Sequence[str], printers: Sequence[str], chunk_records: int = 4096):
+        self.fields = list(fields)
+        self.printers = list(printers)
+        self._file = open(path, "wb")
+        header = json.dumps({"fields": self.fields, "printers": self.printers}).encode()
+        header += b" " * (-(len(MAGIC) + _header_length.size + len(header)) % _alignment)
+        self._file.write(MAGIC + _header_length.pack(len(header)) + header)
+        self._chunk = np.zeros(chunk_records, record_dtype(len(self.fields)))
+        self._length = 0
+        self.records = 0
+
+    def write(self, printer: int, timestamp: float, values: Sequence[float]):
+        record = self._chunk[self._length]
+        record["timestamp"] = timestamp
+        record["printer"] = printer
+        record["values"] = values
+        self._length += 1
+        self.records += 1
+        if self._length == len(self._chunk):
+            self.flush()
+
+    def flush(self):
+        self._file.write(self._chunk[:self._length].tobytes())
+        self._file.flush()
+        self._length = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """
+    A recording, memory-mapped read-only.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"'{path}' isn't a recording")
+        header_start = len(MAGIC) + _header_length.size
+        (header_length,) = _header_length.unpack_from(self._mmap, len(MAGIC))
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        self.fields: List[str] = header["fields"]
+        self.printers: List[str] = header["printers"]
+        self.dtype = record_dtype(len(self.fields))
+        self._offset = header_start + header_length
+        # a record being written when the file was copied is ignored
+        self.records = (len(self._mmap) - self._offset) // self.dtype.itemsize
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+    def chunks(self, chunk_records: int = 4096) -> Iterator[np.ndarray]:
+        """
+        The records, 'chunk_records' at a time, as views of the file. The pages of a chunk are dropped from the
+        memory of the process once the next one is asked for, they stay in the page cache.
+        """
+        released = 0
+        for start in range(0, self.records, chunk_records):
+            yield np.frombuffer(self._mmap, self.dtype, min(chunk_records, self.records - start),
+                                self._offset + start * self.dtype.itemsize)
+            end = (self._offset + (start + chunk_records) * self.dtype.itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+            if end > released and hasattr(mmap, "MADV_DONTNEED"):
+                self._mmap.madvise(mmap.MADV_DONTNEED, released, end - released)
+                released = end
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,97 @@
+import json
+import struct
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from wire_format import BINARY_V1, WIRE_FORMAT_HEADER, encode_descriptor
+
+try:
+    import orjson  # faster JSON encoder, installed with quixstreams
+except ImportError:
+    orjson = None
+
+
+class FrameSerializer:
+    """
+    Serializes frames in two steps, so the sensor values of a sample are only encoded once:
+    'encode_values' encodes the part that never changes between replays and
+    'encode' adds the timestamp and the printer name to it for every message.
+    'headers' are the headers of every message.
+    """
+    headers: Optional[Dict[str, str]] = None
+
+    def encode_values(self, names: Sequence[str], values: Sequence[float]) -> bytes:
+        raise NotImplementedError
+
+    def encode_printer(self, printer: str) -> bytes:
+        raise NotImplementedError
+
+    def encode(self, values: bytes, printer: bytes, timestamp: float) -> bytes:
+        raise NotImplementedError
+
+
+class JSONFrameSerializer(FrameSerializer):
+    """
+    Same JSON messages as before, the values are spliced with the timestamps and printer name.
+    """
+
+    def __init__(self):
+        self._dumps = orjson.dumps if orjson is not None else lambda value: json.dumps(value).encode()
+
+    def encode_values(self, names: Sequence[str], values: Sequence[float]) -> bytes:
+        return self._dumps(dict(zip(names, values)))[1:-1]  # without the braces
+
+    def encode_printer(self, printer: str) -> bytes:
+        return self._dumps(printer)
+
+    def encode(self, values: bytes, printer: bytes, timestamp: float) -> bytes:
+        iso_timestamp = datetime.fromtimestamp(timestamp).isoformat().encode()
+        return b"".join((b"{", values, b',"timestamp":"', iso_timestamp, b'","original_timestamp":"', iso_timestamp,
+                         b'","printer":', printer, b"}"))
+
+
+class BinaryFrameSerializer(FrameSerializer):
+    """
+    The binary wire format of the services (see wire_format.py), with the same fields as the JSON messages:
+    the values as float64, then the timestamps and the printer name as strings.
+    The descriptor and the values are encoded once, the strings and their lengths are added per message.
+    """
+    headers = {WIRE_FORMAT_HEADER: BINARY_V1}
+
+    def __init__(self):
+        self._descriptor = b""
+        self._string_lengths = struct.Struct("<HHH")
+
+    def encode_values(self, names: Sequence[str], values: Sequence[float]) -> bytes:
+        if not self._descriptor:
+            self._descriptor = encode_descriptor([*((name, b"d") for name in names), ("timestamp", b"s"),
+                                                  ("original_timestamp", b"s"), ("printer", b"s")])
+        return struct.pack(f"<{len(values)}d", *values)
+
+    def encode_printer(self, printer: str) -> bytes:
+        return printer.encode()
+
+    def encode(self, values: bytes, printer: bytes, timestamp: float) -> bytes:
+        iso_timestamp = datetime.fromtimestamp(timestamp).isoformat().encode()
+        lengths = self._string_lengths.pack(len(iso_timestamp), len(iso_timestamp), len(printer))
+        return b"".join((self._descriptor, values, lengths, iso_timestamp, iso_timestamp, printer))
+
+
+serializers = {
+    "json": JSONFrameSerializer,
+    "binary": BinaryFrameSerializer,
+}
+
+
+def get_serializer(name: str) -> FrameSerializer:
+    if name not in serializers:
+        raise ValueError(f"Unknown serializer '{name}', use one of: {', '.join(serializers)}")
+    return serializers[name]()
+
+
+def encode_columns(serializer: FrameSerializer, columns: Dict[str, Sequence[float]]) -> List[bytes]:
+    """
+    Encode the values of every sample once, to be reused on every replay by all printers.
+    """
+    names = list(columns)
+    return [serializer.encode_values(names, values) for values in zip(*(columns[name].tolist() for name in names))]
@@ -0,0 +1,218 @@
+import logging
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from quixstreams import State
+from quixstreams.utils.json import dumps as json_dumps, loads as json_loads
+
+logger = logging.getLogger(__name__)
+
+supported_aggregates = ("sum", "mean", "min", "max", "count", "variance", "stddev")
+
+_duration_units = {"ms": 1, "s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000}
+
+
+def parse_duration(value: str) -> int:
+    """
+    Parse a duration like "500ms", "10s", "1m", "1h" or "1d" into milliseconds.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*(ms|s|m|h|d)\s*", value)
+    if not match:
+        raise ValueError(f"Invalid duration '{value}', expected a number followed by ms, s, m, h or d")
+    return int(match.group(1)) * _duration_units[match.group(2)]
+
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# Packed window records are stored in state as this byte followed by the record, any other value as JSON
+_packed_marker = b"\x00"
+
+
+def state_dumps(value: Any) -> bytes:
+    """
+    Serializer of the state store: bytes (packed records) are stored as they are, behind a marker byte
+    JSON never starts with, everything else (the state keys) as JSON.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return _packed_marker + value
+    return json_dumps(value)
+
+
+def state_loads(data: bytes) -> Any:
+    if data[:1] == _packed_marker:
+        return data[1:]
+    return json_loads(data)
+
+
+def event_time(value: dict, field: str, default_ms: int) -> int:
+    """
+    The event time of a message in milliseconds, from its 'field': epoch milliseconds or an ISO 8601 string
+    like the ones of the Data Generator. 'default_ms' (the Kafka timestamp) if the message doesn't have it.
+    """
+    timestamp = value.get(field) if field else None
+    if timestamp is None:
+        return default_ms
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+
+class MultiResolutionAggregator:
+    """
+    Aggregates 'fields' in event time tumbling windows of several sizes in one pass over each message.
+    Every resolution keeps the open windows of every message key in state, with the count, sums,
+    minimums, maximums and the mean and sum of squared differences of Welford's algorithm for the variance.
+
+    The watermark of a key is the latest event time it received minus 'grace_ms'. A window is closed,
+    and its final row returned, once the watermark passes its end. Messages out of order are added to
+    their window while it's open, they are counted as late in 'late', and dropped and counted in 'dropped'
+    once it's closed. With 'emit_early', the partial row of the window of every message is also returned,
+    at most every 'early_interval_ms' of event time per window, and the final row corrects it.
+
+    The open windows are fixed layout records of float64, packed one after the other in the state with 'state_dumps':
+    [start, event time of the last partial row, count, sum * fields, min * fields, max * fields, mean * fields,
+    m2 * fields]. The printer is the message key the state is stored under, it's not repeated in the records,
+    and the 'original_timestamp' of the windows are stored apart, once per window.
+    """
+
+    def __init__(self, fields: List[str], aggregates: List[str], resolutions: Dict[str, int], grace_ms: int = 0,
+                 emit_early: bool = False, early_interval_ms: int = 0):
+        unknown = set(aggregates) - set(supported_aggregates)
+        if unknown:
+            raise ValueError(f"Unknown aggregates {', '.join(sorted(unknown))}, "
+                             f"expected some of {', '.join(supported_aggregates)}")
+
+        self.fields = fields
+        self.aggregates = aggregates
+        self.resolutions = resolutions
+        self.grace_ms = grace_ms
+        self.emit_early = emit_early
+        self.early_interval_ms = early_interval_ms
+        self._state_keys = {name: (f"window_{name}", f"window_{name}_original_timestamp") for name in resolutions}
+
+        # messages of every resolution added to a window out of order, and dropped because their window was closed
+        self.late: Counter = Counter()
+        self.dropped: Counter = Counter()
+
+        n = len(fields)
+        self._sum, self._min, self._max, self._mean, self._m2 = (3 + i * n for i in range(5))
+        self._record_size = 3 + 5 * n
+
+    def process(self, value: dict, timestamp_ms: int, printer: str, state: State) -> List[dict]:
+        """
+        Add the message at event time 'timestamp_ms' to the windows of every resolution, and return the rows of
+        the windows the watermark closed, then the partial rows with 'emit_early'.
+        """
+        latest = state.get("latest_event_time")
+        out_of_order = latest is not None and timestamp_ms < latest
+        if not out_of_order:
+            latest = timestamp_ms
+            state.set("latest_event_time", latest)
+        watermark = latest - self.grace_ms
+
+        rows = []
+        values = [float(value[field]) for field in self.fields]
+        for name, duration_ms in self.resolutions.items():
+            start = timestamp_ms - timestamp_ms % duration_ms
+            if start + duration_ms <= watermark:
+                # the watermark didn't move, a message this late is always out of order
+                self.dropped[name] += 1
+                logger.debug(f"Dropping a message {watermark - timestamp_ms} ms behind the watermark "
+                             f"for the {name} windows")
+                continue
+            if out_of_order:
+                self.late[name] += 1
+
+            windows_key, original_timestamps_key = self._state_keys[name]
+            windows = self._unpack(state.get(windows_key))
+            starts = [window[0] for window in windows]
+            index = bisect_left(starts, start)
+            new = index == len(windows) or starts[index] != start
+            if new:
+                window = self.new_window(start, values)
+                windows.insert(index, window)
+            else:
+                window = windows[index]
+                self.add(window, values)
+
+            closed = 0
+            while windows[closed][0] + duration_ms <= watermark:
+                closed += 1
+            early = self.emit_early and timestamp_ms - window[1] >= self.early_interval_ms
+
+            # the original timestamps are only read when a window is opened, closed or written early
+            if new or closed or early:
+                original_timestamps = state.get(original_timestamps_key, [])
+                if new:
+                    original_timestamps.insert(index, value.get("original_timestamp", value.get("timestamp")))
+                for i in range(closed):
+                    rows.append(self.to_row(name, windows[i], original_timestamps[i], printer, final=True))
+                if early:
+                    window[1] = timestamp_ms
+                    rows.append(self.to_row(name, window, original_timestamps[index], printer, final=False))
+                if new or closed:
+                    state.set(original_timestamps_key, original_timestamps[closed:])
+
+            state.set(windows_key, b"".join(window.tobytes() for window in windows[closed:]))
+        return rows
+
+    def _unpack(self, packed: Optional[bytes]) -> List[array]:
+        if packed is None:
+            return []
+        records = array("d")
+        records.frombytes(packed)
+        return [records[i:i + self._record_size] for i in range(0, len(records), self._record_size)]
+
+    def new_window(self, start: int, values: List[float]) -> array:
+        return array("d", [start, -math.inf, 1, *values, *values, *values, *values, *([0.0] * len(values))])
+
+    def add(self, window: array, values: List[float]):
+        window[2] = count = window[2] + 1
+        s, lo, hi, mean, m2 = self._sum, self._min, self._max, self._mean, self._m2
+        for i, x in enumerate(values):
+            window[s + i] += x
+            if x < window[lo + i]:
+                window[lo + i] = x
+            if x > window[hi + i]:
+                window[hi + i] = x
+            # Welford's online update of the mean and the sum of squared differences from it
+            delta = x - window[mean + i]
+            window[mean + i] += delta / count
+            window[m2 + i] += delta * (x - window[mean + i])
+
+    def to_row(self, name: str, window: array, original_timestamp: Any, printer: str, final: bool = True) -> dict:
+        count = int(window[2])
+        row = {
+            "timestamp": int(window[0]),
+            "resolution": name,
+        }
+        for i, field in enumerate(self.fields):
+            for aggregate in self.aggregates:
+                if aggregate != "count":
+                    row[f"{aggregate}_{field}"] = self._aggregate(aggregate, window, count, i)
+        row["original_timestamp"] = original_timestamp
+        row["count"] = count
+        row["printer"] = printer
+        if self.emit_early:
+            row["final"] = final
+        return row
+
+    def _aggregate(self, aggregate: str, window: array, count: int, i: int) -> float:
+        if aggregate == "sum":
+            return window[self._sum + i]
+        if aggregate == "min":
+            return window[self._min + i]
+        if aggregate == "max":
+            return window[self._max + i]
+        if aggregate == "mean":
+            return window[self._mean + i]
+
+        variance = window[self._m2 + i] / (count - 1) if count > 1 else 0.0  # sample variance
+        return variance if aggregate == "variance" else math.sqrt(variance)
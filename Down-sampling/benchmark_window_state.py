@@ -0,0 +1,152 @@
+"""
+Measure the cost per message of the window state: reading the open window from the state, adding the message to it
+and writing it back, with the state serialization, for
+
+- "reduce": the sums of the original 10 seconds window reducer, a dict with a key per field, as JSON
+- "dict": the windows of every resolution as dicts of lists with the printer, as JSON
+- "packed": the windows of every resolution as packed float64 records, see MultiResolutionAggregator
+
+"dict" and "packed" run the same windows, watermark and late messages, and return the same rows. Every 7th message
+is late, within the grace period.
+
+    python benchmark_window_state.py [messages]
+
+The state is an in-memory store serializing every value like the RocksDB state does, Kafka is not involved.
+"""
+import math
+import sys
+import time
+from datetime import datetime
+
+from quixstreams.utils.json import dumps as json_dumps, loads as json_loads
+
+from aggregations import MultiResolutionAggregator, parse_duration, state_dumps, state_loads
+
+fields = ["hotend_temperature", "bed_temperature", "ambient_temperature", "fluctuated_ambient_temperature"]
+aggregates = ["mean", "min", "max", "stddev"]
+resolutions = {name: parse_duration(name) for name in ("10s", "1m", "1h")}
+grace_ms = 5000
+
+
+class SerializingState:
+    """
+    Keeps the values serialized, like the state of a message key, so every get and set pays the serialization.
+    """
+
+    def __init__(self, dumps, loads):
+        self.dumps = dumps
+        self.loads = loads
+        self.values = {}
+
+    def get(self, key, default=None):
+        value = self.values.get(self.dumps(key))
+        return default if value is None else self.loads(value)
+
+    def set(self, key, value):
+        self.values[self.dumps(key)] = self.dumps(value)
+
+    def size(self) -> int:
+        return sum(len(key) + len(value) for key, value in self.values.items())
+
+
+def reduce_window(value: dict, timestamp_ms: int, printer: str, state: SerializingState) -> list:
+    window = state.get("window")
+    start = timestamp_ms - timestamp_ms % 10000
+    if window is None or window["start"] != start:
+        window = {"start": start, "value": {f"sum_{field}": value[field] for field in fields}}
+        window["value"].update(sum_timestamp=value["timestamp"], sum_original_timestamp=value["original_timestamp"],
+                               sum_printer=printer, sum_count=1)
+    else:
+        for field in fields:
+            window["value"][f"sum_{field}"] += value[field]
+        window["value"]["sum_count"] += 1
+    state.set("window", window)
+    return []
+
+
+def dict_row(name: str, window: dict) -> dict:
+    count = window["count"]
+    row = {"timestamp": window["start"], "resolution": name}
+    for i, field in enumerate(fields):
+        variance = window["m2"][i] / (count - 1) if count > 1 else 0.0
+        values = {"mean": window["mean"][i], "min": window["min"][i], "max": window["max"][i],
+                  "stddev": math.sqrt(variance)}
+        for aggregate in aggregates:
+            row[f"{aggregate}_{field}"] = values[aggregate]
+    row.update(original_timestamp=window["original_timestamp"], count=count, printer=window["printer"])
+    return row
+
+
+def dict_window(value: dict, timestamp_ms: int, printer: str, state: SerializingState) -> list:
+    """
+    The windows and watermark of MultiResolutionAggregator.process, with the open windows of every resolution
+    as a list of dicts.
+    """
+    latest = state.get("latest_event_time")
+    if latest is None or timestamp_ms >= latest:
+        latest = timestamp_ms
+        state.set("latest_event_time", latest)
+    watermark = latest - grace_ms
+
+    rows = []
+    values = [float(value[field]) for field in fields]
+    for name, duration_ms in resolutions.items():
+        start = timestamp_ms - timestamp_ms % duration_ms
+        if start + duration_ms <= watermark:
+            continue  # dropped, its window is closed
+
+        windows = state.get(f"window_{name}", [])
+        window = next((window for window in windows if window["start"] == start), None)
+        if window is None:
+            window = {"start": start, "count": 1, "sum": values, "min": list(values), "max": list(values),
+                      "mean": list(values), "m2": [0.0] * len(values),
+                      "original_timestamp": value["original_timestamp"], "printer": printer}
+            windows.append(window)
+            windows.sort(key=lambda window: window["start"])
+        else:
+            window["count"] = count = window["count"] + 1
+            for i, x in enumerate(values):
+                window["sum"][i] += x
+                window["min"][i] = min(window["min"][i], x)
+                window["max"][i] = max(window["max"][i], x)
+                delta = x - window["mean"][i]
+                window["mean"][i] += delta / count
+                window["m2"][i] += delta * (x - window["mean"][i])
+
+        closed = 0
+        while closed < len(windows) and windows[closed]["start"] + duration_ms <= watermark:
+            rows.append(dict_row(name, windows[closed]))
+            closed += 1
+        state.set(f"window_{name}", windows[closed:])
+    return rows
+
+
+def run(process, state: SerializingState, messages: int) -> float:
+    start_ms = 1709304320000
+    started = time.perf_counter()
+    for i in range(messages):
+        # every 7th message is 3 seconds late, within the grace period
+        timestamp_ms = start_ms + i * 1000 - (3000 if i % 7 == 0 else 0)
+        value = {field: 20.0 + math.sin(i / 10 + j) for j, field in enumerate(fields)}
+        value["timestamp"] = value["original_timestamp"] = datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+        process(value, timestamp_ms, "Printer 1", state)
+    return (time.perf_counter() - started) / messages * 1e6
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    aggregator = MultiResolutionAggregator(fields, aggregates, resolutions, grace_ms)
+    variants = {
+        "reduce": (reduce_window, SerializingState(json_dumps, json_loads)),
+        "dict": (dict_window, SerializingState(json_dumps, json_loads)),
+        "packed": (aggregator.process, SerializingState(state_dumps, state_loads)),
+    }
+
+    print(f"{messages} messages, {len(fields)} fields, resolutions {', '.join(resolutions)}")
+    for name, (process, state) in variants.items():
+        microseconds = run(process, state, messages)
+        print(f"{name:>8}: {microseconds:6.2f} µs per message, {state.size():5d} bytes of state per printer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Metrics of the services: counters, gauges and histograms, served in the Prometheus text format and logged
+periodically, the consumer lag from the Kafka client statistics, and a sampling profiler.
+
+Metrics are created once, at startup, and updated from the processing functions: incrementing a counter is an
+attribute increment and observing a histogram a bisect over its bucket bounds, without locks (the consumer thread
+is the only writer, the exposition reads a snapshot). When the metrics are disabled, every metric is a no-op and
+'timed' and 'sized' return the functions they wrap as they are, so there is no cost at all.
+
+This module is the same in every service, a change to one copy goes to all of them.
+"""
+import atexit
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as SampleCounter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# seconds, from 10 microseconds to 10 seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# interval of the Kafka client statistics the consumer lag is read from
+statistics_interval_ms = 10000
+# seconds between two writes of the profile
+profile_write_interval = 60
+
+
+def exponential_buckets(start: float, factor: float, count: int) -> Tuple[float, ...]:
+    """
+    'count' bucket bounds from 'start', every one 'factor' times the previous one.
+    """
+    return tuple(start * factor ** i for i in range(count))
+
+
+class CounterValue:
+    __slots__ = ("value", "function")
+
+    def __init__(self, function: Optional[Callable[[], float]] = None):
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is above every bound
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, q: float, counts: List[int]) -> str:
+        """
+        The bound of the bucket of the 'q' quantile, from a snapshot of the counts.
+        """
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return f"<={bound:.3g}"
+        return f">{self.bounds[-1]:.3g}"
+
+
+class Family:
+    """
+    The values of a metric, one per combination of its labels.
+    """
+
+    def __init__(self, kind: str, name: str, help: str, label_names: Sequence[str], create: Callable[[], object]):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._create = create
+
+    def labels(self, *values):
+        """
+        The value of the metric for these label values, created the first time.
+        """
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} has the labels {self.label_names}, got {values}")
+            child = self.children[values] = self._create()
+        return child
+
+    def snapshot(self) -> List[Tuple[str, object]]:
+        """
+        The label string and value of every child.
+        """
+        return [(self.label_string(values), child) for values, child in list(self.children.items())]
+
+    def label_string(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _NullMetric:
+    """
+    The metrics when they are disabled: every update is ignored.
+    """
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def labels(self, *values):
+        return self
+
+
+null_metric = _NullMetric()
+
+
+def timed(function: Callable, histogram) -> Callable:
+    """
+    Wrap 'function' to observe the seconds every call takes in 'histogram'. The function itself if it's disabled.
+    """
+    if histogram is null_metric:
+        return function
+    bounds, counts = histogram.bounds, histogram.counts
+    perf_counter = time.perf_counter
+
+    # observes inline, it's called for every message
+    @functools.wraps(function)
+    def wrapper(*args):
+        started = perf_counter()
+        result = function(*args)
+        elapsed = perf_counter() - started
+        counts[bisect_left(bounds, elapsed)] += 1
+        histogram.sum += elapsed
+        return result
+    return wrapper
+
+
+def sized(function: Callable, histogram, sample_every: int = 1) -> Callable:
+    """
+    Wrap 'function' to observe the length of what it returns in 'histogram', for one call in every 'sample_every'.
+    The function itself if it's disabled.
+    """
+    if histogram is null_metric:
+        return function
+    bounds, counts = histogram.bounds, histogram.counts
+    calls = itertools.count()
+
+    @functools.wraps(function)
+    def wrapper(*args):
+        result = function(*args)
+        if not next(calls) % sample_every:
+            size = len(result)
+            counts[bisect_left(bounds, size)] += 1
+            histogram.sum += size
+        return result
+    return wrapper
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread every 'interval' seconds, from a background thread, and writes how many times
+    every stack was sampled to 'path', in the folded format of the flame graph tools (like flamegraph.pl
+    or speedscope). The sampled thread only pays for holding the GIL while its stack is read.
+    """
+
+    def __init__(self, interval: float, path: str, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.path = path
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples: SampleCounter = SampleCounter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self.write()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if stack:
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        next_write = time.monotonic() + profile_write_interval
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_write:
+                self.write()
+                next_write = time.monotonic() + profile_write_interval
+
+
+class Instrumentation:
+    """
+    The metrics of a service, their names prefixed with the service's. Nothing runs in the background
+    until 'start': the HTTP endpoint on 'port' (0 for none), the log of the metrics every 'log_interval' seconds
+    (0 for none) and the profiler sampling the thread calling 'start' every 'profiler_interval' seconds (0 for none).
+    """
+
+    def __init__(self, service: str, enabled: bool = True, port: int = 0, log_interval: float = 60,
+                 profiler_interval: float = 0, profiler_output: str = "profile.folded"):
+        self.service = service
+        self.enabled = enabled
+        self.port = port
+        self.log_interval = log_interval
+        self.profiler_interval = profiler_interval
+        self.profiler_output = profiler_output
+        self.families: Dict[str, Family] = {}
+        self._consumer_lag = self.gauge("consumer_lag_messages", "Messages behind the end of every partition consumed",
+                                        ("topic", "partition"))
+
+    @classmethod
+    def from_env(cls, service: str) -> "Instrumentation":
+        """
+        The instrumentation configured by the environment variables shared by the services.
+        """
+        return cls(service,
+                   enabled=os.getenv("metrics_enabled", "true").lower() not in ("false", "0", "no", "off"),
+                   port=int(os.getenv("metrics_port") or 0),
+                   log_interval=float(os.getenv("metrics_log_interval_seconds", "60")),
+                   profiler_interval=float(os.getenv("profiler_interval_ms", "0")) / 1000,
+                   profiler_output=os.getenv("profiler_output", "profile.folded"))
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (),
+                function: Optional[Callable[[], float]] = None):
+        """
+        A counter, or its family if it has labels. With 'function', its value is read from it.
+        """
+        return self._add("counter", name, help, labels, lambda: CounterValue(function))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None):
+        """
+        A gauge, or its family if it has labels. With 'function', its value is read from it.
+        """
+        return self._add("gauge", name, help, labels, lambda: GaugeValue(function))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labels: Sequence[str] = ()):
+        """
+        A histogram with these bucket bounds, or its family if it has labels.
+        """
+        bounds = tuple(sorted(buckets))
+        return self._add("histogram", name, help, labels, lambda: HistogramValue(bounds))
+
+    def _add(self, kind: str, name: str, help: str, labels: Sequence[str], create):
+        if not self.enabled:
+            return null_metric
+        name = f"{self.service}_{name}"
+        if name in self.families:
+            raise ValueError(f"The metric {name} already exists")
+        metric = self.families[name] = Family(kind, name, help, labels, create)
+        return metric if labels else metric.labels()
+
+    def consumer_config(self) -> dict:
+        """
+        The consumer options reporting the statistics of the Kafka client, for the consumer lag.
+        """
+        if not self.enabled:
+            return {}
+        return {"statistics.interval.ms": statistics_interval_ms, "stats_cb": self.on_statistics}
+
+    def on_statistics(self, statistics: str):
+        """
+        Read the consumer lag of every assigned partition from the statistics of the Kafka client.
+        """
+        children = {}
+        for topic, topic_statistics in json.loads(statistics).get("topics", {}).items():
+            for partition, partition_statistics in topic_statistics.get("partitions", {}).items():
+                consumer_lag = partition_statistics.get("consumer_lag", -1)
+                if partition != "-1" and consumer_lag >= 0:
+                    lag = children[(topic, partition)] = GaugeValue()
+                    lag.set(consumer_lag)
+        self._consumer_lag.children = children  # replaced at once, the partitions revoked are gone
+
+    def render(self) -> str:
+        """
+        All the metrics, in the Prometheus text format.
+        """
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in list(family.children.items()):
+                labels = family.label_string(values)
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{labels} {child.get()}")
+                    continue
+                counts = list(child.counts)
+                cumulative = 0
+                for bound, count in zip(child.bounds, counts):
+                    cumulative += count
+                    bucket = family.label_string(values, 'le="%g"' % bound)
+                    lines.append(f"{family.name}_bucket{bucket} {cumulative}")
+                total = cumulative + counts[-1]
+                bucket = family.label_string(values, 'le="+Inf"')
+                lines.append(f"{family.name}_bucket{bucket} {total}")
+                lines.append(f"{family.name}_sum{labels} {child.sum}")
+                lines.append(f"{family.name}_count{labels} {total}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        A line with the value of every counter and gauge, and the count, mean and quantiles of every histogram.
+        """
+        parts = []
+        for family in list(self.families.values()):
+            name = family.name[len(self.service) + 1:]
+            for labels, child in family.snapshot():
+                if family.kind == "histogram":
+                    counts = list(child.counts)
+                    total = sum(counts)
+                    if total:
+                        parts.append(f"{name}{labels} count={total} mean={child.sum / total:.3g} "
+                                     f"p50{child.quantile(0.5, counts)} p99{child.quantile(0.99, counts)}")
+                else:
+                    parts.append(f"{name}{labels}={child.get():g}")
+        return "; ".join(parts)
+
+    def start(self):
+        """
+        Serve the metrics, log them and start the profiler, as configured.
+        """
+        if self.enabled and self.port:
+            self._serve()
+            logger.info(f"Serving the metrics on port {self.port}")
+        if self.enabled and self.log_interval > 0:
+            threading.Thread(target=self._log, name="metrics-log", daemon=True).start()
+        if self.profiler_interval > 0:
+            SamplingProfiler(self.profiler_interval, self.profiler_output).start()
+            logger.info(f"Sampling the stack every {self.profiler_interval * 1000:g} ms to {self.profiler_output}")
+
+    def _serve(self):
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = instrumentation.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("", self.port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def _log(self):
+        while True:
+            time.sleep(self.log_interval)
+            summary = self.summary()
+            if summary:
+                logger.info(f"Metrics: {summary}")
@@ -1,8 +1,17 @@
 import os
-from quixstreams import Application
+from quixstreams import Application, State, message_context
+from quixstreams.models.rows import Row
+from quixstreams.state.rocksdb import RocksDBOptions
 from dotenv import load_dotenv
 import logging
-from datetime import timedelta
+import time
+from typing import List
+
+from aggregations import (MultiResolutionAggregator, event_time, parse_duration, parse_list, state_dumps,
+                          state_loads)
+from instrumentation import Instrumentation, exponential_buckets, sized, timed
+from tracing import traced_serializer
+from wire_format import WireDeserializer, value_serializer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,80 +19,133 @@ logger = logging.getLogger(__name__)
 with open("./.env", 'a+') as file: pass  # make sure the .env file exists
 load_dotenv("./.env")
 
-# Quix platform injects credentials automatically to the client.
-# Alternatively, you can always pass an SDK token manually as an argument when working locally.
-# Or set the relevant values in a .env file
-app = Application.Quix("transformation", auto_offset_reset="latest", use_changelog_topics=False)
-
-# Open the topics for input and output of data
-input_topic = app.topic(os.getenv("input", "3d-printer-data-json"), value_deserializer="json")
-output_topic = app.topic(os.getenv("output", "downsampled-3d-printer-data-json"), value_serializer="json")
-
-sdf = app.dataframe(input_topic)  # initialize the streaming dataframe
-sdf = sdf[sdf.contains("printer")] # ensure the column "printer" exists in the incomming data
-
-
-def reducer(state: dict, value: dict) -> dict:
+instrumentation = Instrumentation.from_env("downsampling")
+processing_seconds = instrumentation.histogram("processing_seconds", "Time to aggregate a message")
+window_messages = instrumentation.histogram("window_messages", "Messages in every window closed",
+                                            exponential_buckets(1, 2, 16), labels=("resolution",))
+# the keys and values are serialized by the same function, one in every 16 of them is measured
+state_bytes = instrumentation.histogram("state_bytes", "Size of the keys and values serialized to the state",
+                                        exponential_buckets(16, 2, 12))
+late_messages = instrumentation.counter("late_messages_total", "Messages added to their window out of order",
+                                        labels=("resolution",))
+dropped_messages = instrumentation.counter("dropped_messages_total", "Messages dropped, their window was closed",
+                                           labels=("resolution",))
+
+# The windows are packed records in state, stored as they are by 'state_dumps'
+rocksdb_options = RocksDBOptions(dumps=sized(state_dumps, state_bytes, 16), loads=state_loads)
+
+# the fields to aggregate, the aggregates to compute for each of them and the window sizes
+fields = parse_list(os.getenv("fields", "hotend_temperature,bed_temperature,ambient_temperature,fluctuated_ambient_temperature"))
+aggregates = parse_list(os.getenv("aggregates", "mean,min,max,stddev"))
+resolutions = {name: parse_duration(name) for name in parse_list(os.getenv("resolutions", "10s,1m,1h"))}
+
+# the event time of the messages, the windows are closed once the latest event time of the printer
+# is 'grace_period' past their end
+timestamp_field = os.getenv("timestamp_field", "timestamp")
+grace_period = parse_duration(os.getenv("grace_period", "0s"))
+# "final" writes every window once it's closed, "early" also writes its partial aggregates as messages are added
+emit_mode = os.getenv("emit_mode", "final")
+early_emit_interval = parse_duration(os.getenv("early_emit_interval", "0s"))
+late_data_report_interval = int(os.getenv("late_data_report_interval_seconds", "60"))
+
+input_topic_name = os.getenv("input", "3d-printer-data-json")
+output_topic_name = os.getenv("output", "downsampled-3d-printer-data-json")
+wire_format = os.getenv("wire_format", "json")
+
+if emit_mode not in ("final", "early"):
+    raise ValueError(f"Unknown emit_mode '{emit_mode}', expected final or early")
+aggregator = MultiResolutionAggregator(fields, aggregates, resolutions, grace_period,
+                                       emit_mode == "early", early_emit_interval)
+
+# the Forecast Service and the InfluxDB sink read the mean_<field> columns in their default configuration
+if "mean" not in aggregates:
+    logger.error(f"The aggregates {', '.join(aggregates)} don't have mean: the Forecast Service drops the rows "
+                 f"without the mean_<field> columns it forecasts, and the InfluxDB sink doesn't write them")
+next_late_data_report = time.monotonic() + late_data_report_interval
+
+
+def aggregate(value: dict, state: State) -> List[dict]:
     """
-    'reducer' will be called for every message except the first.
-    We add the values to sum them so we can later divide by the 
-    count to get an average.
+    Add the message to the tumbling window of every resolution, in the state of its key (the printer),
+    at the event time of its 'timestamp_field', or its Kafka timestamp if it doesn't have it.
+    Returns a row per window closed by this message, with the aggregates of every field,
+    the start of the window as 'timestamp' and the message count, and a partial row per window in "early" mode.
     """
+    context = message_context()
+    printer = context.key.decode() if isinstance(context.key, bytes) else value["printer"]
+    rows = aggregator.process(value, event_time(value, timestamp_field, context.timestamp.milliseconds), printer, state)
+    for row in rows:
+        if row.get("final", True):
+            window_messages.labels(row["resolution"]).observe(row["count"])
+    report_late_data()
+    return rows
 
-    state['sum_hotend_temperature'] += value['hotend_temperature']
-    state['sum_bed_temperature'] += value['bed_temperature']
-    state['sum_ambient_temperature'] += value['ambient_temperature']
-    state['sum_fluctuated_ambient_temperature'] += value['fluctuated_ambient_temperature']
-    state['sum_count'] += 1
-    return state
 
-def initializer(value: dict) -> dict:
+def report_late_data():
     """
-    'initializer' will be called only for the first message.
-    This is the time to create and initialize the state for 
-    use in the reducer funciton.
+    Log the messages added to their windows out of order and the ones dropped since the last report.
     """
-
-    return {
-        'sum_hotend_temperature': value['hotend_temperature'],
-        'sum_bed_temperature': value['bed_temperature'],
-        'sum_ambient_temperature': value['ambient_temperature'],
-        'sum_fluctuated_ambient_temperature': value['fluctuated_ambient_temperature'],
-        'sum_timestamp': value['timestamp'],
-        'sum_original_timestamp': value['original_timestamp'],
-        'sum_printer': value['printer'],
-        'sum_count': 1
+    global next_late_data_report
+    if time.monotonic() < next_late_data_report:
+        return
+    next_late_data_report = time.monotonic() + late_data_report_interval
+
+    for resolution, count in aggregator.late.items():
+        late_messages.labels(resolution).inc(count)
+    for resolution, count in aggregator.dropped.items():
+        dropped_messages.labels(resolution).inc(count)
+    if aggregator.late or aggregator.dropped:
+        logger.info(f"Late messages in the last {late_data_report_interval}s, per resolution: "
+                    f"added {dict(aggregator.late)}, dropped {dict(aggregator.dropped)}")
+        aggregator.late.clear()
+        aggregator.dropped.clear()
+
+
+def build_pipeline(app: Application):
+    """
+    The topics and the streaming dataframe of the service, on 'app'.
+    """
+    # Open the topics for input and output of data
+    # the first resolution goes to the "output" topic, the others to the "output_<resolution>" topics
+    # the input is read in JSON or binary, by the header of every message, the output is written in 'wire_format'
+    # with the trace of the message closing the window
+    input_topic = app.topic(input_topic_name, value_deserializer=WireDeserializer())
+    output_format = traced_serializer(value_serializer(wire_format), "downsampling")
+    output_topics = {
+        name: app.topic(output_topic_name if i == 0 else os.getenv(f"output_{name}", f"{output_topic_name}-{name}"),
+                        value_serializer=output_format)
+        for i, name in enumerate(resolutions)
     }
 
-# create a tumbling window of 10 seconds
-# use the reducer and initializer configured above
-# get the 'final' values for the window once the window is closed.
-sdf = (
-    sdf.tumbling_window(timedelta(seconds=10))
-    .reduce(reducer=reducer, initializer=initializer)
-    .final()
-)
-
-def get_mean(row: dict, key: str):
-    return row["value"][key] / row["value"]["sum_count"]
-
-
-# use the reduced values
-sdf = sdf.apply(lambda row: {
-    "timestamp": row["start"],
-    "mean_hotend_temperature": get_mean(row, "sum_hotend_temperature"),
-    "mean_bed_temperature": get_mean(row, "sum_bed_temperature"),
-    "mean_ambient_temperature": get_mean(row, "sum_ambient_temperature"),
-    "mean_fluctuated_ambient_temperature": get_mean(row, "sum_fluctuated_ambient_temperature"),
-    "original_timestamp": row["value"]["sum_original_timestamp"],
-    "count": row["value"]["sum_count"],
-    "printer": row["value"]["sum_printer"]
-})
-
-sdf = sdf.to_topic(output_topic)  # publish to the desired output topic 
+    sdf = app.dataframe(input_topic)  # initialize the streaming dataframe
+    sdf = sdf[sdf.contains("printer")] # ensure the column "printer" exists in the incomming data
+    sdf = sdf.filter(lambda value: all(value.get(field) is not None for field in fields))  # and the fields to aggregate
+
+    def publish(row: dict):
+        """
+        Publish the row of a window to the topic of its resolution, with the message key.
+        """
+        sdf.producer.produce_row(Row(value=row, context=message_context()), output_topics[row["resolution"]])
+
+    sdf = sdf.apply(timed(aggregate, processing_seconds), stateful=True, expand=True)
+    sdf = sdf.update(publish)  # publish to the topic of every resolution
+    return sdf
+
+
+def main():
+    # Quix platform injects credentials automatically to the client.
+    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
+    # Or set the relevant values in a .env file
+    app = Application.Quix("transformation", auto_offset_reset="latest", use_changelog_topics=False,
+                           rocksdb_options=rocksdb_options, consumer_extra_config=instrumentation.consumer_config())
+    sdf = build_pipeline(app)
+    instrumentation.start()
 
-if __name__ == "__main__":
     try:
         app.run(sdf)
     except Exception as e:
-        logger.exception("An error occurred while running the application.")
\ No newline at end of file
+        logger.exception("An error occurred while running the application.")
+
+
+if __name__ == "__main__":
+    main()
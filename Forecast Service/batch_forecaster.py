@@ -0,0 +1,116 @@
+import math
+import time
+from concurrent.futures import Executor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from forecasters import forecast_batch, sklearn_forecast
+from models import PolynomialModel
+from rolling_history import PrinterModels
+
+# kinds of inputs kept for a field until the batch is made
+STATS = "stats"  # running sums of a numpy polynomial, solved with the others of the batch
+VALUES = "values"  # history values of a sklearn polynomial, fitted with the others of the batch
+FORECAST = "forecast"  # the other models forecast cheaply from what they fitted, when the request is added
+
+
+class ForecastRequest(NamedTuple):
+    printer: str
+    timestamp: int
+    # latest value of every field
+    current: Dict[str, float]
+    # snapshot of every field when the request was made, as (kind, data)
+    inputs: Dict[str, Tuple[str, object]]
+    # trace context of the message of the request
+    trace: Optional[str] = None
+
+
+def sklearn_forecasts(histories: List[np.ndarray], degree: int, length: int) -> List[np.ndarray]:
+    """
+    Fit a scikit-learn polynomial pipeline on every history and forecast the 'length' following values.
+    It's a module function so a process pool can run it.
+    """
+    return [sklearn_forecast(values, degree, length) for values in histories]
+
+
+class ForecastBatcher:
+    """
+    Collects the forecasts to make for many printers and makes them together, once there are
+    'batch_size' of them or 'interval_seconds' after the first one. For the numpy polynomials, the running sums
+    of all the histories are stacked and the fits solved in one vectorized call. The sklearn polynomials are fitted
+    in 'executor' (a process pool) if there is one, split in a chunk per worker.
+
+    The batch is made when a request is added, so the last requests wait for the next message. The requests waiting
+    are only in memory: the offsets of their messages are committed before their forecasts are made, so they are
+    lost on a crash or a rebalance, up to 'batch_size' of them.
+    Forecasts are returned in the order of the requests.
+    """
+
+    def __init__(self, length: int, batch_size: int, interval_seconds: float,
+                 executor: Optional[Executor] = None, workers: int = 1):
+        self.length = length
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.executor = executor
+        self.workers = workers
+
+        self._requests: List[ForecastRequest] = []
+        self._degrees: Dict[str, int] = {}
+        self._first_added = 0.0
+
+    def add(self, printer: str, timestamp: int, models: PrinterModels,
+            trace: Optional[str] = None) -> List[Tuple[ForecastRequest, Dict[str, np.ndarray]]]:
+        """
+        Add the forecast of the printer, and return every request of the batch with its forecasts if it is ready.
+        """
+        if not self._requests:
+            self._first_added = time.monotonic()
+
+        inputs = {}
+        for field, model in models.models.items():
+            history = models.histories[field]
+            if isinstance(model, PolynomialModel):
+                self._degrees[field] = model.degree
+                if model.backend == "numpy":
+                    inputs[field] = (STATS, list(model.stats))
+                else:
+                    inputs[field] = (VALUES, history.to_array())
+            else:
+                inputs[field] = (FORECAST, model.forecast(history, self.length))
+        self._requests.append(ForecastRequest(printer, timestamp, models.current(), inputs, trace))
+
+        if len(self._requests) >= self.batch_size or time.monotonic() - self._first_added >= self.interval_seconds:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[ForecastRequest, Dict[str, np.ndarray]]]:
+        requests, self._requests = self._requests, []
+        forecasts: List[Dict[str, np.ndarray]] = [{} for _ in requests]
+
+        for field in (requests[0].inputs if requests else ()):
+            for kind in (STATS, VALUES, FORECAST):
+                indexes = [i for i, request in enumerate(requests) if request.inputs[field][0] == kind]
+                if not indexes:
+                    continue
+
+                inputs = [requests[i].inputs[field][1] for i in indexes]
+                if kind == STATS:
+                    values = forecast_batch(np.array(inputs), self._degrees[field], self.length)
+                elif kind == VALUES:
+                    values = self._sklearn_forecasts(inputs, self._degrees[field])
+                else:
+                    values = inputs
+                for i, field_values in zip(indexes, values):
+                    forecasts[i][field] = field_values
+
+        return list(zip(requests, forecasts))
+
+    def _sklearn_forecasts(self, histories: List[np.ndarray], degree: int) -> List[np.ndarray]:
+        if self.executor is None:
+            return sklearn_forecasts(histories, degree, self.length)
+
+        chunk_size = math.ceil(len(histories) / self.workers)
+        chunks = [histories[i:i + chunk_size] for i in range(0, len(histories), chunk_size)]
+        results = self.executor.map(sklearn_forecasts, chunks, [degree] * len(chunks), [self.length] * len(chunks))
+        return [values for chunk in results for values in chunk]
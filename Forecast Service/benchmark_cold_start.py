@@ -0,0 +1,69 @@
+"""
+Measure the cold start of the service: the time from starting a new Python process to the first forecast,
+and the memory it takes, for every forecast backend.
+
+    python benchmark_cold_start.py [runs]
+
+Every run starts a new process that imports main.py, fills a history and makes one forecast, like a new replica
+does with the first message of a printer. Kafka is not involved, so it measures the service's own startup.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+service_folder = os.path.dirname(os.path.abspath(__file__))
+
+child_code = """
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+import main
+from rolling_history import PrinterModels, RollingHistory
+
+histories, models = {}, {}
+for field, model in main.forecast_fields.items():
+    history = histories[field] = RollingHistory(main.history_length)
+    for i in range(main.history_length):
+        history.append(20.0 + i / 100)
+    models[field] = main.create_model(model, main.model_parameters)
+    models[field].warm_start(history)
+main.on_message_handler(PrinterModels(histories, models), 0, "printer")
+
+print(json.dumps({
+    "imports": main.imported - main.started,
+    "first_forecast": time.monotonic() - main.started,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def run(backend: str, workdir: str) -> dict:
+    env = dict(os.environ, forecast_backend=backend)
+    start = time.monotonic()
+    output = subprocess.run([sys.executable, "-c", child_code, service_folder], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_to_first_forecast"] = time.monotonic() - start
+    return result
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    # main.py creates a .env file in the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in ("numpy", "sklearn"):
+            run(backend, workdir)  # warm the file system cache, to measure the startup and not the disk
+            results = [run(backend, workdir) for _ in range(runs)]
+            print(f"{backend}: "
+                  + ", ".join(f"{name} {statistics.median(result[name] for result in results):.3f}"
+                              for name in ("imports", "first_forecast", "process_to_first_forecast"))
+                  + f" seconds, max RSS {statistics.median(result['max_rss_mb'] for result in results):.0f} MB"
+                  + f" (median of {runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from functools import lru_cache
+from math import comb
+from typing import List
+
+import numpy as np
+
+
+def init_stats(degree: int) -> List[float]:
+    """
+    Running sums of a polynomial fit where x is the index of the value (0, 1, 2...):
+    sum(x^k) for k in 0..2*degree, followed by sum(x^k * y) for k in 0..degree.
+    They are plain floats so they can be kept in state.
+    """
+    return [0.0] * (3 * degree + 2)
+
+
+def update_stats(stats: List[float], degree: int, y: float) -> List[float]:
+    """
+    Add the next value to the running sums, in O(degree).
+    """
+    x = stats[0]  # sum(x^0) is the number of values added so far
+    xy_offset = 2 * degree + 1
+    power = 1.0
+    for k in range(xy_offset):
+        stats[k] += power
+        if k <= degree:
+            stats[xy_offset + k] += power * y
+        power *= x
+    return stats
+
+
+@lru_cache()
+def _shift_terms(degree: int) -> List[List[tuple]]:
+    """
+    (j, coefficient) pairs expanding (x - 1)^k as a sum of x^j, for k in 0..degree.
+    """
+    return [[(j, comb(k, j) * (-1) ** (k - j)) for j in range(k + 1)] for k in range(degree + 1)]
+
+
+def slide_stats(stats: List[float], degree: int, oldest: float, y: float) -> List[float]:
+    """
+    Remove the oldest value (x = 0) from full running sums and add the next one, in O(degree^2).
+    The remaining values move one index down, so sum(x^k * y) is re-expanded with the binomial terms
+    of (x - 1)^k. The sums of x^k don't change as the indexes are the same once the value is added.
+    Rounding errors add up over many slides, rebuild the sums from the values from time to time.
+    """
+    xy_offset = 2 * degree + 1
+    xy_sums = stats[xy_offset:]
+    xy_sums[0] -= oldest
+    for k, terms in enumerate(_shift_terms(degree)):
+        stats[xy_offset + k] = sum(coefficient * xy_sums[j] for j, coefficient in terms)
+
+    x = stats[0] - 1  # index of the new value
+    power = 1.0
+    for k in range(degree + 1):
+        stats[xy_offset + k] += power * y
+        power *= x
+    return stats
+
+
+def fit(stats: List[float], degree: int) -> np.ndarray:
+    """
+    Solve the normal equations of the least squares fit from the running sums.
+    Like sklearn's LinearRegression, the features are centered and the intercept is computed apart,
+    so the results match when there are fewer values than coefficients too.
+    Centering from the running sums loses precision for high degrees over long windows
+    (degree 3 over thousands of values), use the sklearn backend for those.
+    Returns the coefficients, lowest degree first.
+    """
+    sums = np.asarray(stats)
+    x_sums = sums[:2 * degree + 1]
+    xy_sums = sums[2 * degree + 1:]
+    n = x_sums[0]
+
+    powers = np.arange(1, degree + 1)
+    covariance = x_sums[powers[:, None] + powers[None, :]] - np.outer(x_sums[powers], x_sums[powers]) / n
+    cross_covariance = xy_sums[powers] - x_sums[powers] * xy_sums[0] / n
+    coefficients = np.linalg.lstsq(covariance, cross_covariance, rcond=None)[0]
+
+    intercept = (xy_sums[0] - x_sums[powers] @ coefficients) / n
+    return np.concatenate(([intercept], coefficients))
+
+
+def forecast(stats: List[float], degree: int, length: int) -> np.ndarray:
+    """
+    Forecast the 'length' values following the ones in the running sums.
+    """
+    start = int(stats[0])
+    x = np.arange(start, start + length, dtype=float)
+    return np.polynomial.polynomial.polyval(x, fit(stats, degree))
+
+
+def fit_batch(stats: np.ndarray, degree: int) -> np.ndarray:
+    """
+    'fit' for a batch of running sums stacked in rows, solved in one vectorized call.
+    Every row must have more values than the degree. Returns one row of coefficients per row of sums.
+    """
+    x_sums = stats[:, :2 * degree + 1]
+    xy_sums = stats[:, 2 * degree + 1:]
+    n = x_sums[:, :1]
+
+    powers = np.arange(1, degree + 1)
+    x_power_sums = x_sums[:, powers]
+    covariance = (x_sums[:, powers[:, None] + powers[None, :]]
+                  - x_power_sums[:, :, None] * x_power_sums[:, None, :] / n[:, :, None])
+    cross_covariance = xy_sums[:, powers] - x_power_sums * xy_sums[:, :1] / n
+    coefficients = np.linalg.solve(covariance, cross_covariance[:, :, None])[:, :, 0]
+
+    intercept = (xy_sums[:, 0] - np.einsum("ij,ij->i", x_power_sums, coefficients)) / n[:, 0]
+    return np.concatenate((intercept[:, None], coefficients), axis=1)
+
+
+def forecast_batch(stats: np.ndarray, degree: int, length: int) -> np.ndarray:
+    """
+    'forecast' for a batch of running sums stacked in rows, returns one row of 'length' values per row of sums.
+    """
+    coefficients = fit_batch(stats, degree)
+    x = stats[:, :1] + np.arange(length)  # the values follow the last index of every row
+    return np.einsum("ijk,ik->ij", x[:, :, None] ** np.arange(degree + 1), coefficients)
+
+
+def sklearn_forecast(values: np.ndarray, degree: int, length: int) -> np.ndarray:
+    """
+    Fit a scikit-learn polynomial pipeline on the values and forecast the 'length' following values.
+    scikit-learn takes over a second to import, it's only imported by the first call.
+    """
+    from sklearn.linear_model import LinearRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import PolynomialFeatures
+
+    # Create a polynomial regression model
+    model = make_pipeline(PolynomialFeatures(degree), LinearRegression())
+    # Fit the model to the data
+    model.fit(np.arange(len(values)).reshape(-1, 1), values)
+    # Forecast the future values
+    return model.predict(np.arange(len(values), len(values) + length).reshape(-1, 1))
@@ -1,107 +1,311 @@
-from quixstreams import Application
+import time
+started = time.monotonic()  # before the other imports, to include them in the startup time
+
+from quixstreams import Application, State, message_context, message_key
+from quixstreams.state.rocksdb import RocksDBOptions
+from quixstreams.utils.json import dumps as json_dumps
 from dotenv import load_dotenv
 
 import logging
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
+from typing import Dict, Optional
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import PolynomialFeatures
-
-from typing import List
+from batch_forecaster import ForecastBatcher
+from instrumentation import Instrumentation, exponential_buckets, sized, timed
+from models import create_model
+from rolling_history import HistoryStore, PrinterModels
+from tracing import TRACE_FIELD, read_trace, traced_serializer, tracing_enabled
+from wire_format import WireDeserializer, value_serializer
 
 with open("./.env", 'a+') as file: pass  # make sure the .env file exists
 load_dotenv("./.env") # load environment variables from .env file for local dev
 
+imported = time.monotonic()
+
 # Assigning environ vars to local variables
 topic_input = os.getenv("input", "downsampled-3d-printer-data-json")
 topic_output = os.getenv("output", "forecast")
 
 forecast_length = int(os.getenv('forecast_length', "5"))
+# number of downsampled values kept per printer to fit the forecast on
+history_length = int(os.getenv("history_length", "120"))
+
+
+def parse_forecast_fields(value: str) -> Dict[str, str]:
+    """
+    Parse "field:model,field:model" into {field: model}, the model is a polynomial if it's omitted.
+    """
+    fields = {}
+    for item in value.split(","):
+        field, _, model = item.strip().partition(":")
+        fields[field] = model or "polynomial"
+    return fields
+
+
+# the fields to forecast and their models, the forecast of the first one is the message's "forecast"
+forecast_fields = parse_forecast_fields(os.getenv("forecast_fields", "mean_fluctuated_ambient_temperature:polynomial"))
+primary_field = next(iter(forecast_fields))
+
+# "numpy" fits the polynomial from running sums kept with the history, "sklearn" fits it on the history values
+forecast_backend = os.getenv("forecast_backend", "numpy")
+# Define the degree of the polynomial regression model
+degree = int(os.getenv("polynomial_degree", "2"))
+
+model_parameters = {
+    "polynomial": {"degree": degree, "backend": forecast_backend},
+    "holt": {"alpha": float(os.getenv("holt_alpha", "0.5")), "beta": float(os.getenv("holt_beta", "0.1"))},
+    "ar": {"order": int(os.getenv("ar_order", "3")), "refit_interval": int(os.getenv("ar_refit_interval", "10"))},
+}
+
+# printers whose fitted models are kept in memory, the others are warm started from their history in state
+model_cache_size = int(os.getenv("model_cache_size", "10000"))
+model_cache_ttl_seconds = float(os.getenv("model_cache_ttl_seconds", "3600"))
+
+# "single" forecasts every row when it's received, "batch" collects the forecasts of many printers to make them together
+forecast_mode = os.getenv("forecast_mode", "single")
+forecast_batch_size = int(os.getenv("forecast_batch_size", "500"))
+forecast_batch_interval_ms = int(os.getenv("forecast_batch_interval_ms", "200"))
+# processes fitting the sklearn models of a batch, 0 to fit them on the consumer thread
+forecast_workers = int(os.getenv("forecast_workers", "0"))
+
+# format of the forecasts, "json" or "binary"
+wire_format = os.getenv("wire_format", "json")
+
+late_data_report_interval = int(os.getenv("late_data_report_interval_seconds", "60"))
 
 debug = os.getenv("debug", False)
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG if debug else logging.INFO)
 logger = logging.getLogger(__name__)
 
+instrumentation = Instrumentation.from_env("forecast")
+processing_seconds = instrumentation.histogram("processing_seconds", "Time to process a down-sampled row")
+# per forecast in "single" mode, per batch in "batch" mode
+fit_seconds = instrumentation.histogram("fit_seconds", "Time to update the models and forecast")
+# the keys and values are serialized by the same function, one in every 16 of them is measured
+state_bytes = instrumentation.histogram("state_bytes", "Size of the keys and values serialized to the state",
+                                        exponential_buckets(4, 2, 12))
+late_rows_dropped = instrumentation.counter("late_rows_total", "Rows dropped, out of event time order")
+# set once, by log_startup_time and log_first_forecast
+startup_seconds = instrumentation.gauge("startup_seconds", "Time from the start to running the application")
+first_forecast_seconds = instrumentation.gauge("first_forecast_seconds", "Time from the start to the first forecast")
+
+# the default serialization of the state, with the size of the values written
+rocksdb_options = RocksDBOptions(dumps=sized(json_dumps, state_bytes, 16))
+
 # 
-def on_message_handler(rows: List[dict]):
+def on_message_handler(models: PrinterModels, timestamp: int, printer: str):
+    """
+    Run the prediction with the model of every field, from what they fitted on the previous values
+    Output a list of objects with timestamp, printer and forecast
+    """
+    return to_forecast_rows(timestamp, models.forecast(forecast_length), models.current(), printer)
+
+
+late_rows = 0
+next_late_data_report = time.monotonic() + late_data_report_interval
+
+
+def in_event_time_order(row: dict, state: State) -> bool:
+    """
+    The histories are in event time order, a row not after the latest one of its printer (a late or repeated window)
+    is dropped rather than appended, and counted. The number dropped is logged every 'late_data_report_interval'.
     """
-    Run the prediciton using the sklearn
-    Output a list of objects with timestamp and forecast
+    global late_rows, next_late_data_report
+    latest = state.get("latest_timestamp")
+    in_order = latest is None or row["timestamp"] > latest
+    if in_order:
+        state.set("latest_timestamp", row["timestamp"])
+    else:
+        late_rows += 1
+        late_rows_dropped.inc()
+        logger.debug(f"Dropping a row of {row['printer']} at {row['timestamp']}, not after {latest}")
+
+    if late_rows and time.monotonic() >= next_late_data_report:
+        logger.info(f"Dropped {late_rows} rows out of event time order in the last {late_data_report_interval}s")
+        late_rows = 0
+        next_late_data_report = time.monotonic() + late_data_report_interval
+    return in_order
+
+
+missing_fields_logged = False
+
+
+def has_forecast_fields(row: dict) -> bool:
+    """
+    True if the row has the printer and every forecasted field. The first row without them is logged, the
+    down-sampling may not write the aggregate of a field, and none of its rows would be forecasted.
     """
+    global missing_fields_logged
+    if "printer" in row and all(field in row for field in forecast_fields):
+        return True
+    if not missing_fields_logged:
+        missing = [field for field in ("printer", *forecast_fields) if field not in row]
+        logger.error(f"Dropping the rows without {', '.join(missing)}, check the aggregates of the down-sampling "
+                     f"and forecast_fields. Only this row is logged: {row}")
+        missing_fields_logged = True
+    return False
+
+
+def log_startup_time():
+    startup_time = time.monotonic() - started
+    startup_seconds.set(startup_time)
+    logger.info(f"Startup took {startup_time:.2f} seconds, {imported - started:.2f} of them to import the modules")
 
-    forecast_input = list(map(lambda row: row["mean_fluctuated_ambient_temperature"], rows))
 
-    # Define the degree of the polynomial regression model
-    degree = 2
-    # Create a polynomial regression model
-    model = make_pipeline(PolynomialFeatures(degree), LinearRegression())
-    # Fit the model to the data
-    model.fit(np.array(range(len(forecast_input))).reshape(-1, 1), forecast_input)
-    # Forecast the future values
-    forecast_array = np.array(range(len(forecast_input), len(forecast_input) + forecast_length)).reshape(-1, 1)
-    forecast_values = model.predict(forecast_array)
+first_forecast_time: Optional[float] = None
 
+
+def log_first_forecast(row: dict):
+    """
+    Log the time from the start to the first forecast once, it includes the time to restore the state
+    and to load the model backend.
+    """
+    global first_forecast_time
+    if first_forecast_time is None:
+        first_forecast_time = time.monotonic() - started
+        first_forecast_seconds.set(first_forecast_time)
+        logger.info(f"First forecast {first_forecast_time:.2f} seconds after the start")
+
+
+def to_forecast_rows(timestamp, forecasts: Dict[str, np.ndarray], current: Dict[str, float], printer: str):
+    """
+    A row per forecasted step, with its position in the forecast so the steps can be put back together,
+    and the latest value of the fields for the alerts on the current values.
+    """
     result = []
-    timestamp = rows[-1]["timestamp"]
 
-    for value in forecast_values:
+    for step, value in enumerate(forecasts[primary_field]):
         timestamp += 60 * 1000
-        result.append({
+        row = {
             "timestamp": timestamp,
-            "forecast": float(value)
-        })
+            "printer": printer,
+            "forecast": float(value),
+            "forecast_index": step,
+            "forecast_length": forecast_length
+        }
+        for field, values in forecasts.items():
+            row[f"forecast_{field}"] = float(values[step])
+            row[f"current_{field}"] = current[field]
+        result.append(row)
     return result
 
 
-if __name__ == "__main__":
-   
-    # Quix platform injects credentials automatically to the client.
-    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
-    # Or set the relevant values in a .env file
-    app = Application.Quix("transformation", auto_offset_reset="earliest", use_changelog_topics=False)
-
-    # Change consumer group to a different constant if you want to run model locally.
+def build_pipeline(app: Application):
+    """
+    The topics and the streaming dataframe of the service, on 'app'.
+    """
     logger.info("Opening input and output topics")
 
     # Open the topics for input and output of data
-    input_topic = app.topic(topic_input, value_deserializer="json")
-    producer_topic = app.topic(topic_output, value_serializer="json")
+    # the input is read in JSON or binary, by the header of every message, the output is written in 'wire_format'
+    # with the trace of the row forecasted from
+    input_topic = app.topic(topic_input, value_deserializer=WireDeserializer())
+    producer_topic = app.topic(topic_output,
+                               value_serializer=traced_serializer(value_serializer(wire_format), "forecast"))
 
     # Hook up to termination signal (for docker image) and CTRL-C
     logger.info("Listening to streams. Press CTRL-C to exit.")
 
     sdf = app.dataframe(input_topic)  # initialize the streaming dataframe
 
-    sdf = sdf[sdf.contains("mean_fluctuated_ambient_temperature")]  # ensure the column exists in the incomming data
+    # ensure the columns exist in the incomming data
+    sdf = sdf.filter(has_forecast_fields)
+    # only the final rows of the windows, when the down-sampling also writes partial ones
+    sdf = sdf.filter(lambda row: row.get("final", True))
 
-    sdf = sdf[["timestamp", "mean_fluctuated_ambient_temperature"]]  # select only these coluns for processing
+    sdf = sdf[["timestamp", "printer", *forecast_fields]]  # select only these coluns for processing
 
-    # reducer appends all but first rows values (in this window) to state
-    def reducer(state: list, row: dict):
-        state.append(row)
-        return state
+    histories = HistoryStore(history_length,
+                             {field: partial(create_model, model, model_parameters)
+                              for field, model in forecast_fields.items()},
+                             model_cache_size, model_cache_ttl_seconds)
+    instrumentation.gauge("models_in_memory", "Printers with their models in memory", function=histories.__len__)
 
-    # init initializes the state arrays with the first value
-    def reducer_init(row: dict):
-        return [row]
+    # add the row's values to the rolling histories of its printer and forecast from the updated models
+    # the state is kept per message key, the printer
+    def rolling_forecast(row: dict, state: State):
+        if not in_event_time_order(row, state):
+            return []
+        fit_started = time.perf_counter()
+        models = histories.append(message_key(), state, row)
+        if not models.is_ready():
+            return []  # not enough values to fit the models yet
 
-    # apply the reducer funciton
-    sdf = sdf.tumbling_window(5000).reduce(reducer, reducer_init).final()
+        rows = on_message_handler(models, row["timestamp"], row["printer"])
+        fit_seconds.observe(time.perf_counter() - fit_started)
+        return rows
 
-    # now handle the output from the above stage which will be like {value: {key:value}}
-    sdf = sdf.apply(lambda row: on_message_handler(row["value"]), expand=True)
+    if forecast_mode == "batch":
+        executor = None
+        if forecast_workers > 0:
+            # spawned rather than forked, the Kafka client threads are already running
+            executor = ProcessPoolExecutor(forecast_workers, mp_context=multiprocessing.get_context("spawn"))
+        batcher = ForecastBatcher(forecast_length, forecast_batch_size, forecast_batch_interval_ms / 1000,
+                                  executor, forecast_workers)
+
+        tracing = tracing_enabled()
+
+        # the rows of a batch are for many printers, every row is published with the key and the trace of its printer
+        def batched_forecast(row: dict, state: State):
+            if not in_event_time_order(row, state):
+                return []
+            models = histories.append(message_key(), state, row)
+            if not models.is_ready():
+                return []  # not enough values to fit the models yet
+
+            fit_started = time.perf_counter()
+            trace = read_trace(message_context().headers) if tracing else None
+            forecasts = batcher.add(row["printer"], row["timestamp"], models, trace)
+            if forecasts:
+                fit_seconds.observe(time.perf_counter() - fit_started)
+            rows = []
+            for request, field_forecasts in forecasts:
+                for forecast_row in to_forecast_rows(request.timestamp, field_forecasts, request.current,
+                                                     request.printer):
+                    if request.trace is not None:
+                        forecast_row[TRACE_FIELD] = request.trace
+                    rows.append(forecast_row)
+            return rows
+
+        # forecast batches of rows, the output will be a row per forecasted value of every row in the batch
+        sdf = sdf.apply(timed(batched_forecast, processing_seconds), stateful=True, expand=True)
+    else:
+        # forecast on every row, the output will be a row per forecasted value
+        sdf = sdf.apply(timed(rolling_forecast, processing_seconds), stateful=True, expand=True)
 
     # convert the timestamps to human readable
     sdf["timestamp"] = sdf["timestamp"].apply(lambda epoch: str(datetime.fromtimestamp(epoch/1000)))
 
-    sdf = sdf.update(lambda message: print(message))
+    sdf = sdf.update(log_first_forecast)
+
+    # every forecast row is logged at the debug level, the step isn't added otherwise
+    if logger.isEnabledFor(logging.DEBUG):
+        sdf = sdf.update(lambda message: logger.debug(f"Forecast: {message}"))
+
+    # publish the data resulting from this pipline to the topic, keyed by printer to partition the alerts by printer
+    sdf = sdf.to_topic(producer_topic, key=lambda row: row["printer"].encode())
+    return sdf
+
+
+if __name__ == "__main__":
+   
+    # Quix platform injects credentials automatically to the client.
+    # Alternatively, you can always pass an SDK token manually as an argument when working locally.
+    # Or set the relevant values in a .env file
+    app = Application.Quix("transformation", auto_offset_reset="earliest", use_changelog_topics=False,
+                           rocksdb_options=rocksdb_options, consumer_extra_config=instrumentation.consumer_config())
+
+    # Change consumer group to a different constant if you want to run model locally.
+    sdf = build_pipeline(app)
 
-    # publish the data resulting from this pipline to the topic
-    sdf = sdf.to_topic(producer_topic)
+    log_startup_time()
+    instrumentation.start()
 
     try:
         app.run(sdf)
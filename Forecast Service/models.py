@@ -0,0 +1,170 @@
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from forecasters import forecast, init_stats, sklearn_forecast, slide_stats, update_stats
+from rolling_history import RollingHistory
+
+
+class ForecastModel:
+    """
+    Forecasts one field of one printer from its rolling history.
+    A model keeps what it fitted between values: 'update' is called after every value added to the history
+    and 'warm_start' rebuilds the model from the history, for a printer that was not in the cache.
+    """
+
+    def warm_start(self, history: RollingHistory):
+        raise NotImplementedError
+
+    def update(self, history: RollingHistory, value: float, oldest: Optional[float]):
+        """
+        Called after 'value' was added to the history, 'oldest' is the value it replaced if the history was full.
+        """
+        raise NotImplementedError
+
+    def is_ready(self, history: RollingHistory) -> bool:
+        raise NotImplementedError
+
+    def forecast(self, history: RollingHistory, length: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class PolynomialModel(ForecastModel):
+    """
+    Polynomial regression over the history. The numpy backend keeps the running sums of the fit and slides them
+    with the history, rebuilding them every 'capacity' slides to drop rounding errors.
+    The sklearn backend fits a scikit-learn pipeline on the history values for every forecast.
+    """
+
+    def __init__(self, degree: int = 2, backend: str = "numpy"):
+        self.degree = degree
+        self.backend = backend
+        self.stats = init_stats(degree)
+        self._slides = 0
+
+    def warm_start(self, history: RollingHistory):
+        self.stats = init_stats(self.degree)
+        for value in history.to_array():
+            update_stats(self.stats, self.degree, float(value))
+        self._slides = 0
+
+    def update(self, history: RollingHistory, value: float, oldest: Optional[float]):
+        if self.backend != "numpy":
+            return
+        if oldest is None:
+            update_stats(self.stats, self.degree, value)
+            return
+
+        slide_stats(self.stats, self.degree, oldest, value)
+        self._slides += 1
+        if self._slides >= history.capacity:
+            self.warm_start(history)
+
+    def is_ready(self, history: RollingHistory) -> bool:
+        return len(history) > self.degree
+
+    def forecast(self, history: RollingHistory, length: int) -> np.ndarray:
+        if self.backend == "sklearn":
+            return sklearn_forecast(history.to_array(), self.degree, length)
+        return forecast(self.stats, self.degree, length)
+
+
+class HoltModel(ForecastModel):
+    """
+    Holt's linear exponential smoothing: a level and a trend updated in O(1) with every value.
+    The forecast h steps ahead is level + h * trend.
+    """
+
+    def __init__(self, alpha: float = 0.5, beta: float = 0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = 0.0
+        self.trend = 0.0
+        self.count = 0
+
+    def warm_start(self, history: RollingHistory):
+        self.level = self.trend = 0.0
+        self.count = 0
+        for value in history.to_array():
+            self.update(history, float(value), None)
+
+    def update(self, history: RollingHistory, value: float, oldest: Optional[float]):
+        if self.count == 0:
+            self.level = value
+        elif self.count == 1:
+            self.trend = value - self.level
+            self.level = value
+        else:
+            previous_level = self.level
+            self.level = self.alpha * value + (1 - self.alpha) * (self.level + self.trend)
+            self.trend = self.beta * (self.level - previous_level) + (1 - self.beta) * self.trend
+        self.count += 1
+
+    def is_ready(self, history: RollingHistory) -> bool:
+        return self.count >= 2
+
+    def forecast(self, history: RollingHistory, length: int) -> np.ndarray:
+        return self.level + self.trend * np.arange(1, length + 1)
+
+
+class ARModel(ForecastModel):
+    """
+    Autoregressive model of order 'order' with an intercept, fitted by least squares over the history.
+    The coefficients are kept and refitted every 'refit_interval' values; the forecasts in between
+    use them with the latest values.
+    """
+
+    def __init__(self, order: int = 3, refit_interval: int = 10):
+        self.order = order
+        self.refit_interval = refit_interval
+        self.coefficients: Optional[np.ndarray] = None
+        self._since_fit = 0
+
+    def warm_start(self, history: RollingHistory):
+        self.coefficients = None
+        self._since_fit = 0
+        if self.is_ready(history):
+            self._fit(history)
+
+    def update(self, history: RollingHistory, value: float, oldest: Optional[float]):
+        self._since_fit += 1
+        if self.is_ready(history) and (self.coefficients is None or self._since_fit >= self.refit_interval):
+            self._fit(history)
+
+    def is_ready(self, history: RollingHistory) -> bool:
+        return len(history) > 2 * self.order  # at least one more equation than coefficients
+
+    def forecast(self, history: RollingHistory, length: int) -> np.ndarray:
+        if self.coefficients is None:
+            self._fit(history)
+
+        intercept, weights = self.coefficients[0], self.coefficients[1:]
+        values = list(history.to_array()[-self.order:])  # the latest values, oldest first
+        result = np.empty(length)
+        for step in range(length):
+            result[step] = intercept + np.dot(weights, values[::-1])
+            values = values[1:] + [result[step]]
+        return result
+
+    def _fit(self, history: RollingHistory):
+        values = history.to_array()
+        lags = np.lib.stride_tricks.sliding_window_view(values[:-1], self.order)[:, ::-1]  # y[t-1]...y[t-order]
+        features = np.hstack((np.ones((len(lags), 1)), lags))
+        self.coefficients = np.linalg.lstsq(features, values[self.order:], rcond=None)[0]
+        self._since_fit = 0
+
+
+model_types: Dict[str, Callable[..., ForecastModel]] = {
+    "polynomial": PolynomialModel,
+    "holt": HoltModel,
+    "ar": ARModel,
+}
+
+
+def create_model(name: str, parameters: Dict[str, Dict]) -> ForecastModel:
+    """
+    Create a model of the registered type 'name' with its parameters in 'parameters[name]'.
+    """
+    if name not in model_types:
+        raise ValueError(f"Unknown forecast model '{name}', expected one of {', '.join(model_types)}")
+    return model_types[name](**parameters.get(name, {}))
@@ -0,0 +1,135 @@
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Optional
+
+import numpy as np
+from quixstreams import State
+
+if TYPE_CHECKING:
+    from models import ForecastModel
+
+
+class RollingHistory:
+    """
+    The last 'capacity' values of a field in a fixed size float array used as a ring buffer.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.values = np.zeros(capacity)
+        self.appended = 0  # number of values appended since the start, the next slot is appended % capacity
+
+    def __len__(self) -> int:
+        return min(self.appended, self.capacity)
+
+    def append(self, value: float) -> Optional[float]:
+        """
+        Add the value and return the oldest one it replaced, if the history was full.
+        """
+        slot = self.appended % self.capacity
+        oldest = float(self.values[slot]) if self.appended >= self.capacity else None
+        self.values[slot] = value
+        self.appended += 1
+        return oldest
+
+    def last(self) -> float:
+        return float(self.values[(self.appended - 1) % self.capacity])
+
+    def to_array(self) -> np.ndarray:
+        """
+        The values from the oldest to the newest.
+        """
+        if self.appended <= self.capacity:
+            return self.values[:self.appended].copy()
+        start = self.appended % self.capacity
+        return np.concatenate((self.values[start:], self.values[:start]))
+
+
+class PrinterModels:
+    """
+    The rolling history and the forecast model of every forecasted field of a printer.
+    """
+
+    def __init__(self, histories: Dict[str, RollingHistory], models: Dict[str, "ForecastModel"]):
+        self.histories = histories
+        self.models = models
+        self.last_used = time.monotonic()
+
+    def is_ready(self) -> bool:
+        return all(model.is_ready(self.histories[field]) for field, model in self.models.items())
+
+    def current(self) -> Dict[str, float]:
+        """
+        The latest value of every field.
+        """
+        return {field: history.last() for field, history in self.histories.items()}
+
+    def forecast(self, length: int) -> Dict[str, np.ndarray]:
+        return {field: model.forecast(self.histories[field], length) for field, model in self.models.items()}
+
+
+class HistoryStore:
+    """
+    Keeps the rolling histories of every printer in the state of its message key, and the histories
+    with their fitted models in memory for up to 'max_printers' printers, evicting the least recently
+    used ones and the ones unused for 'ttl_seconds'.
+
+    The state has one entry per slot of the ring buffers, so a message only writes the slots it replaces
+    and the number of appended values. An evicted printer, or one whose partition was processed somewhere else
+    in the meantime, is read back from the state and its models are warm started from the histories.
+    """
+
+    def __init__(self, capacity: int, models: Dict[str, Callable[[], "ForecastModel"]],
+                 max_printers: int = 10000, ttl_seconds: float = 3600):
+        self.capacity = capacity
+        self.model_factories = models
+        self.max_printers = max_printers
+        self.ttl_seconds = ttl_seconds
+        self._printers: "OrderedDict[Hashable, PrinterModels]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._printers)  # printers in memory
+
+    def append(self, key: Hashable, state: State, row: dict) -> PrinterModels:
+        """
+        Add the row's value of every field to the histories of the printer and update its models.
+        """
+        printer = self._printers.get(key)
+        if printer is None or any(history.appended != state.get(f"{field}/appended", 0)
+                                  for field, history in printer.histories.items()):
+            printer = self._printers[key] = self._load(state)
+        self._printers.move_to_end(key)
+        printer.last_used = time.monotonic()
+
+        for field, history in printer.histories.items():
+            value = row[field]
+            state.set(f"{field}/{history.appended % self.capacity}", value)
+            oldest = history.append(value)
+            state.set(f"{field}/appended", history.appended)
+            printer.models[field].update(history, value, oldest)
+
+        self._evict()
+        return printer
+
+    def _evict(self):
+        expired = time.monotonic() - self.ttl_seconds
+        while self._printers:
+            key, oldest = next(iter(self._printers.items()))
+            if len(self._printers) <= self.max_printers and oldest.last_used >= expired:
+                break
+            del self._printers[key]
+
+    def _load(self, state: State) -> PrinterModels:
+        histories = {}
+        models = {}
+        for field, create_model in self.model_factories.items():
+            history = histories[field] = RollingHistory(self.capacity)
+            appended = state.get(f"{field}/appended", 0)
+            for index in range(max(0, appended - self.capacity), appended):
+                slot = index % self.capacity
+                history.values[slot] = state.get(f"{field}/{slot}", 0.0)
+            history.appended = appended
+
+            models[field] = create_model()
+            models[field].warm_start(history)
+        return PrinterModels(histories, models)
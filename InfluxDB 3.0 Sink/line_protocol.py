@@ -0,0 +1,117 @@
+import math
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional, Tuple
+
+# Characters to escape in each part of a line, see
+# https://docs.influxdata.com/influxdb/cloud-serverless/reference/syntax/line-protocol/#special-characters
+_measurement_escapes = str.maketrans({",": r"\,", " ": r"\ ", "\n": r"\n"})
+_key_escapes = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n"})
+_string_field_escapes = str.maketrans({'"': r'\"', "\\": r"\\", "\n": r"\n"})
+
+
+def escape_measurement(value: str) -> str:
+    return value.translate(_measurement_escapes)
+
+
+def escape_key(value: str) -> str:
+    """
+    Escape tag keys, tag values and field keys.
+    """
+    return value.translate(_key_escapes)
+
+
+def format_field_value(value: Any) -> Optional[str]:
+    """
+    Format a field value like the InfluxDB client does: integers get the 'i' suffix,
+    strings are quoted and unsupported values (None, and NaN or infinite floats) are skipped.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        return f'"{value.translate(_string_field_escapes)}"'
+    return None
+
+
+def to_epoch_ms(value: Any) -> int:
+    """
+    Convert a timestamp in milliseconds or an ISO 8601 string (UTC if it has no time zone) to epoch milliseconds.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def compile_line_builder(measurement: str, tag_keys: List[str], field_keys: List[str],
+                         timestamp_key: str) -> Callable[[dict], Optional[str]]:
+    """
+    Return a function converting a message to a line protocol line with millisecond precision,
+    or None if the message has none of the fields.
+    The measurement, tag keys and field keys are escaped once, here, instead of for every message.
+    """
+    prefix = escape_measurement(measurement)
+    tags = [(key, f",{escape_key(key)}=") for key in tag_keys]
+    fields = [(key, f"{escape_key(key)}=") for key in field_keys]
+    isfinite = math.isfinite
+
+    def build(message: dict) -> Optional[str]:
+        parts = [prefix]
+        for key, tag_prefix in tags:
+            value = message.get(key)
+            if value is not None and value != "":
+                parts.append(tag_prefix)
+                parts.append(escape_key(value if type(value) is str else str(value)))
+
+        separator = " "
+        for key, field_prefix in fields:
+            value = message.get(key)
+            if type(value) is float:
+                formatted = repr(value) if isfinite(value) else None  # NaN and inf aren't valid line protocol
+            else:
+                formatted = format_field_value(value)
+            if formatted is not None:
+                parts.append(separator)
+                parts.append(field_prefix)
+                parts.append(formatted)
+                separator = ","
+
+        if separator == " ":
+            return None  # no fields
+
+        parts.append(" ")
+        parts.append(str(to_epoch_ms(message[timestamp_key])))
+        return "".join(parts)
+
+    return build
+
+
+def compile_latency_line_builder(measurement: str) -> Callable[[str, str, List[Tuple[str, int]], int], str]:
+    """
+    Return a function converting the hops of a trace, received at 'received_ms', to a line with the time spent
+    to reach every hop from the previous one as '<hop>_ms' (the sink is the last one) and 'end_to_end_ms',
+    tagged with the topic and the message key (the printer), at the time of the first hop.
+    """
+    prefix = f"{escape_measurement(measurement)},topic="
+
+    def build(topic: str, printer: str, hops: List[Tuple[str, int]], received_ms: int) -> str:
+        parts = [prefix, escape_key(topic)]
+        if printer:
+            parts.append(",printer=")
+            parts.append(escape_key(printer))
+        separator = " "
+        previous_ms = hops[0][1]
+        for hop, time_ms in (*hops[1:], ("sink", received_ms)):
+            parts.append(f"{separator}{escape_key(hop)}_ms={time_ms - previous_ms}i")
+            separator = ","
+            previous_ms = time_ms
+        parts.append(f",end_to_end_ms={received_ms - hops[0][1]}i {hops[0][1]}")
+        return "".join(parts)
+
+    return build
@@ -1,32 +1,33 @@
 # import Utility modules
-from argparse import ArgumentError
 import os
 import ast
-import datetime
 import logging
+import signal
 import time
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 # import vendor-specific modules
 from quixstreams import Application
+from quixstreams.kafka import Consumer
 from influxdb_client_3 import InfluxDBClient3
 
+from instrumentation import Instrumentation, exponential_buckets
+from line_protocol import compile_latency_line_builder, compile_line_builder
+from retry import Backoff, RetryingWriter, SpillFile
+from tracing import now_ms, parse_trace, read_trace
+from wire_format import WireDeserializer
+from write_buffer import Batch, WriteBuffer
+from writer import ThreadedWriter
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 with open("./.env", 'a+') as file: pass  # make sure the .env file exists
 load_dotenv("./.env") # load environment variables from .env file for local dev
 
-for name, value in os.environ.items():
-    print("{0}: {1}".format(name, value))
-
 consumer_group_name = os.environ.get('CONSUMER_GROUP_NAME', "influxdb-data-writer")
 
-# Create a Quix platform-specific application instead
-app = Application.Quix(consumer_group=consumer_group_name, auto_create_topics=True, auto_offset_reset='earliest', use_changelog_topics=False)
-
-input_topic = app.topic(os.environ["input"])
-
 # Read the environment variable to determine the timestamp key. Default to timestmap if not defined
 incoming_timestamp_key = os.environ.get('TIMESTAMP_KEY', "timestamp")
 
@@ -34,73 +35,243 @@ incoming_timestamp_key = os.environ.get('TIMESTAMP_KEY', "timestamp")
 tag_keys = ast.literal_eval(os.environ.get('INFLUXDB_TAG_KEYS', "[]"))
 field_keys = ast.literal_eval(os.environ.get('INFLUXDB_FIELD_KEYS', "[]"))
 
+# Write batches: flushed when any of the limits is reached
+batch_size = int(os.environ.get('INFLUXDB_BATCH_SIZE', "1000"))
+batch_max_bytes = int(os.environ.get('INFLUXDB_BATCH_MAX_BYTES', str(1024 * 1024)))
+batch_linger_ms = int(os.environ.get('INFLUXDB_BATCH_LINGER_MS', "1000"))
+
+# Failed writes are retried with exponential backoff, from a bounded queue that overflows to a spill file
+retry_initial_ms = int(os.environ.get('INFLUXDB_RETRY_INITIAL_MS', "500"))
+retry_max_ms = int(os.environ.get('INFLUXDB_RETRY_MAX_MS', "30000"))
+retry_queue_size = int(os.environ.get('INFLUXDB_RETRY_QUEUE_SIZE', "100"))
+spill_path = os.environ.get('INFLUXDB_SPILL_PATH', "state/influxdb-spill.lp")
+spill_max_bytes = int(os.environ.get('INFLUXDB_SPILL_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# Writer threads (0 to write from the consumer loop) and batches they can have pending before consumption is paused
+writer_threads = int(os.environ.get('INFLUXDB_WRITER_THREADS', "0"))
+writer_queue_size = int(os.environ.get('INFLUXDB_WRITER_QUEUE_SIZE', "20"))
+
+# Measurement of the latency of the messages with a trace, from the Data Generator to the sink, empty to not write it
+latency_measurement = os.environ.get('INFLUXDB_LATENCY_MEASUREMENT', "pipeline_latency")
+
+# Seconds between logs of the writer metrics
+metrics_interval = 60
+
 # do some parameter/variable validation
 influxdb_host = os.getenv("INFLUXDB_HOST", "")
 if influxdb_host == "":
     raise ValueError("InfluxDB is required")
 
-if not influxdb_host.startswith("https://"):
+# default to https, a scheme can be given to use a local HTTP server (e.g. http://localhost:8181)
+if "://" not in influxdb_host:
     influxdb_host = 'https://' + influxdb_host
 
 # setup the influxdb3 client using values from environment variables
 influx3_client = InfluxDBClient3(token=os.environ["INFLUXDB_TOKEN"],
-                         host=os.environ["INFLUXDB_HOST"],
+                         host=influxdb_host,
                          org=os.environ["INFLUXDB_ORG"],
-                         database=os.environ["INFLUXDB_DATABASE"])
-back_off_delay = 0
-def send_data_to_influx(message):
-    global back_off_delay
-    
-    logger.info(f"Processing message: {message}")
+                         database=os.environ["INFLUXDB_DATABASE"],
+                         connection_pool_maxsize=max(writer_threads, 1))
+
+
+@dataclass
+class MessageMetrics:
+    consumed: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    points: int = 0
+
+
+# Built once from the tag and field keys, converts a message to a line protocol line
+to_line_protocol = compile_line_builder(os.environ.get('INFLUXDB_MEASUREMENT_NAME', "measurement1"),
+                                        tag_keys, field_keys, incoming_timestamp_key)
+to_latency_line = compile_latency_line_builder(latency_measurement) if latency_measurement else None
+message_metrics = MessageMetrics()
+log_invalid_messages = True  # only the first invalid message between two metrics logs is logged
+
+instrumentation = Instrumentation.from_env("influxdb_sink")
+processing_seconds = instrumentation.histogram("processing_seconds", "Time to convert a message to line protocol")
+write_batch_points = instrumentation.histogram("write_batch_points", "Points in every batch handed to the writer",
+                                               exponential_buckets(1, 2, 16))
+write_batch_bytes = instrumentation.histogram("write_batch_bytes", "Bytes of line protocol in every batch",
+                                              exponential_buckets(256, 2, 16))
+end_to_end_seconds = instrumentation.histogram("end_to_end_seconds",
+                                               "Time from the Data Generator to the sink of the messages with a trace",
+                                               exponential_buckets(0.001, 2, 20))
+instrumentation.counter("messages_consumed_total", "Messages consumed", function=lambda: message_metrics.consumed)
+instrumentation.counter("messages_skipped_total", "Messages without a timestamp",
+                        function=lambda: message_metrics.skipped)
+instrumentation.counter("messages_invalid_total", "Messages that couldn't be read",
+                        function=lambda: message_metrics.invalid)
+instrumentation.counter("points_total", "Points converted from the messages", function=lambda: message_metrics.points)
+
+
+def write_lines(lines):
+    influx3_client.write(record=lines, write_precision="ms")
+
+
+def create_writer():
+    if writer_threads > 0:
+        return ThreadedWriter(write_lines, writer_threads, writer_queue_size,
+                              retry_initial_ms / 1000, retry_max_ms / 1000)
+
+    return RetryingWriter(write_lines,
+                          Backoff(retry_initial_ms / 1000, retry_max_ms / 1000),
+                          retry_queue_size,
+                          SpillFile(spill_path, spill_max_bytes) if spill_path else None)
+
+
+def commit(consumer: Consumer, writer, asynchronous: bool = True):
+    offsets = writer.commit_offsets()
+    if offsets:
+        consumer.commit(offsets=offsets, asynchronous=asynchronous)
+
+
+def create_input_topic(app: Application):
+    # the messages are read in JSON or binary, by their header
+    return app.topic(os.environ["input"], value_deserializer=WireDeserializer())
 
+
+def process_message(buffer: WriteBuffer, message, input_topic):
+    global log_invalid_messages
+
+    started = time.perf_counter()
+    message_metrics.consumed += 1
     try:
-        time.sleep(back_off_delay)
-        # Get the measurement name to write data to
-        measurement_name = os.environ.get('INFLUXDB_MEASUREMENT_NAME', "measurement1")
-
-        # Initialize the tags and fields dictionaries
-        tags = {}
-        fields = {}
-
-        # Iterate over the tag_dict and field_dict to populate tags and fields
-        for tag_key in tag_keys:
-            if tag_key in message:
-                tags[tag_key] = message[tag_key]
-
-        for field_key in field_keys:
-            if field_key in message:
-                fields[field_key] = message[field_key]
-
-        logger.info(f"Using tag keys: {', '.join(tags.keys())}")
-        logger.info(f"Using field keys: {', '.join(fields.keys())}")
-
-        # Construct the points dictionary
-        points = {
-            "measurement": measurement_name,
-            "tags": tags,
-            "fields": fields,
-            "time": message[incoming_timestamp_key]
-        }
-
-        influx3_client.write(record=points, write_precision="ms")
-        
-        logger.info(f"{str(datetime.datetime.utcnow())}: Persisted data to influxDb: {points}")
+        rows = input_topic.row_deserialize(message)
+        rows = rows if isinstance(rows, list) else [rows] if rows is not None else []
+
+        for row in rows:
+            # filter out inbound data without the timestamp column
+            if not isinstance(row.value, dict) or incoming_timestamp_key not in row.value:
+                message_metrics.skipped += 1
+                continue
+
+            line = to_line_protocol(row.value)
+            if line is not None:
+                buffer.append(line)
+                message_metrics.points += 1
+
+        if to_latency_line is not None:
+            trace = read_trace(message.headers())
+            if trace is not None:
+                write_latency(buffer, trace, message)
     except Exception as e:
-        if back_off_delay < 5:
-            back_off_delay += 0.5
+        message_metrics.invalid += 1
+        if log_invalid_messages:
+            logger.warning(f"Invalid message at {message.topic()}[{message.partition()}]@{message.offset()}: {e}")
+            log_invalid_messages = False
+
+    buffer.track_offset(message.topic(), message.partition(), message.offset())
+    processing_seconds.observe(time.perf_counter() - started)
+
+
+def write_latency(buffer: WriteBuffer, trace: str, message):
+    """
+    Write the time the message took to go through every service, from its trace, with the other lines.
+    """
+    received_ms = now_ms()
+    hops = parse_trace(trace)
+    key = message.key()
+    buffer.append(to_latency_line(message.topic(), key.decode() if isinstance(key, bytes) else key or "",
+                                  hops, received_ms))
+    end_to_end_seconds.observe((received_ms - hops[0][1]) / 1000)
+
+
+def take_batch(buffer: WriteBuffer) -> Batch:
+    """
+    The buffered batch, with its size in the metrics.
+    """
+    if buffer.lines:
+        write_batch_points.observe(len(buffer.lines))
+        write_batch_bytes.observe(buffer.size_bytes)
+    return buffer.take()
+
+
+def register_writer_metrics(writer):
+    instrumentation.counter("written_points_total", "Points written to InfluxDB",
+                            function=lambda: writer.metrics.written_points)
+    instrumentation.counter("failed_writes_total", "Writes that failed", function=lambda: writer.metrics.failed_writes)
+    instrumentation.counter("retries_total", "Writes retried", function=lambda: writer.metrics.retries)
+    instrumentation.counter("dropped_points_total", "Points rejected by InfluxDB or not fitting in the spill file",
+                            function=lambda: writer.metrics.dropped_points)
+    instrumentation.gauge("writer_queue_depth", "Batches waiting to be written",
+                          function=lambda: writer.metrics.queue_depth)
+    instrumentation.gauge("spill_bytes", "Bytes in the spill file", function=lambda: writer.metrics.spill_bytes)
+
+
+def main():
+    global log_invalid_messages
+
+    # Create a Quix platform-specific application instead
+    # Offsets are committed manually, only after the data consumed before them has been written to InfluxDB
+    app = Application.Quix(consumer_group=consumer_group_name, auto_create_topics=True, auto_offset_reset='earliest',
+                           auto_commit_enable=False, use_changelog_topics=False,
+                           consumer_extra_config=instrumentation.consumer_config())
+    input_topic = create_input_topic(app)
+
+    buffer = WriteBuffer(batch_size, batch_max_bytes, batch_linger_ms / 1000)
+    writer = create_writer()
+    register_writer_metrics(writer)
+    instrumentation.start()
+    running = True
+    paused = False
+
+    def stop(*_):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def on_revoke(consumer: Consumer, partitions):
+        # hand over what was consumed from the revoked partitions and commit it while we still own them
+        writer.submit(take_batch(buffer))
+        commit(consumer, writer, asynchronous=False)
+        writer.drop_partitions(partitions)
+
+    # like app.run, get_consumer creates the topics declared with app.topic (auto_create_topics) and validates them
+    with app.get_consumer() as consumer:
+        consumer.subscribe([input_topic.name], on_revoke=on_revoke)
+        next_metrics_log = time.monotonic() + metrics_interval
+
+        while running:
+            message = consumer.poll(timeout=min(batch_linger_ms / 1000, 1.0))
+            # an error still goes through the rest of the loop, so the writes are retried and flushed meanwhile
+            if message is not None and message.error():
+                logger.error(f"Kafka error: {message.error()}")
+            elif message is not None:
+                process_message(buffer, message, input_topic)
+
+            if buffer.is_ready():
+                writer.submit(take_batch(buffer))
+            writer.process()
+            commit(consumer, writer)
 
-        logger.info(f"{str(datetime.datetime.utcnow())}: Write failed")
-        logger.info(e)
+            # backpressure: stop fetching while the writer threads are behind
+            if writer.is_full():
+                if not paused:
+                    logger.info("Writers are behind, pausing consumption")
+                consumer.pause(consumer.assignment())
+                paused = True
+            elif paused and writer.has_room():
+                consumer.resume(consumer.assignment())
+                paused = False
 
-sdf = app.dataframe(input_topic)
+            if time.monotonic() >= next_metrics_log:
+                logger.info(f"Message metrics: {message_metrics}")
+                logger.info(f"Writer metrics: {writer.metrics}")
+                log_invalid_messages = True
+                next_metrics_log = time.monotonic() + metrics_interval
 
-sdf = sdf[sdf.contains(incoming_timestamp_key)]  # filter out imbound data without this column
+        writer.submit(take_batch(buffer))
+        writer.close()
+        commit(consumer, writer, asynchronous=False)
 
-sdf = sdf.apply(send_data_to_influx)
 
 if __name__ == "__main__":
     logger.info("Starting application")
     try:
-        app.run(sdf)
+        main()
     except Exception as e:
         print(e)
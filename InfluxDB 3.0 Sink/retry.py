@@ -0,0 +1,266 @@
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from confluent_kafka import TopicPartition
+
+from write_buffer import Batch, TopicPartitionKey
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th delay is random between 0 and initial * multiplier^n,
+    capped to the maximum. 'reset' starts again from the initial delay.
+    """
+
+    def __init__(self, initial_seconds: float, max_seconds: float, multiplier: float = 2.0):
+        self.initial_seconds = initial_seconds
+        self.max_seconds = max_seconds
+        self.multiplier = multiplier
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.max_seconds, self.initial_seconds * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return random.uniform(0, delay)
+
+    def reset(self):
+        self.attempts = 0
+
+
+@dataclass
+class WriterMetrics:
+    written_batches: int = 0
+    written_points: int = 0
+    failed_writes: int = 0
+    retries: int = 0
+    spilled_batches: int = 0
+    replayed_batches: int = 0
+    dropped_points: int = 0
+    queue_depth: int = 0
+    spill_bytes: int = 0
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    Client errors (bad line protocol, wrong database...) will fail again, they are not retried.
+    """
+    status = getattr(getattr(error, "response", None), "status", None) or getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+class CommitTracker:
+    """
+    Tracks which offsets can be committed: those of written, spilled and dropped batches,
+    but never past the first offset of a batch that is still pending.
+    """
+
+    def __init__(self):
+        self._done_offsets: Dict[TopicPartitionKey, int] = {}
+        self._committed_offsets: Dict[TopicPartitionKey, int] = {}
+
+    def done(self, batch: Batch):
+        for key, (_, next_offset) in batch.offsets.items():
+            self._done_offsets[key] = max(self._done_offsets.get(key, next_offset), next_offset)
+
+    def commit_offsets(self, pending: Iterable[Batch]) -> List[TopicPartition]:
+        """
+        Return the offsets that changed since the last call and are safe to commit.
+        """
+        offsets = dict(self._done_offsets)
+        for batch in pending:
+            for key, (first_offset, _) in batch.offsets.items():
+                if key in offsets:
+                    offsets[key] = min(offsets[key], first_offset)
+
+        changed = {key: offset for key, offset in offsets.items() if self._committed_offsets.get(key) != offset}
+        self._committed_offsets.update(changed)
+        return [TopicPartition(topic, partition, offset) for (topic, partition), offset in changed.items()]
+
+    def drop_partitions(self, partitions: List[TopicPartition], pending: Iterable[Batch]):
+        """
+        Stop tracking the offsets of partitions that are no longer assigned to this consumer.
+        The lines of their pending batches are still written.
+        """
+        for partition in partitions:
+            key = (partition.topic, partition.partition)
+            self._done_offsets.pop(key, None)
+            self._committed_offsets.pop(key, None)
+            for batch in pending:
+                batch.offsets.pop(key, None)
+
+
+class SpillFile:
+    """
+    Append-only file of batches that did not fit in the retry queue.
+    Every batch is written as its lines followed by an empty line. Batches are read back in order and
+    the file is removed once all of them have been written. A file left by a previous run is replayed too.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._read_position = 0
+        self._next_position = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._size - self._read_position
+
+    def append(self, lines: List[str]) -> bool:
+        data = ("\n".join(lines) + "\n\n").encode()
+        if self._size + len(data) > self.max_bytes:
+            return False
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as file:
+            file.write(data)
+        self._size += len(data)
+        return True
+
+    def peek(self) -> Optional[List[str]]:
+        """
+        Read the oldest batch without removing it, 'pop' removes it once written.
+        """
+        if self._read_position >= self._size:
+            return None
+
+        lines = []
+        with open(self.path, "rb") as file:
+            file.seek(self._read_position)
+            while (line := file.readline()) not in (b"\n", b""):
+                lines.append(line.rstrip(b"\n").decode())
+            self._next_position = file.tell()
+        return lines
+
+    def pop(self):
+        self._read_position = self._next_position
+        if self._read_position >= self._size:
+            os.remove(self.path)
+            self._size = self._read_position = self._next_position = 0
+
+
+class RetryingWriter:
+    """
+    Writes batches without ever blocking the consumer to wait for a retry.
+    A failed batch is queued (up to 'max_queued_batches'), further batches are queued behind it, and
+    'process' retries the oldest one once its backoff delay has passed. When the queue is full, batches go to
+    the spill file and are replayed from it after the queue has been written. Batches that InfluxDB rejects
+    as invalid are dropped. Batches that can't be queued or spilled, like the ones still queued on close without
+    a spill file, aren't written.
+
+    Offsets are never committed past a batch still queued in memory or not written, so the batches not written
+    are consumed again after a restart.
+    """
+
+    def __init__(self, write: Callable[[List[str]], None], backoff: Backoff, max_queued_batches: int,
+                 spill: Optional[SpillFile] = None):
+        self._write = write
+        self._backoff = backoff
+        self._max_queued_batches = max_queued_batches
+        self._spill = spill
+        self._queue: Deque[Batch] = deque()
+        # the first offset of every partition with a batch that wasn't written, queued or spilled
+        self._unwritten = Batch()
+        self._retry_at = 0.0
+        self._commits = CommitTracker()
+        self._metrics = WriterMetrics()
+
+    @property
+    def metrics(self) -> WriterMetrics:
+        self._metrics.queue_depth = len(self._queue)
+        self._metrics.spill_bytes = self._spill.pending_bytes if self._spill else 0
+        return self._metrics
+
+    def is_full(self) -> bool:
+        return False  # the spill file takes the overflow, the consumer never needs to pause
+
+    def has_room(self) -> bool:
+        return True
+
+    def submit(self, batch: Batch):
+        if self._queue or time.monotonic() < self._retry_at:
+            self._enqueue(batch)
+        elif not self._attempt(batch):
+            self._enqueue(batch)
+
+    def process(self):
+        """
+        Retry the oldest queued batch, or replay the oldest spilled one, if the backoff delay has passed.
+        """
+        if time.monotonic() < self._retry_at:
+            return
+
+        if self._queue:
+            self._metrics.retries += 1
+            if self._attempt(self._queue[0]):
+                self._queue.popleft()
+        elif self._spill and (lines := self._spill.peek()) is not None:
+            if self._attempt(Batch(lines)):
+                self._spill.pop()
+                self._metrics.replayed_batches += 1
+
+    def close(self):
+        """
+        Move the batches still queued in memory to the spill file, so they are written after a restart.
+        Without a spill file, or once it's full, their offsets aren't committed and they are consumed again.
+        """
+        while self._queue:
+            self._enqueue_overflow(self._queue.popleft())
+
+    def commit_offsets(self) -> List[TopicPartition]:
+        return self._commits.commit_offsets([*self._queue, self._unwritten])
+
+    def drop_partitions(self, partitions: List[TopicPartition]):
+        self._commits.drop_partitions(partitions, [*self._queue, self._unwritten])
+
+    def _attempt(self, batch: Batch) -> bool:
+        try:
+            if batch.lines:
+                self._write(batch.lines)
+        except Exception as e:
+            if is_permanent_error(e):
+                logger.error(f"InfluxDB rejected {len(batch.lines)} points, dropping them: {e}")
+                self._drop(batch)
+                return True
+
+            self._metrics.failed_writes += 1
+            delay = self._backoff.next_delay()
+            self._retry_at = time.monotonic() + delay
+            logger.info(f"Write failed, retrying in {delay:.2f} seconds: {e}")
+            return False
+
+        self._backoff.reset()
+        self._metrics.written_batches += 1
+        self._metrics.written_points += len(batch.lines)
+        self._commits.done(batch)
+        return True
+
+    def _enqueue(self, batch: Batch):
+        if len(self._queue) < self._max_queued_batches:
+            self._queue.append(batch)
+        else:
+            self._enqueue_overflow(batch)
+
+    def _enqueue_overflow(self, batch: Batch):
+        if self._spill is not None and self._spill.append(batch.lines):
+            self._metrics.spilled_batches += 1
+            self._commits.done(batch)
+        else:
+            logger.warning(f"Retry queue and spill file are full, {len(batch.lines)} points aren't written, "
+                           f"their messages are consumed again after a restart")
+            self._metrics.dropped_points += len(batch.lines)
+            for key, (first_offset, _) in batch.offsets.items():
+                unwritten_offset, _ = self._unwritten.offsets.get(key, (first_offset, first_offset))
+                self._unwritten.offsets[key] = (min(unwritten_offset, first_offset), first_offset)
+
+    def _drop(self, batch: Batch):
+        self._metrics.dropped_points += len(batch.lines)
+        self._commits.done(batch)
@@ -0,0 +1,104 @@
+"""
+Trace context of the messages between the services, in their 'trace' header: the services the data went through,
+from the Data Generator, each with the time it produced its message, in epoch milliseconds:
+
+    trace: generator=1709304320512,downsampling=1709304320530,forecast=1709304320561,alerts=1709304320570
+
+Every service adds itself to the trace of the message it's processing when it produces a message from it, so the
+time between two hops is the time the data spent in Kafka, waiting to be consumed and being processed by the second
+service. A window carries the trace of the message that closed it. The times are read from the wall clock of every
+service, the hops are only as accurate as the clocks are synchronized.
+
+This module is the same in every service, a change to one copy goes to all of them.
+"""
+import os
+import time
+from typing import Any, List, Mapping, Optional, Tuple
+
+from quixstreams.models.serializers import JSONSerializer, SerializationContext, Serializer
+
+TRACE_HEADER = "trace"
+# a row can carry its trace in this field, in place of the trace of the message being processed,
+# when it's produced while processing another message. The field isn't written
+TRACE_FIELD = "_trace"
+
+
+def tracing_enabled() -> bool:
+    """
+    The 'tracing_enabled' environment variable, true by default.
+    """
+    return os.getenv("tracing_enabled", "true").lower() not in ("false", "0", "no", "off")
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def read_trace(headers) -> Optional[str]:
+    """
+    The trace in the headers of a message, None without it.
+    """
+    for name, value in headers.items() if isinstance(headers, Mapping) else headers or ():
+        if name == TRACE_HEADER:
+            return value.decode() if isinstance(value, bytes) else value
+    return None
+
+
+def add_hop(trace: Optional[str], hop: str, time_ms: int) -> str:
+    entry = f"{hop}={time_ms}"
+    return f"{trace},{entry}" if trace else entry
+
+
+def parse_trace(trace: str) -> List[Tuple[str, int]]:
+    """
+    The hops of a trace, as (service, time in epoch milliseconds), from the first one.
+    """
+    hops = []
+    for entry in trace.split(","):
+        hop, _, time_ms = entry.partition("=")
+        hops.append((hop, int(time_ms)))
+    return hops
+
+
+def start_trace(headers: Optional[Mapping[str, str]], hop: str) -> dict:
+    """
+    The headers of a message starting a trace, at this hop.
+    """
+    return {**(headers or {}), TRACE_HEADER: add_hop(None, hop, now_ms())}
+
+
+class TracingSerializer(Serializer):
+    """
+    Serializes the rows with 'serializer' and adds the hop to their trace in the headers, the trace of the message
+    being processed or the one in the row's TRACE_FIELD. Rows without a trace are produced without one.
+    Quix Streams reads the headers once the value is serialized, the trace is kept until then.
+    """
+
+    def __init__(self, hop: str, serializer: Serializer):
+        self.hop = hop
+        self._serializer = serializer
+        self._trace: Optional[str] = None
+
+    @property
+    def extra_headers(self) -> Mapping[str, str]:
+        headers = self._serializer.extra_headers
+        if self._trace is None:
+            return headers
+        return {**headers, TRACE_HEADER: self._trace}
+
+    def __call__(self, value: Any, ctx: SerializationContext) -> bytes:
+        trace = value.pop(TRACE_FIELD, None) if isinstance(value, dict) else None
+        if trace is None:
+            trace = read_trace(ctx.headers)
+        self._trace = add_hop(trace, self.hop, now_ms()) if trace is not None else None
+        return self._serializer(value, ctx)
+
+
+def traced_serializer(serializer, hop: str):
+    """
+    The value serializer of an output topic ("json" or a Serializer), adding the hop to the traces
+    if 'tracing_enabled'.
+    """
+    if not tracing_enabled():
+        return serializer
+    return TracingSerializer(hop, JSONSerializer() if serializer == "json" else serializer)
@@ -0,0 +1,71 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+TopicPartitionKey = Tuple[str, int]
+
+
+@dataclass
+class Batch:
+    """
+    Lines to write in a single request, with the offsets of the messages they come from:
+    for every partition, the offset of the first message and the next offset to commit.
+    """
+    lines: List[str] = field(default_factory=list)
+    offsets: Dict[TopicPartitionKey, Tuple[int, int]] = field(default_factory=dict)
+
+
+class WriteBuffer:
+    """
+    Accumulates line protocol lines until there are 'batch_size' lines, 'max_bytes' bytes
+    or the oldest line has waited 'linger_seconds'.
+    It also keeps the offsets of the consumed messages, so the offsets are only
+    committed once the lines consumed before them have been written.
+    """
+
+    def __init__(self, batch_size: int, max_bytes: int, linger_seconds: float):
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.linger_seconds = linger_seconds
+
+        self.lines: List[str] = []
+        self.size_bytes = 0
+        self._offsets: Dict[TopicPartitionKey, Tuple[int, int]] = {}
+        self._first_added = 0.0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def _start_batch(self):
+        if not self.lines and not self._offsets:
+            self._first_added = time.monotonic()
+
+    def append(self, line: str):
+        self._start_batch()
+        self.lines.append(line)
+        self.size_bytes += len(line) + 1  # lines are joined with a new line
+
+    def track_offset(self, topic: str, partition: int, offset: int):
+        """
+        Mark a consumed message as part of this batch, even if it produced no line.
+        """
+        self._start_batch()
+        first_offset, _ = self._offsets.get((topic, partition), (offset, offset))
+        self._offsets[(topic, partition)] = (first_offset, offset + 1)
+
+    def is_ready(self) -> bool:
+        if not self.lines and not self._offsets:
+            return False
+        return (len(self.lines) >= self.batch_size
+                or self.size_bytes >= self.max_bytes
+                or time.monotonic() - self._first_added >= self.linger_seconds)
+
+    def take(self) -> Batch:
+        """
+        Return the buffered batch and start a new one.
+        """
+        batch = Batch(self.lines, self._offsets)
+        self.lines = []
+        self.size_bytes = 0
+        self._offsets = {}
+        return batch
@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+from itertools import count
+from typing import Callable, Dict, List
+
+from confluent_kafka import TopicPartition
+
+from retry import Backoff, CommitTracker, WriterMetrics, is_permanent_error
+from write_buffer import Batch
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadedWriter:
+    """
+    Writes batches from a pool of threads, so the consumer never waits for InfluxDB.
+    Each thread retries its batch with backoff until it is written. 'is_full' reports when
+    'max_pending_batches' are waiting, the consumer should pause until there is room again.
+
+    Batches are written in any order, offsets are never committed past a batch that is still pending.
+    """
+
+    def __init__(self, write: Callable[[List[str]], None], threads: int, max_pending_batches: int,
+                 retry_initial_seconds: float, retry_max_seconds: float):
+        self._write = write
+        self._max_pending_batches = max_pending_batches
+        self._retry_initial_seconds = retry_initial_seconds
+        self._retry_max_seconds = retry_max_seconds
+
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._pending: Dict[int, Batch] = {}
+        self._batch_ids = count()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._commits = CommitTracker()
+        self._metrics = WriterMetrics()
+
+        self._threads = [threading.Thread(target=self._run, name=f"influxdb-writer-{i}", daemon=True)
+                         for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def metrics(self) -> WriterMetrics:
+        with self._lock:
+            self._metrics.queue_depth = len(self._pending)
+            return self._metrics
+
+    def is_full(self) -> bool:
+        return len(self._pending) >= self._max_pending_batches
+
+    def has_room(self) -> bool:
+        """
+        True once the pending batches are down to half the limit, to avoid pausing and resuming on every batch.
+        """
+        return len(self._pending) <= self._max_pending_batches // 2
+
+    def submit(self, batch: Batch):
+        batch_id = next(self._batch_ids)
+        with self._lock:
+            self._pending[batch_id] = batch
+        self._queue.put(batch_id)
+
+    def process(self):
+        pass  # the threads do the work
+
+    def close(self, timeout: float = 30):
+        """
+        Wait up to 'timeout' seconds for the pending batches, the ones not written by then are not committed
+        and will be consumed again after a restart.
+        """
+        for _ in self._threads:
+            self._queue.put(-1)
+        for thread in self._threads:
+            thread.join(timeout / len(self._threads))
+        self._stopping.set()
+
+    def commit_offsets(self) -> List[TopicPartition]:
+        with self._lock:
+            return self._commits.commit_offsets(self._pending.values())
+
+    def drop_partitions(self, partitions: List[TopicPartition]):
+        with self._lock:
+            self._commits.drop_partitions(partitions, self._pending.values())
+
+    def _run(self):
+        backoff = Backoff(self._retry_initial_seconds, self._retry_max_seconds)
+
+        while (batch_id := self._queue.get()) >= 0:
+            with self._lock:
+                batch = self._pending[batch_id]
+
+            if self._write_with_retries(batch, backoff) is None:
+                return  # closed, the batch stays pending so its offsets are not committed
+
+            with self._lock:
+                del self._pending[batch_id]
+                self._commits.done(batch)
+
+    def _write_with_retries(self, batch: Batch, backoff: Backoff):
+        """
+        Returns True once written, False if it was dropped and None if the writer was closed before writing it.
+        """
+        while not self._stopping.is_set():
+            try:
+                if batch.lines:
+                    self._write(batch.lines)
+            except Exception as e:
+                if is_permanent_error(e):
+                    logger.error(f"InfluxDB rejected {len(batch.lines)} points, dropping them: {e}")
+                    with self._lock:
+                        self._metrics.dropped_points += len(batch.lines)
+                    return False
+
+                delay = backoff.next_delay()
+                with self._lock:
+                    self._metrics.failed_writes += 1
+                    self._metrics.retries += 1
+                logger.info(f"Write failed, retrying in {delay:.2f} seconds: {e}")
+                self._stopping.wait(delay)
+                continue
+
+            backoff.reset()
+            with self._lock:
+                self._metrics.written_batches += 1
+                self._metrics.written_points += len(batch.lines)
+            return True
+        return None
@@ -0,0 +1,65 @@
+"""
+Cost of the instrumentation of the services on the processing of a message: a counter increment, a histogram
+observation, and a function wrapped by 'timed' and 'sized' (the state serialization of the services), enabled and
+disabled, against the bare call.
+
+    python benchmarks/benchmark_instrumentation.py [--calls 1000000]
+
+The end-to-end cost is measured by benchmark_pipeline.py, run with --metrics on and --metrics off.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, "Down-sampling"))
+
+from instrumentation import Instrumentation, sized, timed  # noqa: E402
+
+
+def process(value: bytes) -> bytes:
+    return value
+
+
+def measure(calls: int, enabled: bool) -> dict:
+    instrumentation = Instrumentation("benchmark", enabled=enabled)
+    counter = instrumentation.counter("messages_total", "Messages")
+    histogram = instrumentation.histogram("processing_seconds", "Time to process a message")
+    sizes = instrumentation.histogram("value_bytes", "Size of the values", (16, 64, 256, 1024))
+    timed_process = timed(process, histogram)
+    sized_process = sized(process, sizes)
+    sampled_process = sized(process, sizes, 16)
+    value = b"x" * 100
+
+    def per_call(statement) -> float:
+        return min(timeit.repeat(statement, number=calls, repeat=5)) / calls * 1e9
+
+    return {
+        "counter.inc": per_call(counter.inc),
+        "histogram.observe": per_call(lambda: histogram.observe(0.00015)),
+        "timed call": per_call(lambda: timed_process(value)),
+        "sized call": per_call(lambda: sized_process(value)),
+        "sized call, 1 in 16": per_call(lambda: sampled_process(value)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1000000)
+    args = parser.parse_args()
+
+    value = b"x" * 100
+    bare_call = min(timeit.repeat(lambda: process(value), number=args.calls, repeat=5)) / args.calls * 1e9
+    bare_lambda = min(timeit.repeat(lambda: None, number=args.calls, repeat=5)) / args.calls * 1e9
+    enabled = measure(args.calls, True)
+    disabled = measure(args.calls, False)
+
+    print(f"nanoseconds per call, {bare_lambda:.0f} of them for the loop, {bare_call:.0f} for the bare function call")
+    print(f"{'':<24}{'enabled':>10}{'disabled':>10}")
+    for name in enabled:
+        print(f"{name:<24}{enabled[name]:>10.0f}{disabled[name]:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
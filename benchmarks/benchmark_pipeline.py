@@ -0,0 +1,248 @@
+"""
+End-to-end benchmark of the pipeline: the real processing code of every service, in one process,
+with an in-memory Kafka stand-in between the services and a fake InfluxDB endpoint for the sink.
+
+    python benchmarks/benchmark_pipeline.py [--printers 10] [--datalength 3600] [--wire-format json] [--metrics on]
+                                            [--tracing on]
+                                            [--output results.json] [--baseline results.json --max-regression 0.2]
+
+The stages run one after the other, each one consuming everything the previous one produced:
+
+- generate: the Data Generator's data of every printer, encoded into messages a second apart
+- downsampling: the Down-sampling pipeline, on the generated messages
+- forecast: the Forecast Service pipeline, on the first resolution of the down-sampled data
+- alerts: the Alert Service pipeline, on the forecasts
+- anomalies: the Anomaly Detection Service pipeline, on the generated messages
+- sink: the InfluxDB sink, line protocol and batched writes, on the down-sampled data
+
+For every stage it reports the messages per second, the 50th and 99th percentiles of the time to process a message
+and the peak RSS of the process so far. With --metrics off or --tracing off, the services run without their
+instrumentation or without the trace headers, to compare their cost with a run with them. The services read their
+usual environment variables, so they can be set to benchmark other configurations. With --baseline, the run fails if
+a stage is more than --max-regression slower than in the baseline results.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import ModuleType
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+service_folders = {
+    "generator": "Data Generator",
+    "downsampling": "Down-sampling",
+    "forecast": "Forecast Service",
+    "alerts": "Alert Service",
+    "anomalies": "Anomaly Detection Service",
+    "sink": "InfluxDB 3.0 Sink",
+}
+# the helper modules of every service are imported from their folder
+sys.path[:0] = [os.path.join(root, folder) for folder in service_folders.values()]
+
+from in_memory import FakeInfluxDB, InMemoryApplication, InMemoryBroker  # noqa: E402
+
+raw_topic = "3d-printer-data"
+downsampled_topic = "downsampled-3d-printer-data"
+forecast_topic = "forecast"
+alerts_topic = "alerts"
+anomalies_topic = "anomalies"  # the alerts topic in the deployment, its own here to count them apart
+start_timestamp = 1709304320  # epoch seconds of the first generated message
+
+
+class StageResult(NamedTuple):
+    stage: str
+    messages_in: int
+    messages_out: int
+    seconds: float
+    messages_per_second: float
+    p50_us: float
+    p99_us: float
+    peak_rss_mb: float
+
+
+def load_service(name: str, environment: Dict[str, str]) -> ModuleType:
+    """
+    Import the main.py of a service, with its environment variables. Its Application isn't created.
+    """
+    os.environ.update(environment)
+    spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(root, service_folders[name], "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stage_result(stage: str, durations: List[float], messages_out: int, seconds: float) -> StageResult:
+    p50, p99 = np.percentile(durations, [50, 99]) * 1e6 if durations else (0.0, 0.0)
+    return StageResult(stage, len(durations), messages_out, seconds, len(durations) / seconds if seconds else 0.0,
+                       float(p50), float(p99), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def generate(broker: InMemoryBroker, printers: int, datalength: int, wire_format: str) -> StageResult:
+    generator = load_service("generator", {"datalength": str(datalength)})
+    serializer = generator.get_serializer("binary" if wire_format == "binary" else "json")
+    names = [f"Printer {i + 1}" for i in range(printers)]
+    encoded_printers = [serializer.encode_printer(name) for name in names]
+
+    started = time.perf_counter()
+    payloads = [generator.encode_columns(serializer, generator.generate_data_vectorized(i)) for i in range(printers)]
+    durations = []
+    # the printers send their samples at the same time, like the fleet mode
+    for step in range(datalength):
+        timestamp = start_timestamp + step
+        for i, name in enumerate(names):
+            message_started = time.perf_counter()
+            message = serializer.encode(payloads[i][step], encoded_printers[i], timestamp)
+            headers = serializer.headers
+            if generator.tracing:
+                headers = generator.start_trace(headers, "generator")
+            broker.produce(raw_topic, message, name.encode(), headers, timestamp * 1000)
+            durations.append(time.perf_counter() - message_started)
+    return stage_result("generate", durations, len(broker.messages(raw_topic)), time.perf_counter() - started)
+
+
+def run_pipeline(stage: str, service: ModuleType, broker: InMemoryBroker, state_dir: str, output_topics: List[str],
+                 **application_options) -> StageResult:
+    app = InMemoryApplication(broker, os.path.join(state_dir, stage), **application_options)
+    # nothing the services print is shown with the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        sdf = service.build_pipeline(app)
+        started = time.perf_counter()
+        durations = app.run(sdf)
+        seconds = time.perf_counter() - started
+    return stage_result(stage, durations, sum(len(broker.messages(topic)) for topic in output_topics), seconds)
+
+
+def sink(broker: InMemoryBroker, state_dir: str) -> StageResult:
+    with FakeInfluxDB() as influxdb:
+        # the configuration of the "InfluxDB 3.0 Raw Data" deployment
+        service = load_service("sink", {
+            "input": downsampled_topic,
+            "INFLUXDB_HOST": influxdb.url,
+            "INFLUXDB_TOKEN": "benchmark",
+            "INFLUXDB_ORG": "benchmark",
+            "INFLUXDB_DATABASE": "benchmark",
+            "INFLUXDB_MEASUREMENT_NAME": "Data",
+            "INFLUXDB_TAG_KEYS": "['printer']",
+            "INFLUXDB_FIELD_KEYS": "['mean_hotend_temperature', 'mean_bed_temperature', 'mean_ambient_temperature', "
+                                   "'mean_fluctuated_ambient_temperature', 'count']",
+            "INFLUXDB_SPILL_PATH": "",
+        })
+        input_topic = service.create_input_topic(InMemoryApplication(broker, os.path.join(state_dir, "sink")))
+        buffer = service.WriteBuffer(service.batch_size, service.batch_max_bytes, service.batch_linger_ms / 1000)
+        writer = service.create_writer()
+
+        started = time.perf_counter()
+        durations = []
+        for message in broker.messages(downsampled_topic):
+            message_started = time.perf_counter()
+            service.process_message(buffer, message, input_topic)
+            if buffer.is_ready():
+                writer.submit(service.take_batch(buffer))
+            writer.process()
+            durations.append(time.perf_counter() - message_started)
+        writer.submit(service.take_batch(buffer))
+        writer.close()
+        return stage_result("sink", durations, influxdb.lines, time.perf_counter() - started)
+
+
+def run(printers: int, datalength: int, wire_format: str, metrics: str, tracing: str) -> List[StageResult]:
+    os.environ["wire_format"] = wire_format
+    os.environ["metrics_enabled"] = "true" if metrics == "on" else "false"
+    os.environ["tracing_enabled"] = "true" if tracing == "on" else "false"
+    broker = InMemoryBroker()
+    results = []
+    with tempfile.TemporaryDirectory() as working_dir:
+        os.chdir(working_dir)  # the services create a .env file where they run
+        results.append(generate(broker, printers, datalength, wire_format))
+
+        downsampling = load_service("downsampling", {"input": raw_topic, "output": downsampled_topic})
+        results.append(run_pipeline("downsampling", downsampling, broker, working_dir,
+                                    [downsampled_topic, *(f"{downsampled_topic}-{name}"
+                                                          for name in list(downsampling.resolutions)[1:])],
+                                    rocksdb_options=downsampling.rocksdb_options))
+
+        forecast = load_service("forecast", {"input": downsampled_topic, "output": forecast_topic})
+        results.append(run_pipeline("forecast", forecast, broker, working_dir, [forecast_topic],
+                                    rocksdb_options=forecast.rocksdb_options))
+
+        alerts = load_service("alerts", {"forecast_topic": forecast_topic, "alert_topic": alerts_topic})
+        results.append(run_pipeline("alerts", alerts, broker, working_dir, [alerts_topic],
+                                    rocksdb_options=alerts.rocksdb_options))
+
+        anomalies = load_service("anomalies", {"input": raw_topic, "alert_topic": anomalies_topic})
+        results.append(run_pipeline("anomalies", anomalies, broker, working_dir, [anomalies_topic],
+                                    rocksdb_options=anomalies.rocksdb_options))
+
+        results.append(sink(broker, working_dir))
+        os.chdir(root)
+    return results
+
+
+def print_results(results: List[StageResult]):
+    print(f"{'stage':<13}{'in':>10}{'out':>10}{'seconds':>10}{'msgs/s':>12}{'p50 µs':>10}{'p99 µs':>10}"
+          f"{'peak RSS MB':>13}")
+    for result in results:
+        print(f"{result.stage:<13}{result.messages_in:>10}{result.messages_out:>10}{result.seconds:>10.2f}"
+              f"{result.messages_per_second:>12.0f}{result.p50_us:>10.1f}{result.p99_us:>10.1f}"
+              f"{result.peak_rss_mb:>13.0f}")
+
+
+def regressions(results: List[StageResult], baseline: List[dict], max_regression: float) -> List[str]:
+    baseline_rates = {result["stage"]: result["messages_per_second"] for result in baseline}
+    return [f"{result.stage}: {result.messages_per_second:.0f} msgs/s, "
+            f"{baseline_rates[result.stage]:.0f} in the baseline"
+            for result in results
+            if result.stage in baseline_rates
+            and result.messages_per_second < baseline_rates[result.stage] * (1 - max_regression)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--printers", type=int, default=10)
+    parser.add_argument("--datalength", type=int, default=3600, help="seconds of data per printer")
+    parser.add_argument("--wire-format", choices=("json", "binary"), default="json")
+    parser.add_argument("--metrics", choices=("on", "off"), default="on", help="instrumentation of the services")
+    parser.add_argument("--tracing", choices=("on", "off"), default="on", help="trace headers of the messages")
+    parser.add_argument("--output", help="file to write the results to, in JSON")
+    parser.add_argument("--baseline", help="results of a previous run to compare the throughput with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fraction of the baseline throughput a stage can lose before the run fails")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # only the warnings of the services
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args.printers, args.datalength, args.wire_format, args.metrics, args.tracing)
+
+    print(f"{args.printers} printers, {args.datalength} seconds of data, {args.wire_format} messages, "
+          f"metrics {args.metrics}, tracing {args.tracing}")
+    print_results(results)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump([result._asdict() for result in results], file, indent=2)
+
+    if baseline:
+        with open(baseline) as file:
+            slower = regressions(results, json.load(file), args.max_regression)
+        if slower:
+            print(f"Throughput regressions of more than {args.max_regression:.0%}:")
+            for line in slower:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
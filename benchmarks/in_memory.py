@@ -0,0 +1,184 @@
+"""
+Stand-ins for Kafka and InfluxDB, to run the services' pipelines in one process without a Quix workspace.
+"""
+import threading
+import time
+from contextvars import copy_context
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from confluent_kafka import TopicPartition
+from quixstreams import Application
+from quixstreams.context import set_message_context
+from quixstreams.core.stream.functions import Filtered
+from quixstreams.models.rows import Row
+from quixstreams.models.topics import Topic
+
+TIMESTAMP_CREATE_TIME = 1
+
+
+class InMemoryMessage:
+    """
+    A consumed message, with the interface of confluent_kafka.Message the topics deserialize.
+    """
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers", "_timestamp")
+
+    def __init__(self, topic: str, offset: int, key: Optional[bytes], value: bytes, headers: Optional[list],
+                 timestamp_ms: int, partition: int = 0):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+        self._timestamp = timestamp_ms
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+    def key(self) -> Optional[bytes]:
+        return self._key
+
+    def value(self) -> bytes:
+        return self._value
+
+    def headers(self) -> Optional[list]:
+        return self._headers
+
+    def timestamp(self):
+        return TIMESTAMP_CREATE_TIME, self._timestamp
+
+    def latency(self) -> Optional[float]:
+        return None
+
+    def leader_epoch(self) -> Optional[int]:
+        return None
+
+    def error(self):
+        return None
+
+    def __len__(self) -> int:
+        return len(self._value)
+
+
+class InMemoryBroker:
+    """
+    Topics as lists of messages, in a single partition. It's also the row producer of the pipelines:
+    a produced row is serialized by its topic like the Kafka producer does, and keeps the timestamp of the message
+    it was produced from.
+    """
+
+    def __init__(self):
+        self.topics: Dict[str, List[InMemoryMessage]] = {}
+
+    def produce(self, topic: str, value: bytes, key: Optional[bytes] = None, headers: Optional[dict] = None,
+                timestamp_ms: int = 0):
+        messages = self.topics.setdefault(topic, [])
+        headers = list(headers.items()) if headers else None
+        messages.append(InMemoryMessage(topic, len(messages), key, value, headers, timestamp_ms))
+
+    def produce_row(self, row: Row, topic: Topic, key=None, partition: Optional[int] = None,
+                    timestamp: Optional[int] = None):
+        message = topic.row_serialize(row=row, key=key)
+        self.produce(topic.name, message.value, message.key, message.headers,
+                     timestamp if timestamp is not None else row.timestamp.milliseconds)
+
+    def messages(self, topic: str) -> List[InMemoryMessage]:
+        return self.topics.get(topic, [])
+
+
+class InMemoryApplication(Application):
+    """
+    An Application whose dataframes consume and produce the topics of an InMemoryBroker.
+    The broker address is never connected to: 'run' processes the messages of the input topic
+    the way Application.run does, with a state transaction per message, and returns the time each one took.
+    """
+
+    def __init__(self, broker: InMemoryBroker, state_dir: str, **kwargs):
+        super().__init__(broker_address="localhost:9092", consumer_group="benchmark", state_dir=state_dir,
+                         use_changelog_topics=False, auto_create_topics=False, loglevel="WARNING", **kwargs)
+        self.broker = broker
+
+    def dataframe(self, topic: Topic):
+        sdf = super().dataframe(topic)
+        sdf.producer = self.broker
+        return sdf
+
+    def run(self, dataframe) -> List[float]:
+        topic = dataframe.topic
+        composed = dataframe.compose()
+        state_manager = self._state_manager
+        durations = []
+
+        with state_manager:
+            stateful = bool(state_manager.stores)
+            if stateful:
+                state_manager.on_partition_assign(TopicPartition(topic.name, 0))
+
+            for message in self.broker.messages(topic.name):
+                started = time.perf_counter()
+                rows = topic.row_deserialize(message)
+                rows = rows if isinstance(rows, list) else [rows] if rows is not None else []
+                if stateful:
+                    with state_manager.start_store_transaction(topic.name, 0, message.offset()):
+                        self._process_rows(composed, rows)
+                else:
+                    self._process_rows(composed, rows)
+                durations.append(time.perf_counter() - started)
+        return durations
+
+    @staticmethod
+    def _process_rows(composed, rows: List[Row]):
+        for row in rows:
+            context = copy_context()
+            context.run(set_message_context, row.context)
+            try:
+                context.run(composed, row.value)
+            except Filtered:
+                pass
+
+
+class FakeInfluxDB:
+    """
+    An HTTP server accepting every write, in a background thread, counting the lines and bytes written.
+    """
+
+    def __init__(self):
+        fake = self
+        self.requests = 0
+        self.lines = 0
+        self.bytes = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.requests += 1
+                fake.lines += body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+                fake.bytes += len(body)
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
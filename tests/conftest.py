@@ -0,0 +1,64 @@
+"""
+The service folders aren't packages: their modules are imported from their folder, like the services do,
+and their main.py is loaded by 'load_service' with its environment variables.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+service_folders = {
+    "generator": "Data Generator",
+    "downsampling": "Down-sampling",
+    "forecast": "Forecast Service",
+    "alerts": "Alert Service",
+    "anomalies": "Anomaly Detection Service",
+    "sink": "InfluxDB 3.0 Sink",
+}
+# the shared modules (wire_format.py, tracing.py, instrumentation.py) are the same in every folder
+sys.path[:0] = [os.path.join(root, folder) for folder in service_folders.values()]
+# the in-memory Kafka stand-ins of the benchmarks, to run the pipelines
+sys.path.append(os.path.join(root, "benchmarks"))
+
+
+class FakeState:
+    """
+    The per-key state of a stateful function, in a dict.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def exists(self, key) -> bool:
+        return key in self.values
+
+
+@pytest.fixture
+def load_service(monkeypatch, tmp_path):
+    """
+    Import the main.py of a service with its environment variables, in a temporary folder for its .env file.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("metrics_enabled", "false")
+
+    def load(name: str, **environment):
+        for variable, value in environment.items():
+            monkeypatch.setenv(variable, value)
+        spec = importlib.util.spec_from_file_location(f"{name}_main",
+                                                      os.path.join(root, service_folders[name], "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
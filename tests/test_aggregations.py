@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+
+from aggregations import MultiResolutionAggregator, event_time, parse_duration, parse_list, state_dumps, state_loads
+from conftest import FakeState
+
+start_ms = 1709304300000  # a multiple of an hour
+fields = ["hotend_temperature", "bed_temperature"]
+
+
+class SerializedState(FakeState):
+    """
+    The state, with its values written and read back by the serializer of the service's state store.
+    """
+
+    def get(self, key, default=None):
+        value = self.values.get(key)
+        return default if value is None else state_loads(value)
+
+    def set(self, key, value):
+        self.values[key] = state_dumps(value)
+
+
+def samples(count: int, seed: int = 0):
+    random = np.random.default_rng(seed)
+    return [{"hotend_temperature": 250 + random.normal(), "bed_temperature": 110 + random.normal(),
+             "original_timestamp": start_ms + i * 1000 + 512}
+            for i in range(count)]
+
+
+def test_every_resolution_has_the_aggregates_of_its_windows():
+    aggregator = MultiResolutionAggregator(fields, ["sum", "mean", "min", "max", "count", "variance", "stddev"],
+                                           {"10s": 10_000, "1m": 60_000})
+    state = SerializedState()
+    messages = samples(125)
+    rows = []
+    for i, value in enumerate(messages):
+        rows.extend(aggregator.process(value, start_ms + i * 1000, "Printer 1", state))
+
+    # the windows closed by the last message, 12 of 10 seconds and 2 of a minute
+    assert [(row["resolution"], row["timestamp"]) for row in rows if row["resolution"] == "1m"] \
+        == [("1m", start_ms), ("1m", start_ms + 60_000)]
+    assert len([row for row in rows if row["resolution"] == "10s"]) == 12
+
+    for row in rows:
+        duration = 10 if row["resolution"] == "10s" else 60
+        first = (row["timestamp"] - start_ms) // 1000
+        window = messages[first:first + duration]
+        assert row["count"] == duration
+        assert row["printer"] == "Printer 1"
+        assert row["original_timestamp"] == window[0]["original_timestamp"]
+        for field in fields:
+            values = np.array([value[field] for value in window])
+            assert row[f"sum_{field}"] == pytest.approx(values.sum(), rel=1e-12)
+            assert row[f"mean_{field}"] == pytest.approx(values.mean(), rel=1e-12)
+            assert row[f"min_{field}"] == values.min()
+            assert row[f"max_{field}"] == values.max()
+            assert row[f"variance_{field}"] == pytest.approx(values.var(ddof=1), rel=1e-9)
+            assert row[f"stddev_{field}"] == pytest.approx(values.std(ddof=1), rel=1e-9)
+
+
+def test_the_open_windows_are_packed_records():
+    aggregator = MultiResolutionAggregator(fields, ["mean"], {"10s": 10_000, "1m": 60_000}, grace_ms=5000)
+    state = SerializedState()
+    for i, value in enumerate(samples(63)):
+        aggregator.process(value, start_ms + i * 1000, "Printer 1", state)
+
+    # the windows still open, a float64 record of 3 + 5 values per field each, behind the marker byte
+    record_bytes = 8 * (3 + 5 * len(fields))
+    assert len(state.values["window_10s"]) == 1 + 2 * record_bytes  # the windows at 50s (in the grace) and 60s
+    assert len(state.values["window_1m"]) == 1 + 2 * record_bytes
+    assert state.get("window_10s_original_timestamp") == [start_ms + 50_512, start_ms + 60_512]
+
+
+def test_only_the_configured_fields_and_aggregates_are_written():
+    aggregator = MultiResolutionAggregator(["ambient_temperature"], ["max"], {"10s": 10_000})
+    state = FakeState()
+    for i in range(11):
+        rows = aggregator.process({"ambient_temperature": 50.0 + i, "hotend_temperature": 250.0},
+                                  start_ms + i * 1000, "Printer 2", state)
+    assert rows == [{"timestamp": start_ms, "resolution": "10s", "max_ambient_temperature": 59.0,
+                     "original_timestamp": None, "count": 10, "printer": "Printer 2"}]
+
+
+def test_printers_have_their_own_windows():
+    aggregator = MultiResolutionAggregator(fields, ["mean"], {"10s": 10_000})
+    states = {"Printer 1": SerializedState(), "Printer 2": SerializedState()}
+    rows = []
+    for i in range(20):
+        for printer, offset in (("Printer 1", 0.0), ("Printer 2", 100.0)):
+            value = {"hotend_temperature": offset + i, "bed_temperature": offset}
+            rows.extend(aggregator.process(value, start_ms + i * 1000, printer, states[printer]))
+    assert [(row["printer"], row["mean_hotend_temperature"]) for row in rows] \
+        == [("Printer 1", 4.5), ("Printer 2", 104.5)]
+
+
+def test_single_message_windows_have_no_variance():
+    aggregator = MultiResolutionAggregator(fields, ["stddev"], {"1s": 1000})
+    state = FakeState()
+    aggregator.process({"hotend_temperature": 250.0, "bed_temperature": 110.0}, start_ms, "Printer 1", state)
+    rows = aggregator.process({"hotend_temperature": 250.0, "bed_temperature": 110.0}, start_ms + 1000,
+                              "Printer 1", state)
+    assert rows[0]["stddev_hotend_temperature"] == 0.0 and rows[0]["count"] == 1
+
+
+def test_configuration():
+    assert parse_duration("500ms") == 500 and parse_duration(" 10s ") == 10_000 and parse_duration("1d") == 86_400_000
+    with pytest.raises(ValueError):
+        parse_duration("10 seconds")
+    with pytest.raises(ValueError):
+        MultiResolutionAggregator(fields, ["mean", "median"], {"10s": 10_000})
+    assert parse_list(" mean, min,,max ") == ["mean", "min", "max"]
+    assert event_time({"timestamp": "2024-03-01T14:45:00+00:00"}, "timestamp", 0) == start_ms
+    assert event_time({"timestamp": start_ms}, "timestamp", 0) == start_ms
+    assert event_time({}, "timestamp", 42) == 42
+
+
+def process_all(aggregator, timestamps, state=None):
+    """
+    The rows of messages at these offsets from 'start_ms', in this order.
+    """
+    state = state if state is not None else FakeState()
+    rows = []
+    for timestamp in timestamps:
+        value = {"hotend_temperature": float(timestamp % 100_000) / 1000, "bed_temperature": 110.0,
+                 "original_timestamp": timestamp}
+        rows.extend(aggregator.process(value, start_ms + timestamp, "Printer 1", state))
+    return rows
+
+
+def test_late_messages_within_the_grace_period_are_added():
+    aggregator = MultiResolutionAggregator(fields, ["count"], {"10s": 10_000}, grace_ms=5000)
+    # 11s is received before 9s, and the window of 0-10s only closes at 15s
+    rows = process_all(aggregator, [0, 1000, 11_000, 9000, 14_000, 15_000])
+    assert [(row["timestamp"] - start_ms, row["count"]) for row in rows] == [(0, 3)]
+    assert aggregator.late["10s"] == 1 and not aggregator.dropped
+
+
+def test_messages_past_the_watermark_are_dropped():
+    aggregator = MultiResolutionAggregator(fields, ["count"], {"10s": 10_000, "1m": 60_000})
+    rows = process_all(aggregator, [0, 1000, 12_000, 9000, 61_000])
+    # the 10s window of 9s was closed by 12s, its 1m window is still open
+    assert [(row["resolution"], row["timestamp"] - start_ms, row["count"]) for row in rows] \
+        == [("10s", 0, 2), ("10s", 10_000, 1), ("1m", 0, 4)]
+    assert aggregator.dropped == {"10s": 1} and aggregator.late == {"1m": 1}
+
+
+def test_windows_close_with_the_watermark_not_the_next_window():
+    aggregator = MultiResolutionAggregator(fields, ["count"], {"10s": 10_000}, grace_ms=15_000)
+    state = FakeState()
+    # several windows are open at once, they close in order as the watermark passes their end
+    assert process_all(aggregator, [0, 10_000, 20_000, 24_000], state) == []
+    rows = process_all(aggregator, [25_000, 35_000], state)
+    assert [(row["timestamp"] - start_ms, row["count"]) for row in rows] == [(0, 1), (10_000, 1)]
+    # a message of a window still open, older than the latest one, is still added to it
+    rows = process_all(aggregator, [21_000, 45_000], state)
+    assert [(row["timestamp"] - start_ms, row["count"]) for row in rows] == [(20_000, 4)]
+    assert aggregator.late == {"10s": 1}
+
+
+def test_early_rows_are_corrected_by_the_final_row():
+    aggregator = MultiResolutionAggregator(fields, ["count"], {"10s": 10_000}, emit_early=True,
+                                           early_interval_ms=3000)
+    rows = process_all(aggregator, [0, 1000, 2000, 3000, 4000, 9000, 10_000])
+    assert [(row["timestamp"] - start_ms, row["count"], row["final"]) for row in rows] \
+        == [(0, 1, False), (0, 4, False), (0, 6, False), (0, 6, True), (10_000, 1, False)]
+
+
+def test_forecast_drops_the_rows_out_of_event_time_order(load_service):
+    forecast = load_service("forecast")
+    state = FakeState()
+    timestamps = [start_ms, start_ms + 10_000, start_ms + 10_000, start_ms + 5000, start_ms + 20_000]
+    assert [forecast.in_event_time_order({"printer": "Printer 1", "timestamp": timestamp}, state)
+            for timestamp in timestamps] == [True, True, False, False, True]
@@ -0,0 +1,54 @@
+from alert_dedup import AlertDeduplicator
+from conftest import FakeState
+from rules import NORMAL, RuleEngine, parse_rules
+
+day_ms = 86400 * 1000
+
+
+def alert(timestamp: str = "2024-03-01 14:45:20", status: str = "over-forecast") -> dict:
+    return {"status": status, "parameter_name": "ambient_temperature", "alert_temperature": 76.0,
+            "timestamp": timestamp, "message": "..."}
+
+
+def test_alerts_are_sent_once():
+    deduplicator = AlertDeduplicator(1000, day_ms)
+    state = FakeState()
+    assert deduplicator.is_new(state, alert(), 0)
+    # the temperature and message don't identify it
+    assert not deduplicator.is_new(state, {**alert(), "alert_temperature": 77.0, "message": "other"}, 1000)
+    assert deduplicator.is_new(state, alert("2024-03-01 14:45:30"), 2000)
+    assert deduplicator.is_new(state, alert(status="under-forecast"), 3000)
+
+
+def test_alerts_are_forgotten_after_the_ttl_or_past_the_capacity():
+    deduplicator = AlertDeduplicator(3, day_ms)
+    state = FakeState()
+    assert deduplicator.is_new(state, alert(), 0)
+    assert deduplicator.is_new(state, alert(), day_ms + 1)
+
+    for second in range(10, 14):
+        assert deduplicator.is_new(state, alert(f"2024-03-01 14:45:{second}"), day_ms + second)
+    assert len(state.get(deduplicator.state_key)) == 3
+    assert deduplicator.is_new(state, alert(), day_ms + 20)  # the oldest one was evicted
+    assert not deduplicator.is_new(state, alert("2024-03-01 14:45:13"), day_ms + 21)
+
+
+def test_rules_on_the_same_parameter_alert_apart():
+    # a warning and a critical limit, crossed at the same step of a forecast
+    engine = RuleEngine(parse_rules([
+        {"parameter": "mean_fluctuated_ambient_temperature", "parameter_name": "ambient_temperature", "high": 75},
+        {"parameter": "mean_fluctuated_ambient_temperature", "parameter_name": "ambient_temperature", "high": 78},
+    ]))
+    horizon = [{"timestamp": "2024-03-01 14:45:20", "forecast_mean_fluctuated_ambient_temperature": 74.0},
+               {"timestamp": "2024-03-01 14:45:30", "forecast_mean_fluctuated_ambient_temperature": 80.0}]
+    _, triggered = engine.evaluate(horizon, [NORMAL, NORMAL])
+    alerts = [(engine.rules[rule_index].key, engine.to_alert(horizon, rule_index, rule_state, step, signal))
+              for rule_index, rule_state, step, signal in triggered]
+    assert len(alerts) == 2
+    assert {field: value for field, value in alerts[0][1].items() if field != "message"} \
+        == {field: value for field, value in alerts[1][1].items() if field != "message"}
+
+    deduplicator = AlertDeduplicator(1000, day_ms)
+    state = FakeState()
+    assert [deduplicator.is_new(state, alert, 0, rule) for rule, alert in alerts] == [True, True]
+    assert [deduplicator.is_new(state, alert, 0, rule) for rule, alert in alerts] == [False, False]
@@ -0,0 +1,38 @@
+import json
+
+from in_memory import InMemoryApplication, InMemoryBroker
+
+forecast_topic = "forecast"
+alerts_topic = "alerts"
+length = 3
+
+
+def send_forecasts(broker: InMemoryBroker, forecasts: dict, start_minute: int):
+    """
+    The forecast rows of every printer, interleaved like the partition of the printers does.
+    """
+    for index in range(length):
+        for printer, values in forecasts.items():
+            row = {"timestamp": (start_minute + index) * 60000, "printer": printer, "forecast_index": index,
+                   "forecast_length": length, "forecast_mean_fluctuated_ambient_temperature": values[index]}
+            broker.produce(forecast_topic, json.dumps(row).encode(), printer.encode(),
+                           timestamp_ms=start_minute * 60000)
+
+
+def test_printers_alert_independently(load_service, tmp_path):
+    alerts = load_service("alerts", forecast_topic=forecast_topic, alert_topic=alerts_topic,
+                          tracing_enabled="false", alert_rules="")
+    broker = InMemoryBroker()
+    # Printer 2 is forecasted under 73ºC, then both printers are
+    send_forecasts(broker, {"Printer 1": [74, 74, 74], "Printer 2": [74, 72, 71]}, 0)
+    send_forecasts(broker, {"Printer 1": [74, 74, 72.5], "Printer 2": [71, 71, 70]}, 1)
+
+    app = InMemoryApplication(broker, str(tmp_path / "state"), rocksdb_options=alerts.rocksdb_options)
+    app.run(alerts.build_pipeline(app))
+
+    sent = [(message.key(), json.loads(message.value())) for message in broker.messages(alerts_topic)]
+    assert [(key, alert["printer"], alert["status"], alert["timestamp"]) for key, alert in sent] == [
+        (b"Printer 2", "Printer 2", "under-forecast", 60000),
+        # Printer 2 is still under, its alert isn't sent again
+        (b"Printer 1", "Printer 1", "under-forecast", 180000),
+    ]
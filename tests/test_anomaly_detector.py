@@ -0,0 +1,64 @@
+import numpy as np
+
+from conftest import FakeState
+from detectors import OVER, UNDER, AnomalyDetector, state_dumps, state_loads
+
+fields = ["hotend_temperature", "bed_temperature"]
+
+
+def create_detector(warmup_samples: int = 50) -> AnomalyDetector:
+    return AnomalyDetector(fields, alpha=0.02, z_threshold=4, cusum_slack=0.5, cusum_threshold=8,
+                           warmup_samples=warmup_samples, relearn_samples=20)
+
+
+def samples(count: int, hotend: float = 250, bed: float = 110, seed: int = 0):
+    random = np.random.default_rng(seed)
+    return np.column_stack((random.normal(hotend, 0.5, count), random.normal(bed, 0.5, count))).tolist()
+
+
+def detect(detector: AnomalyDetector, state: FakeState, values) -> list:
+    return [(index, anomaly.field, anomaly.state) for index, sample in enumerate(values)
+            for anomaly in detector.process(sample, state)]
+
+
+def test_nothing_is_detected_during_the_warmup():
+    detector, state = create_detector(), FakeState()
+    # a jump in the first samples is learned as they come
+    values = samples(10, hotend=200) + samples(40, seed=1)
+    assert detect(detector, state, values) == []
+    assert detect(detector, state, samples(500, seed=2)) == []
+
+
+def test_a_step_is_reported_once():
+    detector, state = create_detector(), FakeState()
+    detect(detector, state, samples(200))
+
+    # the hotend drops by 20 standard deviations and stays there
+    assert detect(detector, state, samples(100, hotend=240, seed=1)) == [(0, 0, UNDER)]
+
+
+def test_a_lasting_level_is_relearned():
+    detector, state = create_detector(), FakeState()
+    detect(detector, state, samples(200))
+    assert detect(detector, state, samples(200, bed=115, seed=1)) == [(0, 1, OVER)]
+
+    # the new level is the normal one, a step from it is a new anomaly
+    assert detect(detector, state, samples(200, bed=115, seed=2)) == []
+    assert detect(detector, state, samples(10, bed=105, seed=3))[:1] == [(0, 1, UNDER)]
+
+
+def test_a_small_shift_is_found_by_the_cusum():
+    detector, state = create_detector(), FakeState()
+    detect(detector, state, samples(200))
+    # 1.5 standard deviations, under the z-score threshold
+    anomalies = detect(detector, state, samples(100, hotend=250.75, seed=1))
+    assert anomalies[:1] and anomalies[0][1:] == (0, OVER) and anomalies[0][0] > 0
+
+
+def test_the_packed_state_round_trips():
+    detector, state = create_detector(), FakeState()
+    detect(detector, state, samples(10))
+    packed = state.get(detector.state_key)
+    assert len(packed) == 8 * (1 + 6 * len(fields))
+    assert state_loads(state_dumps(packed)) == packed
+    assert state_loads(state_dumps(["Printer 1"])) == ["Printer 1"]
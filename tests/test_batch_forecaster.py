@@ -0,0 +1,49 @@
+import numpy as np
+
+from batch_forecaster import ForecastBatcher
+from conftest import FakeState
+from models import ARModel, HoltModel, PolynomialModel
+from rolling_history import HistoryStore
+
+printers = ["Printer 1", "Printer 2", "Printer 3"]
+length = 5
+
+
+def interleaved_rows(rows_per_printer: int):
+    """
+    The rows of the printers, in turn, with a trend of their own and some noise.
+    """
+    random = np.random.default_rng(1)
+    for step in range(rows_per_printer):
+        for i, printer in enumerate(printers):
+            yield {"printer": printer, "timestamp": step * 1000,
+                   "numpy": 200 + i * step + random.normal(), "sklearn": 50 - i * step + random.normal(),
+                   "holt": 30 + random.normal(), "ar": 10 + random.normal()}
+
+
+def test_mixed_batch_keeps_the_order_of_every_printer():
+    store = HistoryStore(20, {"numpy": PolynomialModel, "sklearn": lambda: PolynomialModel(backend="sklearn"),
+                              "holt": HoltModel, "ar": ARModel})
+    states = {printer: FakeState() for printer in printers}
+    # a batch is 7 requests, so the batches start with any of the printers and mix them
+    batcher = ForecastBatcher(length, 7, interval_seconds=3600)
+
+    expected = {printer: [] for printer in printers}
+    results = []
+    for row in interleaved_rows(40):
+        models = store.append(row["printer"], states[row["printer"]], row)
+        if not models.is_ready():
+            continue
+        # what the single mode would forecast for the row
+        expected[row["printer"]].append((row["timestamp"], models.forecast(length)))
+        results.extend(batcher.add(row["printer"], row["timestamp"], models))
+    results.extend(batcher.flush())
+
+    for printer in printers:
+        forecasts = [(request.timestamp, field_forecasts) for request, field_forecasts in results
+                     if request.printer == printer]
+        assert [timestamp for timestamp, _ in forecasts] == [timestamp for timestamp, _ in expected[printer]]
+        for (_, batched), (_, single) in zip(forecasts, expected[printer]):
+            for field in single:
+                np.testing.assert_allclose(batched[field], single[field], rtol=1e-9)
+
@@ -0,0 +1,21 @@
+import os
+from unittest import mock
+
+import benchmark_pipeline
+
+
+def test_every_stage_of_the_pipeline_has_output(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    # the benchmark sets the environment variables of the services
+    with mock.patch.dict(os.environ):
+        results = {result.stage: result for result in benchmark_pipeline.run(2, 600, "json", "on", "on")}
+
+    assert list(results) == ["generate", "downsampling", "forecast", "alerts", "anomalies", "sink"]
+    assert results["generate"].messages_out == 2 * 600
+    for result in results.values():
+        assert result.messages_in > 0 and result.messages_out > 0, result.stage
+    # every stage consumes everything its input stage produced
+    assert results["downsampling"].messages_in == results["anomalies"].messages_in == 2 * 600
+    assert results["alerts"].messages_in == results["forecast"].messages_out
+    # a point and a latency line per down-sampled message
+    assert results["sink"].messages_out == 2 * results["sink"].messages_in
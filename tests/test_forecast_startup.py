@@ -0,0 +1,13 @@
+def test_startup_times_are_metrics(load_service):
+    forecast = load_service("forecast", metrics_enabled="true")
+    assert "forecast_first_forecast_seconds 0" in forecast.instrumentation.render()
+
+    forecast.log_startup_time()
+    forecast.log_first_forecast({})
+    first_forecast_time = forecast.first_forecast_time
+    forecast.log_first_forecast({})  # only the first one is measured
+
+    metrics = forecast.instrumentation.render()
+    assert f"forecast_first_forecast_seconds {first_forecast_time!r}" in metrics
+    assert forecast.startup_seconds.value > 0
+    assert forecast.first_forecast_seconds.value == first_forecast_time
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from forecasters import fit, fit_batch, forecast, forecast_batch, init_stats, slide_stats, sklearn_forecast, \
+    update_stats
+
+length = 10
+degrees = [1, 2, 3]
+
+
+def temperatures(count: int, seed: int = 0) -> np.ndarray:
+    """
+    Values like the down-sampled temperatures: a slow drift with noise.
+    """
+    random = np.random.default_rng(seed)
+    return 200 + 0.05 * np.arange(count) + 0.001 * np.arange(count) ** 2 + random.normal(0, 2, count)
+
+
+def running_sums(values: np.ndarray, degree: int):
+    stats = init_stats(degree)
+    for value in values:
+        update_stats(stats, degree, float(value))
+    return stats
+
+
+@pytest.mark.parametrize("degree", degrees)
+@pytest.mark.parametrize("count", [30, 120])
+def test_fit_matches_sklearn(degree, count):
+    values = temperatures(count)
+    stats = running_sums(values, degree)
+
+    np.testing.assert_allclose(forecast(stats, degree, length), sklearn_forecast(values, degree, length),
+                               rtol=1e-10)
+    # the fit itself, on the values
+    np.testing.assert_allclose(np.polynomial.polynomial.polyval(np.arange(count), fit(stats, degree)),
+                               np.polyval(np.polyfit(np.arange(count), values, degree), np.arange(count)),
+                               rtol=1e-10)
+
+
+@pytest.mark.parametrize("degree", degrees)
+def test_slid_sums_match_sklearn_on_the_window(degree):
+    window = 60
+    values = temperatures(window * 3)
+    stats = running_sums(values[:window], degree)
+
+    # up to a full window of slides, the model rebuilds its sums after that
+    for end in range(window + 1, 2 * window + 1):
+        slide_stats(stats, degree, float(values[end - window - 1]), float(values[end - 1]))
+        np.testing.assert_allclose(forecast(stats, degree, length),
+                                   sklearn_forecast(values[end - window:end], degree, length), rtol=1e-10)
+
+
+@pytest.mark.parametrize("degree", degrees)
+def test_batch_matches_sklearn(degree):
+    # histories of different lengths and levels in one batch
+    histories = [temperatures(count, seed) + seed * 10 for seed, count in enumerate([degree + 1, 20, 45, 60, 60])]
+    stats = np.array([running_sums(values, degree) for values in histories])
+
+    expected = np.array([sklearn_forecast(values, degree, length) for values in histories])
+    np.testing.assert_allclose(forecast_batch(stats, degree, length), expected, rtol=1e-10)
+    # the coefficients, on the values they were fitted on
+    x = np.arange(60)
+    np.testing.assert_allclose([np.polynomial.polynomial.polyval(x, coefficients)
+                                for coefficients in fit_batch(stats, degree)],
+                               [np.polynomial.polynomial.polyval(x, fit(row, degree)) for row in stats], rtol=1e-10)
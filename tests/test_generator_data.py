@@ -0,0 +1,96 @@
+import random
+
+import numpy as np
+import pytest
+
+datalength = 20000
+runs = 8
+
+
+@pytest.fixture
+def generator(load_service):
+    return load_service("generator", datalength=str(datalength), number_of_anomalies="20")
+
+
+def both_generators(generator):
+    """
+    The columns of 'runs' printers, from the loop and from the vectorized generator.
+    """
+    loops = [generator.to_columns([frame._asdict() for frame in generator.stream_data(random.Random(seed))])
+             for seed in range(runs)]
+    vectorized = [generator.generate_data_vectorized(seed) for seed in range(runs)]
+    return loops, vectorized
+
+
+def statistics(columns: dict) -> dict:
+    hotend_deficit = 250 - columns["hotend_temperature"]
+    bed_deficit = 110 - columns["bed_temperature"]
+    fluctuations = columns["fluctuated_ambient_temperature"] - columns["ambient_temperature"]
+    # away from the anomalies, the noise of the sensors
+    hotend_normal = hotend_deficit[hotend_deficit < 2]
+    return {
+        "hotend_noise_mean": hotend_normal.mean(),
+        "hotend_noise_std": hotend_normal.std(),
+        "hotend_anomaly_samples": np.mean(hotend_deficit > 5),
+        "hotend_anomaly_deficit": hotend_deficit.mean(),
+        "hotend_deepest_anomaly": hotend_deficit.max(),
+        "bed_anomaly_deficit": bed_deficit.mean(),
+        "bed_deepest_anomaly": bed_deficit.max(),
+        "fluctuated_samples": np.mean(fluctuations != 0),
+        "fluctuation_amplitude": np.abs(fluctuations[fluctuations != 0]).mean(),
+    }
+
+
+def test_vectorized_data_has_the_statistics_of_the_loop(generator):
+    loops, vectorized = both_generators(generator)
+    loop_statistics = [statistics(columns) for columns in loops]
+    vectorized_statistics = [statistics(columns) for columns in vectorized]
+
+    for name in loop_statistics[0]:
+        loop_value = np.mean([values[name] for values in loop_statistics])
+        vectorized_value = np.mean([values[name] for values in vectorized_statistics])
+        assert vectorized_value == pytest.approx(loop_value, rel=0.1, abs=0.02), name
+
+    # the anomalies go down to the full fluctuation in both
+    for values in loop_statistics + vectorized_statistics:
+        assert values["hotend_deepest_anomaly"] == pytest.approx(generator.anomaly_fluctuation, abs=2.5)
+        assert values["bed_deepest_anomaly"] == pytest.approx(generator.anomaly_fluctuation / 2, abs=2.5)
+
+
+def test_vectorized_ambient_trend_is_the_loop_trend(generator):
+    loops, vectorized = both_generators(generator)
+    # the means of every tenth of the data follow the same curve
+    loop_trend = np.mean([np.mean(np.split(columns["ambient_temperature"], 10), axis=1) for columns in loops], axis=0)
+    vectorized_trend = np.mean([np.mean(np.split(columns["ambient_temperature"], 10), axis=1)
+                                for columns in vectorized], axis=0)
+    np.testing.assert_allclose(vectorized_trend, loop_trend, atol=0.05)
+    # 50ºC in the first half, then from 75ºC down to 37.5ºC
+    assert loop_trend[0] == pytest.approx(50, abs=0.05)
+    assert loop_trend[-1] < loop_trend[0] < loop_trend[5]
+
+
+def test_stream_data_is_lazy(generator):
+    frames = generator.stream_data(random.Random(0))
+    # a generator, nothing is computed before the first frame is asked for
+    assert iter(frames) is frames
+    first = next(frames)
+    assert isinstance(first, generator.Frame)
+    assert 1 + sum(1 for _ in frames) == datalength
+
+
+def test_printer_sources_are_independent(generator, monkeypatch):
+    monkeypatch.setenv("seed", "7")
+    serializer = generator.get_serializer("json")
+    sources = [generator.get_payload_source(index, None, serializer) for index in range(2)]
+
+    # every replay of a printer sends the same data, and every printer its own data
+    first_printer = list(sources[0]())
+    assert list(sources[0]()) == first_printer
+    assert list(sources[1]()) != first_printer
+    assert len(first_printer) == datalength
+
+    # reading a printer doesn't move the others forward
+    replays = [sources[0](), sources[1](), sources[0]()]
+    assert next(replays[0]) == next(replays[2]) == first_printer[0]
+    assert next(replays[0]) == first_printer[1]
+    assert next(replays[2]) == first_printer[1]
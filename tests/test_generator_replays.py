@@ -0,0 +1,91 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from aggregations import MultiResolutionAggregator, event_time
+from conftest import FakeState
+
+
+class Stop(Exception):
+    pass
+
+
+class FakeProducer:
+    """
+    Keeps the messages produced, and stops the generator once it has 'limit' of them.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.messages = []
+
+    def produce(self, topic, value, key=None, headers=None):
+        self.messages.append((key, json.loads(value)))
+        if len(self.messages) == self.limit:
+            raise Stop()
+
+
+@pytest.fixture
+def generator(load_service):
+    # the replays are sent as fast as possible, one right after the other
+    module = load_service("generator", datalength="120", replay_speed="1000000", tracing_enabled="false")
+    module.restart_delay = 0
+    return module
+
+
+def test_second_replay_is_aggregated(generator):
+    serializer = generator.get_serializer("json")
+    payloads = generator.encode_columns(serializer, generator.generate_data_vectorized(1))
+    producer = FakeProducer(2 * len(payloads))
+
+    with pytest.raises(Stop):
+        asyncio.run(generator.generate_data_async(SimpleNamespace(name="data"), producer, "Printer 1",
+                                                  lambda: payloads, serializer, 0))
+
+    aggregator = MultiResolutionAggregator(["hotend_temperature"], ["mean"], {"10s": 10_000, "1m": 60_000}, 0,
+                                           False, 0)
+    state = FakeState()
+    rows = []
+    for key, value in producer.messages:
+        rows.extend(aggregator.process(value, event_time(value, "timestamp", 0), key, state))
+
+    second_replay_start = event_time(producer.messages[len(payloads)][1], "timestamp", 0)
+    assert event_time(producer.messages[len(payloads) - 1][1], "timestamp", 0) < second_replay_start
+    assert not aggregator.dropped
+    # every message of both replays but the ones of the window still open, whatever the windows they start in
+    assert sum(row["count"] for row in rows if row["resolution"] == "10s") >= 2 * len(payloads) - 10
+
+
+def test_fleet_timestamps_go_on_across_replays(generator):
+    serializer = generator.get_serializer("json")
+    payloads = generator.encode_columns(serializer, generator.generate_data_vectorized(1))
+    printers = ["Printer 1", "Printer 2", "Printer 3"]
+    producer = FakeProducer(3 * 3 * len(payloads))
+
+    with pytest.raises(Stop):
+        asyncio.run(generator.publish_fleet("data", producer, printers, payloads, serializer, 1000000.0))
+
+    for printer in printers:
+        timestamps = [event_time(value, "timestamp", 0) for key, value in producer.messages if key == printer]
+        assert len(timestamps) > 2 * len(payloads)
+        assert all(earlier < later for earlier, later in zip(timestamps, timestamps[1:]))
+
+
+def test_fleet_target_rate_sends_every_printer_on_every_tick(generator, monkeypatch):
+    monkeypatch.setenv("target_messages_per_second", "10000")
+    printers = [f"Printer {i + 1}" for i in range(10)]
+    tick_rate = generator.get_fleet_tick_rate(len(printers))
+    serializer = generator.get_serializer("json")
+    payloads = generator.encode_columns(serializer, generator.generate_data_vectorized(1))
+    ticks = 3 * len(payloads)
+    producer = FakeProducer(ticks * len(printers))
+
+    with pytest.raises(Stop):
+        asyncio.run(generator.publish_fleet("data", producer, printers, payloads, serializer, tick_rate))
+
+    # as many messages as the target rate, whatever the data length: no printer is ever idle
+    assert tick_rate * len(printers) == 10000
+    for printer in printers:
+        assert sum(1 for key, value in producer.messages if key == printer) == ticks
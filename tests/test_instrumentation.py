@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+from conftest import root, service_folders
+from instrumentation import Instrumentation, null_metric, sized, timed
+
+
+def test_every_service_has_the_same_module():
+    copies = set()
+    for folder in service_folders.values():
+        with open(os.path.join(root, folder, "instrumentation.py"), "rb") as file:
+            copies.add(file.read())
+    assert len(copies) == 1
+
+
+def test_metrics_in_the_prometheus_format():
+    instrumentation = Instrumentation("sink")
+    messages = instrumentation.counter("messages_total", "Messages consumed")
+    alerts = instrumentation.counter("alerts_total", "Alerts", labels=("status",))
+    queue = instrumentation.gauge("queue_depth", "Batches waiting", function=lambda: 3)
+    sizes = instrumentation.histogram("batch_bytes", "Bytes per batch", [10, 100])
+
+    messages.inc()
+    messages.inc(2)
+    alerts.labels('under "forecast"').inc()
+    for size in (5, 10, 50, 500):
+        sizes.observe(size)
+    instrumentation.on_statistics(json.dumps({"topics": {"forecast": {"partitions": {
+        "0": {"consumer_lag": 12}, "1": {"consumer_lag": -1}, "-1": {"consumer_lag": 0}}}}}))
+
+    lines = instrumentation.render().splitlines()
+    assert "# TYPE sink_messages_total counter" in lines
+    assert "sink_messages_total 3" in lines
+    assert 'sink_alerts_total{status="under \\"forecast\\""} 1' in lines
+    assert "sink_queue_depth 3" in lines
+    assert 'sink_consumer_lag_messages{topic="forecast",partition="0"} 12' in lines
+    assert len([line for line in lines if line.startswith("sink_consumer_lag_messages")]) == 1
+    # cumulative buckets
+    assert [line for line in lines if line.startswith("sink_batch_bytes")] == [
+        'sink_batch_bytes_bucket{le="10"} 2', 'sink_batch_bytes_bucket{le="100"} 3',
+        'sink_batch_bytes_bucket{le="+Inf"} 4', "sink_batch_bytes_sum 565.0", "sink_batch_bytes_count 4"]
+
+    with pytest.raises(ValueError, match="already exists"):
+        instrumentation.counter("messages_total", "Messages consumed")
+
+
+def test_timed_and_sized_observe_the_calls():
+    instrumentation = Instrumentation("alerts")
+    seconds = instrumentation.histogram("processing_seconds", "Time to process")
+    sizes = instrumentation.histogram("state_bytes", "State sizes", [4, 8])
+
+    process = timed(lambda value: value * 2, seconds)
+    assert [process(value) for value in range(3)] == [0, 2, 4]
+    assert sum(seconds.counts) == 3 and seconds.sum > 0
+
+    # one call in every 2
+    dumps = sized(lambda value: "x" * value, sizes, 2)
+    assert [len(dumps(value)) for value in (3, 5, 9, 1)] == [3, 5, 9, 1]
+    assert sizes.counts == [1, 0, 1] and sizes.sum == 12  # the first and third calls
+
+
+def test_disabled_metrics_cost_nothing():
+    instrumentation = Instrumentation("forecast", enabled=False)
+    counter = instrumentation.counter("messages_total", "Messages", labels=("status",))
+    histogram = instrumentation.histogram("processing_seconds", "Time to process")
+    assert counter is null_metric and histogram is null_metric
+    counter.labels("sent").inc()
+    histogram.observe(1)
+
+    # the functions are not wrapped
+    function = len
+    assert timed(function, histogram) is function and sized(function, histogram) is function
+    assert instrumentation.consumer_config() == {}
+    assert instrumentation.render() == "\n"
@@ -0,0 +1,96 @@
+import math
+
+import pytest
+from influxdb_client_3 import Point
+
+from line_protocol import compile_line_builder, format_field_value
+
+timestamp = 1709304320000
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, -math.inf])
+def test_non_finite_floats_are_skipped(value):
+    build = compile_line_builder("Data", ["printer"], ["mean", "count"], "timestamp")
+    assert format_field_value(value) is None
+    assert build({"printer": "Printer 1", "mean": value, "count": 3, "timestamp": timestamp}) \
+        == f"Data,printer=Printer\\ 1 count=3i {timestamp}"
+    # a row with no other field has no line
+    assert build({"printer": "Printer 1", "mean": value, "timestamp": timestamp}) is None
+
+
+def split(text: str, separator: str) -> list:
+    """
+    Split a part of a line on 'separator', outside of escapes and quoted strings.
+    """
+    parts, current, quoted, escaped = [], "", False, False
+    for character in text:
+        if escaped:
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == '"':
+            quoted = not quoted
+        elif character == separator and not quoted:
+            parts.append(current)
+            current = ""
+            continue
+        current += character
+    return parts + [current]
+
+
+def parse(line: str):
+    """
+    The measurement, tags, fields and timestamp of a line, in the order the InfluxDB client's Point writes them:
+    sorted, and with the floats as numbers ('250' and '250.0' are the same float).
+    """
+    series, fields, timestamp = split(line, " ")
+    measurement, *tags = split(series, ",")
+    values = {}
+    for field in split(fields, ","):
+        key, value = split(field, "=")
+        if not (value.endswith("i") or value.startswith('"') or value in ("true", "false")):
+            value = float(value)
+        values[key] = value
+    return measurement, sorted(tags), values, int(timestamp)
+
+
+messages = [
+    {"printer": "Printer 1", "resolution": "1m", "mean_hotend_temperature": 250.0, "count": 60,
+     "timestamp": 1709304320000},
+    # escapes in the measurement, the keys and the values
+    {"printer": "Printer, \"3\"=x", "resolution": "", "mean_hotend_temperature": 1e-7, "count": -2,
+     "message": 'It\'s "hot"\\ ', "final": True, "timestamp": "2024-03-01 14:45:20"},
+    # missing and null values are skipped
+    {"printer": None, "mean_hotend_temperature": 249.123456789012, "timestamp": "2024-03-01T14:45:20.512"},
+    {"printer": "Printer 2", "resolution": "10s", "mean_hotend_temperature": None, "final": False,
+     "timestamp": 1709304320512},
+]
+
+
+@pytest.mark.parametrize("message", messages)
+def test_lines_are_the_ones_of_the_influxdb_client(message):
+    tag_keys = ["printer", "resolution"]
+    field_keys = ["mean_hotend_temperature", "count", "message", "final"]
+    build = compile_line_builder("3D printer, data", tag_keys, field_keys, "timestamp")
+    # the point the original sink wrote for the message
+    point = Point.from_dict({
+        "measurement": "3D printer, data",
+        "tags": {key: message[key] for key in tag_keys if key in message},
+        "fields": {key: message[key] for key in field_keys if key in message},
+        "time": message["timestamp"],
+    }, write_precision="ms")
+
+    assert parse(build(message)) == parse(point.to_line_protocol())
+
+
+def test_new_lines_are_escaped():
+    # the client writes them as they are in string fields, which would split the point in two lines
+    build = compile_line_builder("Data", ["printer"], ["message"], "timestamp")
+    assert build({"printer": "Printer\n1", "message": "a\nb", "timestamp": 1709304320000}) \
+        == 'Data,printer=Printer\\n1 message="a\\nb" 1709304320000'
+
+
+def test_message_without_fields_has_no_line():
+    build = compile_line_builder("Data", ["printer"], ["mean_hotend_temperature"], "timestamp")
+    assert build({"printer": "Printer 1", "timestamp": 1709304320000}) is None
+    assert build({"printer": "Printer 1", "mean_hotend_temperature": None, "timestamp": 1709304320000}) is None
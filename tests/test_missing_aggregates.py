@@ -0,0 +1,17 @@
+import logging
+
+
+def test_downsampling_without_mean_logs_an_error(load_service, caplog):
+    with caplog.at_level(logging.ERROR):
+        load_service("downsampling", aggregates="min,max")
+    assert "don't have mean" in caplog.text
+
+
+def test_forecast_logs_the_first_row_without_its_fields(load_service, caplog):
+    forecast = load_service("forecast", forecast_fields="mean_fluctuated_ambient_temperature:polynomial")
+    row = {"timestamp": 1709304320000, "printer": "Printer 1", "min_fluctuated_ambient_temperature": 74.0}
+    with caplog.at_level(logging.ERROR):
+        assert not forecast.has_forecast_fields(row)
+        assert not forecast.has_forecast_fields(row)
+    assert len(caplog.records) == 1 and "mean_fluctuated_ambient_temperature" in caplog.text
+    assert forecast.has_forecast_fields({**row, "mean_fluctuated_ambient_temperature": 74.0})
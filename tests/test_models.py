@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import rolling_history
+from conftest import FakeState
+from models import ARModel, HoltModel, PolynomialModel, create_model
+from rolling_history import HistoryStore
+
+printers = ["Printer 1", "Printer 2", "Printer 3"]
+capacity = 30
+length = 5
+
+
+def rows(count: int):
+    random = np.random.default_rng(3)
+    for step in range(count):
+        yield {"polynomial": 200 + 0.5 * step + random.normal(), "holt": 50 + random.normal(),
+               "ar": 10 + np.sin(step / 3) + 0.1 * random.normal()}
+
+
+def create_store(max_printers: int = 10000, ttl_seconds: float = 3600) -> HistoryStore:
+    # the Holt models see the full history, so a warm start replays everything they saw
+    return HistoryStore(capacity, {"polynomial": PolynomialModel, "holt": HoltModel,
+                                   "ar": lambda: ARModel(refit_interval=1)}, max_printers, ttl_seconds)
+
+
+def test_models_are_created_by_name():
+    model = create_model("polynomial", {"polynomial": {"degree": 3}, "holt": {"alpha": 0.2}})
+    assert isinstance(model, PolynomialModel) and model.degree == 3
+    assert isinstance(create_model("holt", {}), HoltModel)
+    assert create_model("ar", {"ar": {"order": 2}}).order == 2
+
+    with pytest.raises(ValueError, match="Unknown forecast model 'arima'"):
+        create_model("arima", {})
+
+
+def test_evicted_printers_are_warm_started():
+    cached, evicting = create_store(), create_store(max_printers=1)
+    states = {printer: (FakeState(), FakeState()) for printer in printers}
+
+    for row in rows(capacity - 1):
+        for printer in printers:
+            expected = cached.append(printer, states[printer][0], row)
+            models = evicting.append(printer, states[printer][1], row)
+            # every printer but the last one was evicted, its models were rebuilt from the state
+            assert len(evicting) == 1
+            if expected.is_ready():
+                forecasts = models.forecast(length)
+                for field, values in expected.forecast(length).items():
+                    np.testing.assert_allclose(forecasts[field], values, rtol=1e-9, err_msg=field)
+    assert len(cached) == len(printers)
+
+
+def test_unused_printers_expire(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(rolling_history.time, "monotonic", lambda: now[0])
+    store = create_store(ttl_seconds=60)
+    states = {printer: FakeState() for printer in printers}
+    row = next(rows(1))
+
+    store.append("Printer 1", states["Printer 1"], row)
+    now[0] = 30
+    store.append("Printer 2", states["Printer 2"], row)
+    now[0] = 61
+    store.append("Printer 3", states["Printer 3"], row)
+    assert len(store) == 2
+    now[0] = 100
+    store.append("Printer 3", states["Printer 3"], row)
+    assert len(store) == 1
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from recording import Recording, RecordingWriter
+
+fields = ["hotend_temperature", "bed_temperature", "ambient_temperature"]
+printers = ["Printer 1", "Printer 2"]
+
+
+def write(path, count: int) -> np.ndarray:
+    values = np.random.default_rng(0).normal(100, 10, (count, len(fields)))
+    with RecordingWriter(str(path), fields, printers, chunk_records=4) as writer:
+        for index in range(count):
+            writer.write(index % 2, 1709304320 + index // 2, values[index])
+    return values
+
+
+def read(path, chunk_records: int) -> np.ndarray:
+    with Recording(str(path)) as recording:
+        assert recording.fields == fields and recording.printers == printers
+        records = np.concatenate([chunk.copy() for chunk in recording.chunks(chunk_records)])
+    return records
+
+
+def test_records_round_trip(tmp_path):
+    path = tmp_path / "fleet.rec"
+    values = write(path, 11)
+
+    for chunk_records in (1, 3, 4096):
+        records = read(path, chunk_records)
+        assert records["printer"].tolist() == [index % 2 for index in range(11)]
+        assert records["timestamp"].tolist() == [1709304320 + index // 2 for index in range(11)]
+        np.testing.assert_array_equal(records["values"], values)
+
+
+def test_a_partial_record_is_ignored(tmp_path):
+    path = tmp_path / "fleet.rec"
+    values = write(path, 5)
+    # the file was copied while a record was being written
+    with open(path, "ab") as file:
+        file.write(b"\x00" * 12)
+
+    records = read(path, 2)
+    assert len(records) == 5
+    np.testing.assert_array_equal(records["values"], values)
+
+
+def test_other_files_are_not_recordings(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"timestamp,hotend_temperature\n")
+    with pytest.raises(ValueError, match="isn't a recording"):
+        Recording(str(path))
@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+
+from conftest import FakeState
+from models import PolynomialModel
+from rolling_history import HistoryStore, RollingHistory
+
+capacity = 20
+length = 5
+
+
+def rows(count: int, start: int = 0):
+    random = np.random.default_rng(start)
+    for step in range(start, start + count):
+        yield {"hotend": 200 + 0.5 * step + random.normal(), "bed": 100 - 0.2 * step + random.normal()}
+
+
+def create_store() -> HistoryStore:
+    return HistoryStore(capacity, {"hotend": PolynomialModel, "bed": lambda: PolynomialModel(degree=1)})
+
+
+def assert_same_forecasts(actual: dict, expected: dict):
+    assert actual.keys() == expected.keys()
+    for field in expected:
+        np.testing.assert_allclose(actual[field], expected[field], rtol=1e-9)
+
+
+def test_ring_buffer_keeps_the_last_values_in_order():
+    history = RollingHistory(3)
+    assert [history.append(value) for value in [1, 2, 3]] == [None, None, None]
+    assert history.to_array().tolist() == [1, 2, 3]
+    assert history.append(4) == 1
+    assert history.append(5) == 2
+    assert history.to_array().tolist() == [3, 4, 5]
+    assert history.last() == 5 and len(history) == 3
+
+
+def test_restarted_store_forecasts_from_the_state():
+    state = FakeState()
+    store = create_store()
+    # more rows than the capacity, the histories wrapped around
+    for row in rows(capacity + 7):
+        store.append("Printer 1", state, row)
+
+    # a restart keeps the state only
+    restarted_state = copy.deepcopy(state)
+    restarted = create_store()
+    row = next(rows(1, capacity + 7))
+    expected = store.append("Printer 1", state, row)
+    models = restarted.append("Printer 1", restarted_state, row)
+
+    assert restarted_state.values == state.values
+    for field in expected.histories:
+        assert models.histories[field].to_array().tolist() == expected.histories[field].to_array().tolist()
+    assert_same_forecasts(models.forecast(length), expected.forecast(length))
+
+
+def test_histories_written_somewhere_else_are_read_back():
+    state = FakeState()
+    store, other = create_store(), create_store()
+    for row in rows(10):
+        store.append("Printer 1", state, row)
+    # the partition was processed by another consumer in the meantime, then assigned back
+    for row in rows(5, 10):
+        other.append("Printer 1", state, row)
+
+    row = next(rows(1, 15))
+    expected = other.append("Printer 1", copy.deepcopy(state), row)
+    models = store.append("Printer 1", state, row)
+    assert models.histories["hotend"].appended == 16
+    assert_same_forecasts(models.forecast(length), expected.forecast(length))
@@ -0,0 +1,103 @@
+import pytest
+
+from rules import NORMAL, OVER, UNDER, RuleEngine, load_rules, parse_rules
+
+
+def horizon(forecasts, current, start_minute: int = 0):
+    """
+    The rows of a forecast of the ambient temperature, a minute apart, with its current value.
+    """
+    return [{"timestamp": (start_minute + i) * 60000, "forecast_mean_fluctuated_ambient_temperature": value,
+             "current_mean_fluctuated_ambient_temperature": current} for i, value in enumerate(forecasts)]
+
+
+def test_default_rules_only_alert_on_the_forecast():
+    engine = RuleEngine(load_rules(""))
+    assert [(rule.type, rule.source) for rule in engine.rules] == [("threshold", "forecast")]
+
+    # the current value is out of the limits, not the forecast
+    states, alerts = engine.evaluate(horizon([74.0, 74.0, 74.0], current=70.0), [NORMAL])
+    assert states == [NORMAL] and alerts == []
+
+    states, alerts = engine.evaluate(horizon([74.0, 72.5, 72.0], current=74.0), [NORMAL])
+    assert states == [UNDER] and alerts == [(0, UNDER, 1, 72.5)]
+    assert engine.to_alert(horizon([74.0, 72.5, 72.0], current=74.0), *alerts[0])["status"] == "under-forecast"
+
+
+def test_current_value_rules_are_enabled_by_the_config():
+    rules = load_rules('[{"type": "threshold", "source": "now", "parameter": "mean_fluctuated_ambient_temperature",'
+                       ' "parameter_name": "ambient_temperature", "high": 75}]')
+    engine = RuleEngine(rules)
+    states, alerts = engine.evaluate(horizon([74.0, 74.0], current=76.0), [NORMAL])
+    assert states == [OVER] and alerts == [(0, OVER, 0, 76.0)]
+    assert engine.to_alert(horizon([74.0, 74.0], current=76.0), *alerts[0])["status"] == "over-now"
+
+
+def test_rules_go_back_to_normal_past_the_hysteresis():
+    engine = RuleEngine(parse_rules([{"parameter": "mean_fluctuated_ambient_temperature", "low": 73, "high": 75,
+                                      "hysteresis": 0.5}]))
+    states, alerts = engine.evaluate(horizon([74.0, 75.5], current=74.0), [NORMAL])
+    assert states == [OVER] and len(alerts) == 1
+
+    # still over, or back within the limits but not by the hysteresis: no new alert and no way back
+    for forecasts in ([76.0, 77.0], [74.8, 74.9]):
+        states, alerts = engine.evaluate(horizon(forecasts, current=74.0), states)
+        assert states == [OVER] and alerts == []
+
+    states, alerts = engine.evaluate(horizon([74.5, 74.0], current=74.0), states)
+    assert states == [NORMAL] and alerts == []
+    states, alerts = engine.evaluate(horizon([74.0, 75.5], current=74.0), states)
+    assert states == [OVER] and len(alerts) == 1
+
+
+def test_the_first_crossing_of_the_horizon_decides():
+    engine = RuleEngine(parse_rules([{"parameter": "mean_fluctuated_ambient_temperature", "low": 73, "high": 75}]))
+    states, alerts = engine.evaluate(horizon([74.0, 72.0, 76.0], current=74.0), [NORMAL])
+    assert states == [UNDER] and alerts == [(0, UNDER, 1, 72.0)]
+    # from under straight to over
+    states, alerts = engine.evaluate(horizon([76.0, 72.0], current=74.0), states)
+    assert states == [OVER] and alerts == [(0, OVER, 0, 76.0)]
+
+
+def test_rate_rules():
+    engine = RuleEngine(parse_rules([
+        {"type": "rate", "parameter": "mean_fluctuated_ambient_temperature", "max_rise_per_minute": 1},
+        {"type": "rate", "source": "now", "parameter": "mean_fluctuated_ambient_temperature",
+         "max_fall_per_minute": 2},
+    ]))
+    # the forecast rises 0.5 then 1.5ºC a minute
+    first = horizon([74.0, 74.5, 76.0], current=74.0)
+    states, alerts = engine.evaluate(first, [NORMAL, NORMAL])
+    assert states == [OVER, NORMAL] and alerts == [(0, OVER, 2, 1.5)]
+    assert engine.to_alert(first, *alerts[0])["status"] == "rising-forecast"
+    assert engine.to_alert(first, *alerts[0])["rate"] == 1.5
+
+    # the current value fell 3ºC in a minute since the previous forecast
+    second = horizon([71.0, 71.0, 71.0], current=71.0, start_minute=1)
+    states, alerts = engine.evaluate(second, states, previous=first[0])
+    assert states == [NORMAL, UNDER] and alerts == [(1, UNDER, 0, -3.0)]
+    assert engine.to_alert(second, *alerts[0])["status"] == "falling-now"
+
+
+def test_rules_of_several_parameters_are_evaluated_together():
+    engine = RuleEngine(parse_rules([
+        {"parameter": "mean_fluctuated_ambient_temperature", "low": 73, "high": 75},
+        {"parameter": "mean_hotend_temperature", "parameter_name": "hotend_temperature", "label": "Hotend",
+         "high": 260},
+    ]))
+    assert engine.columns == ["timestamp", "forecast_mean_fluctuated_ambient_temperature",
+                              "forecast_mean_hotend_temperature"]
+    rows = [{**row, "forecast_mean_hotend_temperature": hotend}
+            for row, hotend in zip(horizon([74.0, 74.0], current=74.0), [255.0, 262.0])]
+    # a row without the parameter of a rule doesn't move it
+    rows.append(horizon([72.0], current=74.0, start_minute=2)[0])
+    states, alerts = engine.evaluate([engine.compact(row) for row in rows], [NORMAL, NORMAL])
+    assert states == [UNDER, OVER] and alerts == [(0, UNDER, 2, 72.0), (1, OVER, 1, 262.0)]
+    alert = engine.to_alert(rows, *alerts[1])
+    assert alert["parameter_name"] == "hotend_temperature"
+    assert alert["message"] == "'Hotend' is forecasted to go over 260ºC at 60000."
+
+
+def test_unknown_rules_are_rejected():
+    with pytest.raises(ValueError):
+        parse_rules([{"type": "threshold", "source": "yesterday", "parameter": "mean_hotend_temperature"}])
@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from serializers import encode_columns, get_serializer
+from wire_format import BINARY_V1, WIRE_FORMAT_HEADER, BinaryDecoder
+
+columns = {
+    "hotend_temperature": np.array([250.5, 249.25, -0.125]),
+    "bed_temperature": np.array([110.0, 1e-7, 109.5]),
+}
+timestamp = datetime(2024, 3, 1, 14, 5, 20, 250000).timestamp()
+
+
+def decode(name: str, message: bytes) -> dict:
+    return json.loads(message) if name == "json" else BinaryDecoder().decode(message)
+
+
+@pytest.mark.parametrize("name", ["json", "binary"])
+def test_spliced_messages_have_all_the_fields(name):
+    serializer = get_serializer(name)
+    payloads = encode_columns(serializer, columns)
+    printer = serializer.encode_printer("Imprimante 2 — ºC")
+
+    assert len(payloads) == 3
+    for position, values in enumerate(payloads):
+        # the same encoded values with any timestamp
+        for seconds in (0, 3600):
+            message = decode(name, serializer.encode(values, printer, timestamp + seconds))
+            iso_timestamp = datetime.fromtimestamp(timestamp + seconds).isoformat()
+            assert message == {"hotend_temperature": columns["hotend_temperature"][position],
+                               "bed_temperature": columns["bed_temperature"][position],
+                               "timestamp": iso_timestamp, "original_timestamp": iso_timestamp,
+                               "printer": "Imprimante 2 — ºC"}
+
+
+def test_binary_messages_have_the_wire_format_header():
+    assert get_serializer("binary").headers == {WIRE_FORMAT_HEADER: BINARY_V1}
+    assert get_serializer("json").headers is None
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError, match="Unknown serializer"):
+        get_serializer("avro")
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+from quixstreams import Application
+
+import write_buffer
+from write_buffer import WriteBuffer
+
+topic = "downsampled-3d-printer-data"
+
+
+class FakeMessage:
+    """
+    A consumed Kafka message with a JSON value.
+    """
+
+    def __init__(self, value, partition: int, offset: int):
+        self._value = value if isinstance(value, bytes) else json.dumps(value).encode()
+        self._partition = partition
+        self._offset = offset
+
+    def __len__(self):
+        return len(self._value)
+
+    def value(self):
+        return self._value
+
+    def key(self):
+        return b"Printer 1"
+
+    def headers(self):
+        return None
+
+    def timestamp(self):
+        return 1, 1709304320000
+
+    def topic(self):
+        return topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def latency(self):
+        return None
+
+    def leader_epoch(self):
+        return None
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(write_buffer.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_the_batch_is_ready_at_the_size_the_bytes_or_the_linger(clock):
+    buffer = WriteBuffer(batch_size=3, max_bytes=1000, linger_seconds=1)
+    assert not buffer.is_ready()
+    buffer.append("a value=1i")
+    buffer.append("a value=2i")
+    assert not buffer.is_ready()
+    buffer.append("a value=3i")
+    assert buffer.is_ready()
+    assert len(buffer.take().lines) == 3
+    assert len(buffer) == 0 and buffer.size_bytes == 0
+
+    buffer = WriteBuffer(batch_size=100, max_bytes=22, linger_seconds=1)
+    buffer.append("a value=1i")
+    assert buffer.size_bytes == 11 and not buffer.is_ready()
+    buffer.append("a value=2i")
+    assert buffer.is_ready()
+
+    # the linger starts at the first line of the batch
+    buffer = WriteBuffer(batch_size=100, max_bytes=1000, linger_seconds=1)
+    clock[0] += 5
+    buffer.append("a value=1i")
+    clock[0] += 0.5
+    assert not buffer.is_ready()
+    clock[0] += 0.5
+    assert buffer.is_ready()
+    buffer.take()
+    assert not buffer.is_ready()
+
+
+def test_messages_without_lines_are_committed_too(clock):
+    buffer = WriteBuffer(batch_size=100, max_bytes=1000, linger_seconds=1)
+    buffer.track_offset(topic, 0, 5)
+    buffer.append("a value=1i")
+    buffer.track_offset(topic, 0, 6)
+    buffer.track_offset(topic, 1, 40)
+    clock[0] += 1
+    assert buffer.is_ready()
+
+    batch = buffer.take()
+    assert batch.lines == ["a value=1i"]
+    assert batch.offsets == {(topic, 0): (5, 7), (topic, 1): (40, 41)}
+    assert buffer.take().offsets == {}
+
+
+def test_process_message(load_service):
+    sink = load_service("sink", input=topic, INFLUXDB_HOST="http://localhost:8181", INFLUXDB_TOKEN="token",
+                        INFLUXDB_ORG="org", INFLUXDB_DATABASE="database", INFLUXDB_MEASUREMENT_NAME="printers",
+                        INFLUXDB_TAG_KEYS="['printer']", INFLUXDB_FIELD_KEYS="['mean_hotend_temperature']",
+                        INFLUXDB_LATENCY_MEASUREMENT="")
+    input_topic = sink.create_input_topic(Application(broker_address="localhost:9092"))
+    buffer = WriteBuffer(batch_size=100, max_bytes=1000, linger_seconds=1)
+
+    messages = [
+        FakeMessage({"timestamp": 1709304320000, "printer": "Printer 1", "mean_hotend_temperature": 249.5}, 0, 10),
+        FakeMessage({"printer": "Printer 1", "mean_hotend_temperature": 249.5}, 0, 11),  # no timestamp
+        FakeMessage(b"{not json", 0, 12),
+    ]
+    for message in messages:
+        sink.process_message(buffer, message, input_topic)
+
+    batch = buffer.take()
+    assert batch.lines == ["printers,printer=Printer\\ 1 mean_hotend_temperature=249.5 1709304320000"]
+    # the skipped and invalid messages are still committed after the lines before them
+    assert batch.offsets == {(topic, 0): (10, 13)}
+    assert (sink.message_metrics.consumed, sink.message_metrics.points,
+            sink.message_metrics.skipped, sink.message_metrics.invalid) == (3, 1, 1, 1)
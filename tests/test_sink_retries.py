@@ -0,0 +1,197 @@
+import os
+
+from confluent_kafka import TopicPartition
+
+from retry import Backoff, CommitTracker, RetryingWriter, SpillFile
+from write_buffer import Batch
+
+topic = "downsampled-3d-printer-data"
+
+
+class FlakyInfluxDB:
+    """
+    Keeps the lines written, and fails every write while it's down.
+    """
+
+    def __init__(self):
+        self.down = False
+        self.status = None  # of the errors, None for connection errors
+        self.lines = []
+
+    def write(self, lines):
+        if self.down:
+            error = ConnectionError("InfluxDB is down")
+            error.status = self.status
+            raise error
+        self.lines.extend(lines)
+
+
+def batch(name: str, partition: int, first_offset: int, next_offset: int) -> Batch:
+    return Batch([f"{name},printer=Printer\\ 1 value=1i"], {(topic, partition): (first_offset, next_offset)})
+
+
+def offsets(partitions) -> list:
+    return sorted((partition.topic, partition.partition, partition.offset) for partition in partitions)
+
+
+def create_writer(influxdb: FlakyInfluxDB, max_queued_batches: int = 10, spill: SpillFile = None) -> RetryingWriter:
+    # retried as soon as 'process' is called
+    return RetryingWriter(influxdb.write, Backoff(0, 0), max_queued_batches, spill)
+
+
+def test_offsets_wait_for_the_failed_batches():
+    influxdb = FlakyInfluxDB()
+    writer = create_writer(influxdb)
+    writer.submit(batch("first", 0, 0, 10))
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 10)]
+
+    influxdb.down = True
+    writer.submit(batch("second", 0, 10, 20))
+    writer.submit(batch("third", 0, 20, 30))
+    writer.process()
+    assert offsets(writer.commit_offsets()) == []  # still 10
+    assert writer.metrics.queue_depth == 2
+
+    influxdb.down = False
+    writer.process()
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 20)]
+    writer.process()
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 30)]
+    assert offsets(writer.commit_offsets()) == []  # only the offsets that changed
+    assert [line.split(",")[0] for line in influxdb.lines] == ["first", "second", "third"]
+    assert writer.metrics.failed_writes == 2 and writer.metrics.retries == 3
+
+
+def test_partitions_are_committed_apart():
+    influxdb = FlakyInfluxDB()
+    writer = create_writer(influxdb)
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("first", 1, 0, 5))
+    influxdb.down = True
+    writer.submit(batch("second", 0, 10, 20))
+    # a batch of both partitions waits behind the failed one
+    writer.submit(Batch(["third value=1i"], {(topic, 0): (20, 30), (topic, 1): (5, 8)}))
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 10), (topic, 1, 5)]
+
+    # the partition 0 is assigned to another consumer, its lines are still written
+    writer.drop_partitions([TopicPartition(topic, 0)])
+    influxdb.down = False
+    writer.process()
+    writer.process()
+    assert offsets(writer.commit_offsets()) == [(topic, 1, 8)]
+    assert len(influxdb.lines) == 4
+
+
+def test_rejected_batches_are_dropped_and_committed():
+    influxdb = FlakyInfluxDB()
+    writer = create_writer(influxdb)
+    influxdb.down, influxdb.status = True, 400
+    writer.submit(batch("invalid", 0, 0, 10))
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 10)]
+    assert writer.metrics.dropped_points == 1 and writer.metrics.queue_depth == 0
+
+    # too many requests, retried
+    influxdb.status = 429
+    writer.submit(batch("throttled", 0, 10, 20))
+    assert writer.metrics.queue_depth == 1
+
+
+def test_overflow_is_spilled_and_replayed(tmp_path):
+    influxdb = FlakyInfluxDB()
+    spill = SpillFile(str(tmp_path / "spill" / "influxdb-spill.lp"), 1024 * 1024)
+    writer = create_writer(influxdb, max_queued_batches=1, spill=spill)
+    influxdb.down = True
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("second", 0, 10, 20))
+    writer.submit(batch("third", 0, 20, 30))
+    # the spilled batches are safe on disk, but not past the one queued in memory
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 0)]
+    assert writer.metrics.spilled_batches == 2 and writer.metrics.spill_bytes > 0
+
+    influxdb.down = False
+    writer.process()
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 30)]
+    writer.process()
+    writer.process()
+    assert [line.split(",")[0] for line in influxdb.lines] == ["first", "second", "third"]
+    assert writer.metrics.replayed_batches == 2
+    assert not os.path.exists(spill.path) and writer.metrics.spill_bytes == 0
+
+
+def test_replay_fails_and_resumes(tmp_path):
+    influxdb = FlakyInfluxDB()
+    spill = SpillFile(str(tmp_path / "influxdb-spill.lp"), 1024 * 1024)
+    writer = create_writer(influxdb, max_queued_batches=0, spill=spill)
+    influxdb.down = True
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("second", 0, 10, 20))
+    writer.process()  # the replay of the first one fails, it stays in the file
+    assert writer.metrics.replayed_batches == 0
+
+    influxdb.down = False
+    writer.process()
+    writer.process()
+    writer.process()
+    assert [line.split(",")[0] for line in influxdb.lines] == ["first", "second"]
+
+
+def test_queued_batches_are_replayed_after_a_restart(tmp_path):
+    path = str(tmp_path / "influxdb-spill.lp")
+    influxdb = FlakyInfluxDB()
+    writer = create_writer(influxdb, spill=SpillFile(path, 1024 * 1024))
+    influxdb.down = True
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("second", 0, 10, 20))
+    writer.close()
+    # once spilled, their offsets are committed
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 20)]
+
+    influxdb.down = False
+    restarted = create_writer(influxdb, spill=SpillFile(path, 1024 * 1024))
+    restarted.process()
+    restarted.process()
+    assert [line.split(",")[0] for line in influxdb.lines] == ["first", "second"]
+    assert not os.path.exists(path)
+
+
+def test_batches_past_a_full_spill_file_are_consumed_again(tmp_path):
+    influxdb = FlakyInfluxDB()
+    spill = SpillFile(str(tmp_path / "influxdb-spill.lp"), 60)
+    writer = create_writer(influxdb, max_queued_batches=0, spill=spill)
+    influxdb.down = True
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("second", 0, 10, 20))
+    assert writer.metrics.spilled_batches == 1 and writer.metrics.dropped_points == 1
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 10)]
+
+    # the batches written later don't move the offsets past the one not written
+    influxdb.down = False
+    writer.process()
+    writer.submit(batch("third", 0, 20, 30))
+    assert offsets(writer.commit_offsets()) == []
+    assert [line.split(",")[0] for line in influxdb.lines] == ["first", "third"]
+
+
+def test_queued_batches_are_consumed_again_after_a_close_without_spill_file():
+    influxdb = FlakyInfluxDB()
+    writer = create_writer(influxdb)
+    writer.submit(batch("first", 0, 0, 10))
+    writer.submit(batch("first", 1, 0, 10))
+    influxdb.down = True
+    writer.submit(batch("second", 0, 10, 20))
+    writer.submit(batch("third", 0, 20, 30))
+    writer.close()
+
+    assert offsets(writer.commit_offsets()) == [(topic, 0, 10), (topic, 1, 10)]
+    assert offsets(writer.commit_offsets()) == []
+    assert writer.metrics.queue_depth == 0 and writer.metrics.dropped_points == 2
+
+
+def test_commit_tracker_never_passes_a_pending_batch():
+    tracker = CommitTracker()
+    pending = [batch("second", 0, 10, 20)]
+    tracker.done(batch("third", 0, 20, 30))
+    tracker.done(batch("first", 0, 0, 10))  # written out of order
+    assert offsets(tracker.commit_offsets(pending)) == [(topic, 0, 10)]
+    tracker.done(pending.pop())
+    assert offsets(tracker.commit_offsets(pending)) == [(topic, 0, 30)]
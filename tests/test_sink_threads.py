@@ -0,0 +1,96 @@
+import threading
+import time
+
+from writer import ThreadedWriter
+from write_buffer import Batch
+
+topic = "downsampled-3d-printer-data"
+
+
+class GatedInfluxDB:
+    """
+    Holds the writes of the batches named in 'blocked' until they are released, fails them all while it's down.
+    """
+
+    def __init__(self, blocked=()):
+        self.gates = {name: threading.Event() for name in blocked}
+        self.down = False
+        self.written = []
+        self._lock = threading.Lock()
+
+    def write(self, lines):
+        name = lines[0].split(",")[0]
+        if name in self.gates:
+            self.gates[name].wait()
+        if self.down:
+            raise ConnectionError("InfluxDB is down")
+        with self._lock:
+            self.written.append(name)
+
+
+def batch(name: str, first_offset: int, next_offset: int) -> Batch:
+    return Batch([f"{name},printer=Printer\\ 1 value=1i"], {(topic, 0): (first_offset, next_offset)})
+
+
+def committed(writer: ThreadedWriter) -> list:
+    return [partition.offset for partition in writer.commit_offsets()]
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_offsets_wait_for_the_slower_batches():
+    influxdb = GatedInfluxDB(blocked=["first"])
+    writer = ThreadedWriter(influxdb.write, 2, 10, 0, 0)
+    writer.submit(batch("first", 0, 10))
+    writer.submit(batch("second", 10, 20))
+
+    # the second batch is written while the first one waits, its offsets wait for the first one
+    wait_until(lambda: influxdb.written == ["second"])
+    assert committed(writer) == [0]
+
+    influxdb.gates["first"].set()
+    wait_until(lambda: writer.metrics.queue_depth == 0)
+    assert committed(writer) == [20]
+    writer.close()
+    assert writer.metrics.written_batches == 2
+
+
+def test_the_consumer_pauses_until_half_the_batches_are_written():
+    influxdb = GatedInfluxDB(blocked=["first", "second", "third", "fourth"])
+    writer = ThreadedWriter(influxdb.write, 4, 4, 0, 0)
+    for offset, name in enumerate(["first", "second", "third"]):
+        writer.submit(batch(name, offset, offset + 1))
+    assert not writer.is_full() and not writer.has_room()
+    writer.submit(batch("fourth", 3, 4))
+    assert writer.is_full()
+
+    influxdb.gates["first"].set()
+    wait_until(lambda: writer.metrics.queue_depth == 3)
+    assert not writer.is_full() and not writer.has_room()
+    influxdb.gates["second"].set()
+    wait_until(lambda: writer.metrics.queue_depth == 2)
+    assert writer.has_room()
+
+    for gate in influxdb.gates.values():
+        gate.set()
+    writer.close()
+
+
+def test_batches_not_written_on_close_are_not_committed():
+    influxdb = GatedInfluxDB()
+    writer = ThreadedWriter(influxdb.write, 1, 10, 0.001, 0.01)
+    writer.submit(batch("first", 0, 10))
+    wait_until(lambda: influxdb.written == ["first"])
+    influxdb.down = True
+    writer.submit(batch("second", 10, 20))
+    wait_until(lambda: writer.metrics.failed_writes > 0)
+
+    writer.close(timeout=0.05)
+    # consumed again after a restart
+    assert committed(writer) == [10]
+    assert writer.metrics.queue_depth == 1
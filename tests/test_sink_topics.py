@@ -0,0 +1,16 @@
+from unittest import mock
+
+from quixstreams import Application
+
+
+def test_the_consumer_sets_up_the_input_topic(load_service, monkeypatch):
+    # the sink consumes without app.run, its topics must still be created and validated
+    sink = load_service("sink", input="downsampled-3d-printer-data", INFLUXDB_HOST="http://localhost:8181",
+                        INFLUXDB_TOKEN="token", INFLUXDB_ORG="org", INFLUXDB_DATABASE="database")
+    app = Application(broker_address="localhost:9092", consumer_group="influxdb-data-writer", auto_create_topics=True)
+    input_topic = sink.create_input_topic(app)
+
+    with mock.patch.object(Application, "_setup_topics") as setup_topics, mock.patch("quixstreams.app.Consumer"):
+        app.get_consumer()
+    setup_topics.assert_called_once()
+    assert [topic.name for topic in app._topic_manager.all_topics] == [input_topic.name]
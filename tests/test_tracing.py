@@ -0,0 +1,55 @@
+import json
+import os
+
+from quixstreams.models.serializers import SerializationContext
+
+import tracing
+from conftest import root, service_folders
+from tracing import TRACE_FIELD, TRACE_HEADER, TracingSerializer, parse_trace, read_trace, start_trace, \
+    traced_serializer
+
+
+def test_every_service_has_the_same_module():
+    copies = set()
+    for folder in service_folders.values():
+        with open(os.path.join(root, folder, "tracing.py"), "rb") as file:
+            copies.add(file.read())
+    assert len(copies) == 1
+
+
+def test_a_trace_goes_through_the_services(monkeypatch):
+    clock = iter([1709304320512, 1709304320530, 1709304320561])
+    monkeypatch.setattr(tracing, "now_ms", lambda: next(clock))
+
+    headers = start_trace({"wire_format": "binary-v1"}, "generator")
+    assert headers == {"wire_format": "binary-v1", TRACE_HEADER: "generator=1709304320512"}
+
+    serializer = TracingSerializer("downsampling", tracing.JSONSerializer())
+    # the headers of a consumed message are a list of tuples with bytes values
+    consumed = [("wire_format", b"binary-v1"), (TRACE_HEADER, headers[TRACE_HEADER].encode())]
+    assert json.loads(serializer({"count": 1}, SerializationContext("raw", consumed))) == {"count": 1}
+    trace = serializer.extra_headers[TRACE_HEADER]
+
+    # a row carrying its own trace, the field isn't written
+    serializer = TracingSerializer("forecast", tracing.JSONSerializer())
+    row = {"count": 1, TRACE_FIELD: trace}
+    assert json.loads(serializer(row, SerializationContext("downsampled", None))) == {"count": 1}
+    trace = serializer.extra_headers[TRACE_HEADER]
+
+    assert read_trace({TRACE_HEADER: trace}) == trace
+    assert parse_trace(trace) == [("generator", 1709304320512), ("downsampling", 1709304320530),
+                                  ("forecast", 1709304320561)]
+
+
+def test_rows_without_a_trace_are_produced_without_one():
+    serializer = TracingSerializer("alerts", tracing.JSONSerializer())
+    serializer({"status": "normal"}, SerializationContext("forecast", [("wire_format", b"json")]))
+    assert TRACE_HEADER not in serializer.extra_headers
+    assert read_trace(None) is None
+
+
+def test_disabled_tracing_keeps_the_serializer(monkeypatch):
+    monkeypatch.setenv("tracing_enabled", "false")
+    assert traced_serializer("json", "alerts") == "json"
+    monkeypatch.setenv("tracing_enabled", "true")
+    assert isinstance(traced_serializer("json", "alerts"), TracingSerializer)
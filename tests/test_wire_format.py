@@ -0,0 +1,89 @@
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+from quixstreams.models.serializers import SerializationContext, SerializationError
+
+from conftest import root, service_folders
+from wire_format import BINARY_V1, BinaryDecoder, BinaryEncoder, WireDeserializer, WireSerializer, field_names
+
+rows = [
+    {"timestamp": 1709304320000, "printer": "Printer 1", "hotend_temperature": 250.1, "final": True},
+    # nulls take no space, the fields after them are still read
+    {"timestamp": 1709304320000, "printer": None, "mean_bed_temperature": None, "count": 3, "final": False},
+    {"status": None},
+    # names that have no id are written in full, in any script
+    {"printer": "Printer 2", "trace": "00-abc-01", "température ambiante": -3.5, "": 0, "x" * 255: "long name"},
+    # empty, non-ASCII and the longest strings
+    {"message": "", "printer": "Imprimante 3 — ºC", "parameter_name": "a" * 65535},
+    {},
+]
+
+
+def test_field_ids_fit_in_a_byte():
+    assert len(field_names) < 256
+    assert len(set(field_names)) == len(field_names)
+
+
+@pytest.mark.parametrize("row", rows)
+def test_rows_round_trip(row):
+    encoder, decoder = BinaryEncoder(), BinaryDecoder()
+    # twice, the second time with the layouts compiled by the first
+    for _ in range(2):
+        decoded = decoder.decode(encoder.encode(row))
+        assert decoded == row
+        # the nulls are read after the other fields
+        assert {name: type(decoded[name]) for name in row} == {name: type(value) for name, value in row.items()}
+
+
+def test_numpy_scalars_are_written_as_their_python_type():
+    row = {"timestamp": np.int64(1709304320000), "count": np.int32(7), "mean_hotend_temperature": np.float64(250.25),
+           "min_hotend_temperature": np.float32(249.5), "forecast": np.float64("nan")}
+    decoded = BinaryDecoder().decode(BinaryEncoder().encode(row))
+
+    assert decoded["timestamp"] == 1709304320000 and type(decoded["timestamp"]) is int
+    assert decoded["count"] == 7 and type(decoded["count"]) is int
+    assert decoded["mean_hotend_temperature"] == 250.25 and type(decoded["mean_hotend_temperature"]) is float
+    assert decoded["min_hotend_temperature"] == 249.5
+    assert math.isnan(decoded["forecast"])
+
+
+def test_same_fields_with_other_types_get_their_own_layout():
+    encoder, decoder = BinaryEncoder(), BinaryDecoder()
+    for row in ({"forecast": 1.5, "printer": "Printer 1"}, {"forecast": None, "printer": "Printer 1"},
+                {"forecast": 2, "printer": None}, {"forecast": 1.5, "printer": "Printer 10"}):
+        assert decoder.decode(encoder.encode(row)) == row
+
+
+def test_serializer_headers_select_the_format():
+    serializer, deserializer = WireSerializer(), WireDeserializer()
+    row = {"printer": "Printer 1", "alert_temperature": None, "unknown_field": 1}
+    headers = list(serializer.extra_headers.items())
+    assert headers == [("wire_format", BINARY_V1)]
+
+    binary = serializer(row, SerializationContext("alerts"))
+    assert deserializer(binary, SerializationContext("alerts", headers)) == row
+    # JSON with its header or without any, like the messages of producers not migrated yet
+    assert deserializer(json.dumps(row).encode(), SerializationContext("alerts", [("wire_format", b"json")])) == row
+    assert deserializer(json.dumps(row).encode(), SerializationContext("alerts")) == row
+
+
+def test_errors_are_serialization_errors():
+    with pytest.raises(SerializationError):
+        WireSerializer()({"printer": ["not", "a", "scalar"]}, SerializationContext("data"))
+    with pytest.raises(SerializationError):
+        WireSerializer()({"message": "a" * 65536}, SerializationContext("data"))
+    with pytest.raises(SerializationError):
+        WireDeserializer()(b"\xb1\x05\x00d", SerializationContext("data", [("wire_format", BINARY_V1)]))
+    with pytest.raises(SerializationError):
+        WireDeserializer()(b"{}", SerializationContext("data", [("wire_format", "binary-v9")]))
+
+
+def test_every_service_has_the_same_module():
+    copies = set()
+    for folder in service_folders.values():
+        with open(os.path.join(root, folder, "wire_format.py"), "rb") as file:
+            copies.add(file.read())
+    assert len(copies) == 1